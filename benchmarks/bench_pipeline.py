@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the request pipeline.
+
+Synthetic sources.yml, ressources.yml and acl.yml files and a plugins
+module are generated in a temporary directory, then are timed:
+- the loading of each configuration file and of a PluginsRunner
+- each check, the decoding and the compiled validation plan
+- the plugin loading, data_or_errors and a call from the dispatch table
+- whole requests on the single source, multiple sources and all paths
+
+Run from the repository root: ::
+
+    $> python benchmarks/bench_pipeline.py --sources 50 --plugins 5
+    $> python benchmarks/bench_pipeline.py --json results.json
+
+Timings are given in microseconds per call.
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import collections
+import datetime
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from excalibur.check import CheckACL, CheckArguments, CheckRequest,\
+    CheckSource
+from excalibur.core import PluginsRunner, Query
+from excalibur.decode import DecodeArguments
+from excalibur.loader import ConfigurationLoader
+from excalibur.utils import ALL_KEYWORD, SOURCE_SEPARATOR, call_plugin,\
+    data_or_errors, monotonic
+
+PLUGINS_MODULE = "excalibur_bench_plugins"
+RESSOURCE = "actions"
+METHOD = "action1"
+REMOTE_IP = "10.1.2.3"
+# every source accepts this key, so that one signature matches them all
+SHARED_API_KEY = "SHAREDS3CR3T"
+VALUES = ("excalibur", "caliburn", "durandal", "joyeuse")
+
+PLUGIN_TEMPLATE = '''
+class %(name)s(object):
+
+    def %(function)s(self, parameters, *args, **kwargs):
+        return parameters.get("token")
+'''
+
+
+def source_name(index):
+    return "source%d" % index
+
+
+def plugin_name(index):
+    return "Plugin%d" % index
+
+
+def argument_name(index):
+    return "argument%d" % index
+
+
+def yaml_dump(value, indent=0):
+    """
+    Minimal yaml writer for the generated dicts, lists and strings.
+    """
+    lines = []
+    prefix = " " * indent
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)) and item:
+                lines.append("%s%s:" % (prefix, key))
+                lines.append(yaml_dump(item, indent + 4))
+            else:
+                lines.append("%s%s: %s" % (prefix, key, json.dumps(item)))
+    else:
+        for item in value:
+            if isinstance(item, dict):
+                nested = yaml_dump(item, indent + 4).lstrip()
+                lines.append("%s-   %s" % (prefix, nested))
+            else:
+                lines.append("%s- %s" % (prefix, json.dumps(item)))
+    return "\n".join(lines)
+
+
+def arguments_values(options):
+    """
+    Decoded values of the request arguments, passing every check.
+    """
+    return collections.OrderedDict(
+        (argument_name(i), VALUES[i % len(VALUES)])
+        for i in range(options.arguments))
+
+
+def generate_sources(options):
+    sources = collections.OrderedDict()
+    for i in range(options.sources):
+        api_keys = ["S3CR3T%d_%d" % (i, k)
+                    for k in range(options.api_keys - 1)] + [SHARED_API_KEY]
+        # the request ip matches the last pattern only
+        ips = []
+        for k in range(options.ips - 1):
+            ips.append(("192.168.%d.%d" % (i % 256, k % 256),
+                        "172.16.%d.0/24" % (k % 256),
+                        "^192\\.0\\.%d\\." % (k % 256))[k % 3])
+        ips.append("10.0.0.0/8")
+        sources[source_name(i)] = collections.OrderedDict([
+            ("apikey", api_keys),
+            ("ip", ips),
+            ("plugins", collections.OrderedDict(
+                (plugin_name(p), [{"token": "token%d_%d" % (i, p)}])
+                for p in range(options.plugins))),
+        ])
+    if not options.projects:
+        return sources
+    return collections.OrderedDict(
+        ("project%d" % p, {"sources": sources})
+        for p in range(options.projects))
+
+
+def generate_ressources(options):
+    arguments = collections.OrderedDict()
+    for i, value in enumerate(arguments_values(options).values()):
+        arguments[argument_name(i)] = collections.OrderedDict([
+            ("checks", collections.OrderedDict([
+                ("min length", 2),
+                ("max length", 50),
+                ("matches re", "^[a-z]+$"),
+                ("value in", list(VALUES)),
+            ])),
+        ])
+    if arguments:
+        # the first argument is sent encoded
+        arguments[argument_name(0)]["encoding"] = "base64"
+    return {RESSOURCE: {METHOD: collections.OrderedDict([
+        ("request method", "GET"),
+        ("arguments", arguments),
+    ])}}
+
+
+def generate_acl(options):
+    acl = collections.OrderedDict(
+        (source_name(i), {RESSOURCE: [METHOD]})
+        for i in range(options.sources))
+    if not options.projects:
+        return acl
+    return collections.OrderedDict(
+        ("project%d" % p, acl) for p in range(options.projects))
+
+
+def generate(options, directory):
+    """
+    Write the configuration files and the plugins module in directory.
+    Return the paths of the acl, sources and ressources files.
+    """
+    paths = []
+    for name, content in (("acl.yml", generate_acl(options)),
+                          ("sources.yml", generate_sources(options)),
+                          ("ressources.yml", generate_ressources(options))):
+        path = os.path.join(directory, name)
+        with open(path, "w") as yml:
+            yml.write(yaml_dump(content) + "\n")
+        paths.append(path)
+
+    package = os.path.join(directory, PLUGINS_MODULE)
+    os.mkdir(package)
+    open(os.path.join(package, "__init__.py"), "w").close()
+    for p in range(options.plugins):
+        with open(os.path.join(package, plugin_name(p) + ".py"), "w") as py:
+            py.write(PLUGIN_TEMPLATE % {
+                "name": plugin_name(p),
+                "function": "%s_%s" % (RESSOURCE, METHOD)})
+    sys.path.insert(0, directory)
+    return paths
+
+
+def sign(arguments):
+    return hashlib.sha1((SHARED_API_KEY + "".join(
+        "%s%s" % (key, arguments[key]) for key in sorted(arguments))
+    ).encode("utf-8")).hexdigest()
+
+
+class QueryFactory(object):
+
+    """
+    Build fresh queries: checks decode the arguments of the query they
+    receive, so a query is never timed twice.
+    """
+
+    def __init__(self, options):
+        self.project = "project0" if options.projects else None
+        self.decoded = arguments_values(options)
+        self.encoded = collections.OrderedDict(self.decoded)
+        if self.encoded:
+            name = argument_name(0)
+            self.encoded[name] = base64.b64encode(
+                self.encoded[name].encode("utf-8")).decode("utf-8")
+        self.signature = sign(self.decoded)
+
+    def __call__(self, source=None, decoded=False):
+        return Query(
+            source=source or source_name(0),
+            remote_ip=REMOTE_IP,
+            signature=self.signature,
+            arguments=dict(self.decoded if decoded else self.encoded),
+            ressource=RESSOURCE,
+            method=METHOD,
+            request_method="GET",
+            project=self.project)
+
+
+def measure(function, number, prepare=None):
+    """
+    Call function number times and return its timings in microseconds.
+    prepare builds the argument of each call out of the timed section.
+    """
+    timings = []
+    for _ in range(number):
+        argument = prepare() if prepare is not None else None
+        start = monotonic()
+        function(argument)
+        timings.append((monotonic() - start) * 1e6)
+    return timings
+
+
+def summary(timings):
+    timings = sorted(timings)
+    count = len(timings)
+    return collections.OrderedDict([
+        ("calls", count),
+        ("min", timings[0]),
+        ("median", timings[count // 2]),
+        ("p95", timings[min(count - 1, int(count * 0.95))]),
+        ("mean", sum(timings) / count),
+    ])
+
+
+def benchmarks(options, paths):
+    """
+    Yield the name, function, number of calls and argument factory of
+    each benchmark.
+    """
+    acl, sources, ressources = paths
+    for key, path in (("acl", acl), ("sources", sources),
+                      ("ressources", ressources)):
+        yield ("load.%s" % key,
+               lambda _, path=path, key=key: ConfigurationLoader(
+                   path, key=key).content,
+               options.load_number, None)
+    yield ("load.runner",
+           lambda _: PluginsRunner(acl, sources, ressources, PLUGINS_MODULE),
+           options.load_number, None)
+
+    runner = PluginsRunner(acl, sources, ressources, PLUGINS_MODULE)
+    query = QueryFactory(options)
+    sources = runner.sources(query.signature, query.project)
+
+    def check(check_class):
+        return lambda q: check_class(q, runner.ressources, sources,
+                                     runner.acl)()
+
+    yield "check.acl", check(CheckACL), options.number, query
+    # CheckArguments decodes the arguments when it is built
+    yield "check.arguments", check(CheckArguments), options.number, query
+    yield ("check.request", check(CheckRequest), options.number,
+           lambda: query(decoded=True))
+    yield ("check.source", check(CheckSource), options.number,
+           lambda: query(decoded=True))
+
+    decoder = DecodeArguments(lambda *args, **kwargs: None)
+    decoder.obj = None
+    yield ("decode", lambda q: decoder(q, runner.ressources, sources),
+           options.number, query)
+    yield ("check.plan", lambda q: runner.validation_plan(q)(q),
+           options.number, query)
+
+    loader = runner.plugin_loader
+    name = plugin_name(0)
+
+    def load_plugin(_):
+        with loader.plugin(name):
+            pass
+    yield "plugin.load", load_plugin, options.number, None
+    parameters = runner.plugins(*query(decoded=True)("plugins"))[name]
+    yield ("plugin.data_or_errors",
+           lambda q: data_or_errors(loader, name, q, parameters,
+                                    collections.OrderedDict(),
+                                    collections.OrderedDict()),
+           options.number, lambda: query(decoded=True))
+    call = runner.dispatch(query(decoded=True))[0]
+    yield ("plugin.call",
+           lambda q: call_plugin(loader, call, q, collections.OrderedDict(),
+                                 collections.OrderedDict()),
+           options.number, lambda: query(decoded=True))
+
+    yield "request.single", runner, options.number, query
+    if not options.projects:
+        # multiple sources and all are resolved within a project
+        return
+    multiple = SOURCE_SEPARATOR.join(
+        source_name(i) for i in range(min(options.sources,
+                                          options.multiple)))
+    yield ("request.multiple", runner, options.number,
+           lambda: query(multiple))
+    yield ("request.all", runner, options.number,
+           lambda: query(ALL_KEYWORD))
+
+
+def run(options):
+    directory = tempfile.mkdtemp(prefix="excalibur_bench_")
+    try:
+        paths = generate(options, directory)
+        results = collections.OrderedDict()
+        for name, function, number, prepare in benchmarks(options, paths):
+            results[name] = summary(measure(function, number, prepare))
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def report(options, results):
+    return collections.OrderedDict([
+        ("date", datetime.datetime.utcnow().isoformat()),
+        ("python", platform.python_version()),
+        ("implementation", platform.python_implementation()),
+        ("platform", platform.platform()),
+        ("parameters", collections.OrderedDict(
+            (key, getattr(options, key)) for key in PARAMETERS)),
+        ("unit", "us"),
+        ("results", results),
+    ])
+
+
+def print_table(results):
+    columns = ("calls", "min", "median", "p95", "mean")
+    print("%-24s" % "stage" + "".join("%12s" % c for c in columns))
+    for name, timings in results.items():
+        print("%-24s%12d" % (name, timings["calls"]) + "".join(
+            "%12.1f" % timings[c] for c in columns[1:]))
+
+
+PARAMETERS = ("projects", "sources", "plugins", "api_keys", "ips",
+              "arguments", "multiple", "number", "load_number")
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time each stage of the excalibur request pipeline.")
+    parser.add_argument("--projects", type=int, default=1,
+                        help="projects level in sources.yml and acl.yml, "
+                             "0 for flat files, without the multiple "
+                             "sources and all requests")
+    parser.add_argument("--sources", type=int, default=10)
+    parser.add_argument("--plugins", type=int, default=3,
+                        help="plugins per source")
+    parser.add_argument("--api-keys", type=int, default=2,
+                        help="api keys per source")
+    parser.add_argument("--ips", type=int, default=3,
+                        help="ip patterns per source")
+    parser.add_argument("--arguments", type=int, default=4,
+                        help="arguments of the method, each one with "
+                             "four checks")
+    parser.add_argument("--multiple", type=int, default=3,
+                        help="sources of the multiple sources request")
+    parser.add_argument("--number", type=int, default=1000,
+                        help="calls per stage")
+    parser.add_argument("--load-number", type=int, default=20,
+                        help="calls per configuration loading stage")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write the results in FILE, - for stdout")
+    options = parser.parse_args(argv)
+    if options.sources < 1 or options.api_keys < 1 or options.ips < 1:
+        parser.error("at least one source, api key and ip are required")
+    return options
+
+
+def main(argv=None):
+    options = parse_arguments(argv)
+    results = run(options)
+    if options.json == "-":
+        print(json.dumps(report(options, results), indent=2))
+        return
+    print_table(results)
+    if options.json:
+        with open(options.json, "w") as output:
+            json.dump(report(options, results), output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio execution path of the PluginsRunner.
+Coroutine plugin methods (async def actions_action1...) are awaited
+in the event loop, the other plugins are got, called and released in
+an executor so that the loop is never blocked. The plugins of a query run concurrently.
+Checks only compute on the query and the compiled configuration,
+they are run in the loop.
+"""
+
+import asyncio
+import collections
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import pickle
+import time
+
+from excalibur import utils
+from excalibur.exceptions import CircuitOpenError, PluginLoaderError,\
+    PluginTimeoutError
+from excalibur.flight import query_key, shared_result
+from excalibur.process import prepare_call, record_outcomes
+from excalibur.scheduler import plugins_dependencies
+from excalibur.utils import call_deadline, format_error, monotonic,\
+    plugin_data_format, record_result, separator_contained, set_plugin_name,\
+    thread_call, timeout_result
+
+# asyncio.wait_for times out up to the loop's clock resolution early
+CLOCK_RESOLUTION = time.get_clock_info('monotonic').resolution
+
+
+def reached(deadline):
+    return deadline is not None and\
+        monotonic() + CLOCK_RESOLUTION >= deadline
+
+
+def cancelled(breaker, name, deadline):
+    """
+    Count a cancelled call in the circuit breaker as a timeout when it
+    reached its deadline, a request cancelled earlier is not a failure.
+    """
+    if reached(deadline):
+        breaker.failure(PluginTimeoutError(
+            "%s did not answer before its deadline" % name))
+    else:
+        breaker.release()
+
+
+def is_coroutine_call(plugin_loader, call):
+    """
+    Whether the plugin function of a PluginCall is a coroutine.
+    """
+    try:
+        plugin = plugin_loader.get_plugin_class(call.plugin_name)
+    except PluginLoaderError:
+        return False
+    return asyncio.iscoroutinefunction(
+        getattr(plugin, call.function_name, None))
+
+
+async def get_plugin(plugin_loader, plugin_name, executor=None):
+    """
+    Instances are created (setup may block) and pooled instances waited
+    for outside of the loop. With the thread lifecycle, the loop's
+    thread has its own instances.
+    """
+    if plugin_loader.lifecycle == 'thread':
+        return plugin_loader.get_plugin(plugin_name)
+    return await asyncio.get_event_loop().run_in_executor(
+        executor, plugin_loader.get_plugin, plugin_name)
+
+
+async def release(plugin_loader, plugin_name, instance, executor=None):
+    """
+    Instances of the request lifecycle are torn down outside of the loop.
+    """
+    if plugin_loader.lifecycle == 'request':
+        await asyncio.get_event_loop().run_in_executor(
+            executor, plugin_loader.release, plugin_name, instance)
+    else:
+        plugin_loader.release(plugin_name, instance)
+
+
+async def call_sync_plugin(plugin_loader, call, query, data, errors,
+                           executor=None, deadline=None):
+    """
+    utils.call_plugin in the executor: the plugin is got, called and
+    released by the thread using it. A call cancelled at its deadline
+    is counted by the circuit breakers.
+    """
+    threads = []
+    try:
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, functools.partial(
+                thread_call, threads, utils.call_plugin, plugin_loader, call,
+                query, data, errors, deadline))
+    except asyncio.CancelledError:
+        if call.breakers is not None and threads and reached(deadline):
+            error = PluginTimeoutError(
+                "%s did not answer before its deadline" % call.name)
+            for breaker in call.breakers:
+                breaker.timeout(threads[0], error)
+        raise
+
+
+async def get_data(plugin, f_name, parameters, query, data, executor=None,
+                   deadline=None):
+    f = getattr(plugin, f_name)
+    kwargs = {"data": data, "source": query.source, "project": query.project}
+    if deadline is not None:
+        kwargs["timeout"] = max(deadline - monotonic(), 0)
+    if asyncio.iscoroutinefunction(f):
+        return await f(parameters, query.arguments, **kwargs)
+    return await asyncio.get_event_loop().run_in_executor(
+        executor, functools.partial(f, parameters, query.arguments,
+                                    **kwargs))
+
+
+async def timed_get_data(listener, plugin_name, index, plugin, f_name,
+                         parameters, query, data, executor=None,
+                         deadline=None):
+    """
+    get_data giving its duration to a PipelineListener.
+    """
+    start = monotonic()
+    try:
+        plugin_data = await get_data(plugin, f_name, parameters, query, data,
+                                     executor, deadline)
+    except Exception as e:
+        listener.plugin_call(query, plugin_name, index, monotonic() - start,
+                             e)
+        raise
+    listener.plugin_call(query, plugin_name, index, monotonic() - start)
+    return plugin_data
+
+
+async def data_or_errors(plugin_loader, plugin_name, query, parameters_sets,
+                         data, errors, executor=None, deadline=None,
+                         breakers=None):
+    """
+    Coroutine counterpart of utils.data_or_errors
+    """
+    f_name = query.function_name
+    raw_plugin_name = plugin_name
+    separated = separator_contained(plugin_name)
+    plugin_name = set_plugin_name(plugin_name)
+    listener = plugin_loader.listener
+    plugin = await get_plugin(plugin_loader, plugin_name, executor)
+
+    try:
+        for index, parameters in enumerate(parameters_sets):
+            # Initialize returned data to None
+            plugin_data = None
+            if hasattr(plugin, f_name):
+                breaker = breakers[index] if breakers is not None else None
+                # Get data
+                try:
+                    if breaker is not None:
+                        breaker.check()
+                    plugin_data = await (
+                        get_data(plugin, f_name, parameters, query, data,
+                                 executor, deadline) if listener is None else
+                        timed_get_data(listener, plugin_name, index, plugin,
+                                       f_name, parameters, query, data,
+                                       executor, deadline))
+                    if breaker is not None:
+                        breaker.success()
+                except asyncio.CancelledError:
+                    if breaker is not None:
+                        cancelled(breaker, plugin_name, deadline)
+                    raise
+                # Or register exception
+                except Exception as e:
+                    if breaker is not None:
+                        breaker.failure(e)
+                    errors[plugin_name] = format_error(query, e, index)
+                # Register data by plugin name
+                data = plugin_data_format(plugin_data, data, separated,
+                                          raw_plugin_name, plugin_name)
+    finally:
+        await release(plugin_loader, plugin_name, plugin, executor)
+    return data, errors
+
+
+async def call_plugin(plugin_loader, call, query, data, errors,
+                      executor=None, deadline=None):
+    """
+    Coroutine counterpart of utils.call_plugin and
+    utils.call_cached_plugin
+    """
+    if call.process:
+        return await call_process_plugin(plugin_loader, call, query, data,
+                                         errors, deadline)
+    if not is_coroutine_call(plugin_loader, call):
+        return await call_sync_plugin(plugin_loader, call, query, data,
+                                      errors, executor, deadline)
+    if call.implemented is None:
+        return await data_or_errors(plugin_loader, call.name, query,
+                                    call.parameters_sets, data, errors,
+                                    executor, deadline, call.breakers)
+
+    keys = results = None
+    if call.cache is not None:
+        keys = call.cache.keys(query, call)
+        results = [call.cache.get(key) for key in keys]
+        if None not in results:
+            for result in results:
+                record_result(call, result, data, errors)
+            return data, errors
+
+    listener = plugin_loader.listener
+    breakers = call.breakers
+    plugin = await get_plugin(plugin_loader, call.plugin_name, executor)
+    try:
+        for index, parameters in enumerate(call.parameters_sets):
+            if results is not None and results[index] is not None:
+                record_result(call, results[index], data, errors)
+                continue
+            breaker = breakers[index] if breakers is not None else None
+            try:
+                if breaker is not None:
+                    breaker.check()
+                plugin_data = await (
+                    get_data(plugin, call.function_name, parameters, query,
+                             data, executor, deadline) if listener is None
+                    else timed_get_data(listener, call.plugin_name, index,
+                                        plugin, call.function_name,
+                                        parameters, query, data, executor,
+                                        deadline))
+            except asyncio.CancelledError:
+                if breaker is not None:
+                    cancelled(breaker, call.plugin_name, deadline)
+                raise
+            except Exception as e:
+                errors[call.plugin_name] = format_error(query, e, index)
+                if breaker is not None:
+                    breaker.failure(e)
+                if keys is not None and\
+                        not isinstance(e, CircuitOpenError):
+                    call.cache.set(keys[index],
+                                   (None, errors[call.plugin_name]))
+                continue
+            if breaker is not None:
+                breaker.success()
+            if keys is not None:
+                call.cache.set(keys[index], (plugin_data, None))
+            if plugin_data is not None:
+                data[call.data_key] = plugin_data
+    finally:
+        await release(plugin_loader, call.plugin_name, plugin, executor)
+    return data, errors
+
+
+async def call_process_plugin(plugin_loader, call, query, data, errors,
+                              deadline=None):
+    """
+    Coroutine counterpart of process.call_process_plugin
+    """
+    keys, results = prepare_call(call, query)
+    outcomes = []
+    if None in results:
+        try:
+            pool = plugin_loader.get_process_pool()
+            outcomes = pickle.loads(await asyncio.wrap_future(
+                pool.submit(call, query, data, results, deadline)))
+        except asyncio.CancelledError:
+            if call.breakers is not None:
+                for index, result in enumerate(results):
+                    if result is None:
+                        cancelled(call.breakers[index], call.plugin_name,
+                                  deadline)
+            raise
+        except BrokenProcessPool as e:
+            pool.restart()
+            errors[call.plugin_name] = format_error(query, e, None)
+        except Exception as e:
+            errors[call.plugin_name] = format_error(query, e, None)
+    return record_outcomes(plugin_loader, call, query, keys, results,
+                           outcomes, data, errors)
+
+
+async def run(runner, query, configuration=None):
+    """
+    Coroutine counterpart of PluginsRunner.run
+    Like the threaded execution, a plugin only receives the data of
+    the plugins listed in its depends_on attribute, and is reported
+    in errors with a PluginTimeoutError after its timeout (or
+    plugin_timeout seconds) or beyond the request's deadline, in which
+    case it is cancelled.
+    """
+    deadline = runner.request_deadline(query)
+    calls = collections.OrderedDict(
+        (call.name, call) for call in runner.dispatch(query, configuration))
+    names = list(calls.keys())
+    dependencies = plugins_dependencies(runner.plugin_loader, names)
+    tasks = {}
+
+    async def run_plugin(name):
+        received = collections.OrderedDict()
+        for other in names:
+            if other in dependencies[name]:
+                received.update((await tasks[other])[0])
+        received_names = set(received)
+        call = calls[name]
+        timeout = call.timeout if call.timeout is not None\
+            else runner.plugin_timeout
+        end = call_deadline(timeout, deadline)
+        message = "did not answer before the request deadline"\
+            if end is not None and end == deadline\
+            else "did not answer within %ss" % timeout
+        if end is not None and end <= monotonic():
+            return timeout_result(query, name, message)
+        coroutine = call_plugin(runner.plugin_loader, call, query,
+                                received, collections.OrderedDict(),
+                                runner.executor, end)
+        try:
+            data, errors = await asyncio.wait_for(
+                coroutine, end - monotonic() if end is not None else None)
+        except asyncio.TimeoutError:
+            return timeout_result(query, name, message)
+        return (collections.OrderedDict(
+            (k, v) for k, v in data.items() if k not in received_names),
+            errors)
+
+    for name in names:
+        tasks[name] = asyncio.ensure_future(run_plugin(name))
+    try:
+        results = await asyncio.gather(*[tasks[name] for name in names])
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    data, errors = collections.OrderedDict(), collections.OrderedDict()
+    for plugin_data, plugin_errors in results:
+        data.update(plugin_data)
+        errors.update(plugin_errors)
+    return data, errors
+
+
+async def call(runner, query, configuration=None):
+    """
+    Coroutine counterpart of PluginsRunner.__call__
+    """
+    configuration = configuration or runner.configuration
+    runner.validation_plan(query, configuration)(query,
+                                                 runner.pipeline_listener)
+    flights = runner.async_flights
+    if flights is None:
+        return await run(runner, query, configuration)
+    result, _ = await flights(query_key(query, configuration),
+                              lambda: run(runner, query, configuration))
+    return shared_result(result)
+
+
+class AsyncSingleFlight(object):
+
+    """
+    Coroutine counterpart of flight.SingleFlight. The first call runs
+    in a task awaited by the others: cancelling a call does not cancel
+    the calls waiting for it.
+    """
+
+    def __init__(self):
+        self.__tasks = {}
+
+    def __len__(self):
+        return len(self.__tasks)
+
+    async def __call__(self, key, function):
+        """
+        Return (result, shared), shared when another call computed it.
+        """
+        key = (asyncio.get_event_loop(), key)
+        task = self.__tasks.get(key)
+        shared = task is not None
+        if not shared:
+            task = self.__tasks[key] = asyncio.ensure_future(function())
+            task.add_done_callback(lambda _: self.__tasks.pop(key, None))
+        return await asyncio.shield(task), shared
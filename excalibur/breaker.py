@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breakers of the plugins, configured by the breaker entry of
+their plugins_options in sources.yml: a plugin whose backend keeps
+failing is not called for a while, its calls failing at once.
+"""
+
+import threading
+
+from excalibur.exceptions import CircuitOpenError
+from excalibur.utils import get_ident, monotonic
+
+DEFAULT_FAILURES = 5
+DEFAULT_OPEN_SECONDS = 30
+
+
+def breaker_options(options, plugin_name):
+    """
+    breaker entry of a plugin in the plugins_options entry of a source:
+        plugins_options:
+            Plugin1:
+                breaker: {failures: 5, open_seconds: 30}
+    None when the plugin has no circuit breaker.
+    """
+    try:
+        options = options[plugin_name]['breaker']
+    except (KeyError, TypeError):
+        return None
+    if options is True:
+        return {}
+    return options if isinstance(options, dict) else None
+
+
+class CircuitBreaker(object):
+
+    """
+    Consecutive failures of a plugin with a parameters set.
+    - closed: the plugin is called, failures are counted
+    - open: after failures consecutive failures, calls raise a
+      CircuitOpenError for open_seconds
+    - half-open: then one call is let through to probe the backend,
+      closing the breaker when it succeeds and opening it again when
+      it fails. The other calls fail until the probe answers or
+      another open_seconds elapse.
+    With exceptions, a list of exception class names, only the errors
+    of these classes (or their subclasses) are failures, the others
+    mean the backend answered.
+    The calls are tracked by thread: a call running late is counted as
+    a failure by timeout, and the outcome its thread reports later is
+    ignored.
+    """
+
+    def __init__(self, plugin_name, parameters_index,
+                 failures=DEFAULT_FAILURES, open_seconds=DEFAULT_OPEN_SECONDS,
+                 exceptions=None):
+        self.plugin_name = plugin_name
+        self.parameters_index = parameters_index
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.exceptions = frozenset(exceptions) if exceptions else None
+        self.__lock = threading.Lock()
+        self.__count = 0
+        # threads calling the plugin, and those whose call timed out
+        self.__calls = set()
+        self.__late = set()
+        # monotonic() time of the opening or of the last probe
+        self.__opened = None
+
+    @classmethod
+    def from_options(cls, plugin_name, parameters_index, options):
+        return cls(plugin_name, parameters_index,
+                   failures=options.get('failures', DEFAULT_FAILURES),
+                   open_seconds=options.get('open_seconds',
+                                            DEFAULT_OPEN_SECONDS),
+                   exceptions=options.get('exceptions'))
+
+    @property
+    def state(self):
+        opened = self.__opened
+        if opened is None:
+            return "closed"
+        if monotonic() < opened + self.open_seconds:
+            return "open"
+        return "half-open"
+
+    def check(self):
+        """
+        Raise a CircuitOpenError unless the plugin may be called.
+        """
+        if self.__opened is None:
+            self.__calls.add(get_ident())
+            return
+        with self.__lock:
+            if self.__opened is None:
+                self.__calls.add(get_ident())
+                return
+            now = monotonic()
+            remaining = self.__opened + self.open_seconds - now
+            if remaining > 0:
+                raise CircuitOpenError(
+                    "%s is not called with parameters set %s for %.1fs "
+                    "after %s failures" % (self.plugin_name,
+                                           self.parameters_index, remaining,
+                                           self.failures))
+            # this call probes the backend
+            self.__opened = now
+            self.__calls.add(get_ident())
+
+    def success(self):
+        with self.__lock:
+            if self.__answered(get_ident()):
+                self.__count = 0
+                self.__opened = None
+
+    def failure(self, error):
+        """
+        Count the exception raised by a call.
+        """
+        if isinstance(error, CircuitOpenError):
+            return
+        if not self.counts(error):
+            self.success()
+            return
+        with self.__lock:
+            if self.__answered(get_ident()):
+                self.__fail()
+
+    def timeout(self, ident, error):
+        """
+        Count the PluginTimeoutError of the call running in the thread
+        ident, if any. The outcome of this call is then ignored.
+        """
+        if not self.counts(error):
+            return
+        with self.__lock:
+            if ident in self.__calls:
+                self.__calls.discard(ident)
+                self.__late.add(ident)
+                self.__fail()
+
+    def release(self):
+        """
+        Forget the call of this thread, which has no outcome.
+        """
+        ident = get_ident()
+        with self.__lock:
+            self.__calls.discard(ident)
+            self.__late.discard(ident)
+
+    def counts(self, error):
+        """
+        Whether error is a failure of the backend.
+        """
+        return self.exceptions is None or any(
+            cls.__name__ in self.exceptions for cls in type(error).__mro__)
+
+    def __answered(self, ident):
+        # False for the late call of a thread, already counted
+        if ident in self.__late:
+            self.__late.discard(ident)
+            return False
+        self.__calls.discard(ident)
+        return True
+
+    def __fail(self):
+        self.__count += 1
+        if self.__count >= self.failures or self.__opened is not None:
+            self.__opened = monotonic()
+
+
+def plugin_breakers(plugin_name, parameters_sets, options):
+    """
+    CircuitBreaker of each parameters set of a plugin.
+    """
+    return tuple(CircuitBreaker.from_options(plugin_name, index, options)
+                 for index in range(len(parameters_sets)))
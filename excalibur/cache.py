@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Caches of the plugins results, configured by the cache entry of a
+ressource method.
+"""
+
+import collections
+import threading
+
+from excalibur.utils import monotonic
+
+# returned by a backend for a key it does not hold
+MISSING = object()
+
+
+def freeze(value):
+    """
+    Hashable equivalent of query arguments, equal for equal arguments
+    whatever the order of their keys.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(((key, freeze(item))
+                             for key, item in value.items()),
+                            key=lambda item: repr(item[0])))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    return value
+
+
+def cache_options(ressources, source, ressource, method):
+    """
+    cache entry of a ressource method in ressources.yml, overridden by
+    the entry of the source in sources.yml:
+        cache:
+            ressource:
+                method: {ttl: 60}
+    None when the results are not cached.
+    """
+    try:
+        options = ressources[ressource][method].get('cache')
+    except (AttributeError, KeyError, TypeError):
+        options = None
+    try:
+        overrides = source['cache'][ressource]
+        if method in overrides:
+            options = overrides[method]
+    except (KeyError, TypeError):
+        pass
+    if options is True:
+        return {}
+    return options if isinstance(options, dict) else None
+
+
+class CacheBackend(object):
+
+    """
+    Storage of the cached results. Keys are tuples of strings, numbers
+    and nested tuples, values the (data, error) of a plugin call.
+    A backend shared between processes serializes them itself.
+    """
+
+    def get(self, key):
+        """
+        Value stored for key, MISSING when there is none or it expired.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value for key, for ttl seconds when ttl is set.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+
+    """
+    In-process backend, dropping the least recently used entries beyond
+    max_entries.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        with self.__lock:
+            try:
+                value, expires = self.__entries.pop(key)
+            except KeyError:
+                return MISSING
+            if expires is not None and expires <= monotonic():
+                return MISSING
+            self.__entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = monotonic() + ttl if ttl is not None else None
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (value, expires)
+            if self.max_entries is not None:
+                while len(self.__entries) > self.max_entries:
+                    self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+class PluginCache(object):
+
+    """
+    Results of the plugins of a source for a ressource method, keyed on
+    (project, source, ressource, method, plugin, parameters index,
+    arguments). Errors are only kept with the errors option.
+    """
+
+    def __init__(self, prefix, backend, ttl=None, errors=False):
+        self.prefix = prefix
+        self.backend = backend
+        self.ttl = ttl
+        self.errors = errors
+
+    @classmethod
+    def from_options(cls, prefix, options, backend_factory=MemoryCache):
+        """
+        PluginCache for the options of a cache entry:
+        ttl, max_entries and errors.
+        """
+        return cls(prefix, backend_factory(
+            max_entries=options.get('max_entries')),
+            ttl=options.get('ttl'), errors=bool(options.get('errors')))
+
+    def keys(self, query, call):
+        """
+        Key of each parameters set of the call.
+        """
+        arguments = freeze(query.arguments)
+        return [self.prefix + (call.plugin_name, index, arguments)
+                for index in range(len(call.parameters_sets))]
+
+    def get(self, key):
+        """
+        (data, error) stored for key, None when there is none.
+        """
+        result = self.backend.get(key)
+        return None if result is MISSING else result
+
+    def set(self, key, result):
+        """
+        Store the (data, error) of a plugin call.
+        """
+        if result[1] is None or self.errors:
+            self.backend.set(key, result, self.ttl)
+
+    def clear(self):
+        self.backend.clear()
@@ -1,20 +1,94 @@
 # -*- coding: utf-8 -*-
 import re
 
+import six
+
 from excalibur.exceptions import ArgumentError,\
     ArgumentCheckMethodNotFoundError, CheckMethodError,\
     NoACLMatchedError, RessourceNotFoundError, MethodNotFoundError,\
     HTTPMethodError, SourceNotFoundError, \
-    IPNotAuthorizedError, WrongSignatureError
+    IPNotAuthorizedError, WrongSignatureError, DecodeAlgorithmNotFoundError
 from excalibur.decode import DecodeArguments
+from excalibur.ip import IPAllowList
+from excalibur.signature import SignatureVerifier, api_keys_list,\
+    canonical_arguments
 from excalibur.utils import add_args_then_encode,\
     ALL_KEYWORD, SOURCE_SEPARATOR, sources_list_or_list,\
-    all_sources_or_sources_list_or_list, dict_merge,\
+    all_sources_or_sources_list_or_list, method_arguments,\
     is_simple_request_and_source_not_found, ip_found_in_sources,\
-    get_api_keys_by_sources, get_nested_dict_value
+    get_ip_entry, get_api_keys_by_sources, monotonic
 
 import itertools
 
+# request method is optional in ressources.yml and may be set to None
+NOT_SPECIFIED = object()
+
+# {check name in ressources.yml: validator factory}
+ARGUMENT_CHECKS = {}
+
+
+def register_argument_check(name, factory=None):
+    """
+    Register the check named name in ressources.yml.
+    factory receives the check parameter from ressources.yml, once per
+    configuration, and returns a validator: a function taking the
+    argument value and returning True when it passes.
+    May be used as a decorator. Register checks before the runner
+    compiles its validation plans.
+    """
+    if factory is None:
+        return lambda factory: register_argument_check(name, factory)
+    ARGUMENT_CHECKS[name] = factory
+    return factory
+
+
+def unregister_argument_check(name):
+    ARGUMENT_CHECKS.pop(name, None)
+
+
+def parse_length(length):
+    # lengths written as strings in ressources.yml
+    return int(length) if isinstance(length, six.string_types) else length
+
+
+@register_argument_check("min length")
+def min_length(length):
+    length = parse_length(length)
+    return lambda value: len(value) >= length
+
+
+@register_argument_check("max length")
+def max_length(length):
+    length = parse_length(length)
+    return lambda value: len(value) <= length
+
+
+@register_argument_check("value in")
+def value_in(choices):
+    if isinstance(choices, (list, tuple, set, frozenset)):
+        try:
+            choices = frozenset(choices)
+        except TypeError:
+            # unhashable choices are looked up in the list
+            pass
+    return lambda value: value in choices
+
+
+@register_argument_check("matches re")
+def matches_re(re_string):
+    match = re.compile(re_string).match
+    return lambda value: match(value) is not None
+
+
+def failing_validator(error):
+    """
+    Validator of a check whose parameter is invalid: the error is
+    raised when an argument is checked, as for any failing check.
+    """
+    def validator(value):
+        raise error
+    return validator
+
 
 class Check(object):
 
@@ -26,6 +100,98 @@ class Check(object):
     def check(self):
         raise NotImplementedError
 
+    @classmethod
+    def compile(cls, query, ressources, sources, acl,
+                sha1check=True, ipcheck=True, **options):
+        """
+        Return a callable taking the query as only argument and running
+        the part of the check that depends on the request.
+        query is a template carrying project, source, ressource and method
+        but no arguments. By default nothing is precomputed.
+        options tune the compiled checks:
+        - signature_cache_size: verified signatures kept by CheckSource
+        """
+        return RuntimeCheck(cls, ressources, sources, acl,
+                            sha1check=sha1check, ipcheck=ipcheck)
+
+
+class RuntimeCheck(object):
+
+    """
+    Fallback of Check.compile: the check is built and run from scratch
+    for each request. Used when the configuration cannot be compiled,
+    so that errors are raised exactly as they have always been.
+    """
+
+    def __init__(self, check_class, ressources, sources, acl,
+                 sha1check=True, ipcheck=True):
+        self.check_class = check_class
+        self.ressources = ressources
+        self.sources = sources
+        self.acl = acl
+        self.sha1check = sha1check
+        self.ipcheck = ipcheck
+
+    def __call__(self, query):
+        self.check_class(query, self.ressources, self.sources, self.acl,
+                         sha1check=self.sha1check, ipcheck=self.ipcheck)()
+
+
+class ValidationPlan(object):
+
+    """
+    All the checks of a (project, source, ressource, method) tuple,
+    compiled once. Calling the plan with a query only runs the work
+    depending on the request: signature, ip and arguments values.
+    """
+
+    __slots__ = ('key', 'stages', 'names', 'compiled')
+
+    def __init__(self, key, stages, names=None):
+        self.key = key
+        names = names or [None] * len(stages)
+        self.names = tuple(name for name, stage in zip(names, stages)
+                           if stage is not None)
+        self.stages = tuple(stage for stage in stages if stage is not None)
+        # a plan relying on runtime checks targets an invalid configuration
+        self.compiled = not any(isinstance(stage, RuntimeCheck)
+                                for stage in self.stages)
+
+    @classmethod
+    def compile(cls, query, ressources, sources, acl,
+                sha1check=True, ipcheck=True, **options):
+        key = (query.project, query.source, query.ressource, query.method)
+        return cls(key, [check.compile(query, ressources, sources, acl,
+                                       sha1check=sha1check, ipcheck=ipcheck,
+                                       **options)
+                         for check in CHECKS],
+                   [check.__name__ for check in CHECKS])
+
+    def __call__(self, query, listener=None):
+        if listener is not None:
+            return self.timed(query, listener)
+        for stage in self.stages:
+            stage(query)
+
+    def timed(self, query, listener):
+        """
+        Run the checks, giving their durations to a PipelineListener.
+        """
+        for name, stage in zip(self.names, self.stages):
+            start = monotonic()
+            try:
+                if isinstance(stage, CompiledArguments):
+                    # decodings are timed apart
+                    stage.decode(query, listener)
+                    start = monotonic()
+                    stage.validate(query)
+                else:
+                    stage(query)
+            except Exception as e:
+                listener.check(query, name, monotonic() - start, e)
+                raise
+            listener.check(query, name, monotonic() - start)
+
 
 class CheckArguments(Check):
 
@@ -33,7 +199,8 @@ class CheckArguments(Check):
     Class ensuring argument consistency.
     Search the ressources.yml's argument entry
     to find all registered constraints and launch
-    matching methods based on naming convention.
+    matching validators from ARGUMENT_CHECKS, or
+    methods based on naming convention.
     By now, checks are two arguments methods that
     compare a received value to an expected value.
     The comparator is not dynamically obtained, it
@@ -58,28 +225,17 @@ class CheckArguments(Check):
         # Keep trace of arguments that do not pass tests.
         errors = {}
 
-        # Check if there is an arguments parameter in the source
-        try:
-            source_arguments = self.sources[self.source]['arguments']
-        except (KeyError, TypeError):
-            source_arguments = {}
-
         targeted_ressource = self.ressources[self.ressource]\
             if self.ressource in self.ressources.keys() else None
 
-        # Merge targeted_ressource and source_arguments
-        dict_merge(
-            get_nested_dict_value(targeted_ressource, (self.method, 'arguments')),
-            # targeted_ressource[self.method]["arguments"],
-            source_arguments)
-
         if targeted_ressource is None:
             raise ArgumentError("unexpected argument")
 
         if "arguments" in targeted_ressource[self.method].keys():
 
-            args = targeted_ressource[self.method][
-                "arguments"]
+            # arguments of the source override those of the ressource
+            args = method_arguments(self.ressources, self.sources,
+                                    self.source, self.ressource, self.method)
             for argument_name in self.arguments:
                 try:
                     check_list = args[argument_name]["checks"]\
@@ -90,10 +246,10 @@ class CheckArguments(Check):
                 for check in check_list:
                     try:
                         check_method_name = self.format(check)
-                        check_method = getattr(self, check_method_name)
                         check_parameter = args[argument_name]["checks"][check]
+                        validator = self.validator(check, check_parameter)
                         value_to_check = self.arguments[argument_name]
-                        if not check_method(value_to_check, check_parameter):
+                        if not validator(value_to_check):
                             errors[argument_name] = check
                     except AttributeError as a:
                         raise ArgumentCheckMethodNotFoundError(
@@ -104,6 +260,75 @@ class CheckArguments(Check):
         if errors:
             raise ArgumentError("The check list did not pass", errors)
 
+    @classmethod
+    def compile(cls, query, ressources, sources, acl,
+                sha1check=True, ipcheck=True, **options):
+        fallback = super(CheckArguments, cls).compile(
+            query, ressources, sources, acl,
+            sha1check=sha1check, ipcheck=ipcheck, **options)
+        try:
+            # Decoding validates the ressource and the method
+            check = cls(query, ressources, sources, acl)
+            targeted_method = ressources[query.ressource][query.method]
+            args = method_arguments(ressources, sources, query.source,
+                                    query.ressource, query.method)
+            if args is not None and not all(
+                    isinstance(v, dict) and
+                    isinstance(v.get("checks", {}), dict)
+                    for v in args.values()):
+                return fallback
+        except Exception:
+            return fallback
+
+        decoder = DecodeArguments(None)
+        decoders = None
+        if args:
+            decoders = {}
+            for argument_name, spec in args.items():
+                if "encoding" in spec:
+                    algo = spec["encoding"]
+                    decoders[argument_name] = (
+                        algo, getattr(decoder, "decode_%s" % algo, None))
+
+        # arguments set to None in ressources.yml are not checked
+        checks = None
+        if "arguments" in targeted_method and args is not None:
+            checks = {}
+            for argument_name, spec in args.items():
+                if "checks" in spec:
+                    checks[argument_name] = tuple(
+                        (name, cls.format(name),
+                         check.compile_validator(name, parameter))
+                        for name, parameter in spec["checks"].items())
+
+        return CompiledArguments(query.method, frozenset(args or ()),
+                                 decoders, checks)
+
+    def validator(self, check, parameter):
+        """
+        Return the validator of the named check in ressources.yml,
+        a registered one or else the matching check_ method.
+        Raise an AttributeError when the check does not exist.
+        """
+        try:
+            factory = ARGUMENT_CHECKS[check]
+        except KeyError:
+            method = getattr(self, self.format(check))
+            return lambda value: method(value, parameter)
+        return factory(parameter)
+
+    def compile_validator(self, check, parameter):
+        """
+        Validator built once for a compiled plan, None when the check
+        does not exist.
+        """
+        try:
+            return self.validator(check, parameter)
+        except AttributeError:
+            return None
+        except Exception as e:
+            return failing_validator(e)
+
     def check_min_length(self, argument_value, length):
         return len(argument_value) >= length
 
@@ -123,6 +348,93 @@ class CheckArguments(Check):
         return "check_" + x.replace(" ", "_")
 
 
+class CompiledArguments(object):
+
+    """
+    Per request part of DecodeArguments and CheckArguments.
+    """
+
+    def __init__(self, method, declared, decoders, checks):
+        self.method = method
+        # names of the arguments described in ressources.yml
+        self.declared = declared
+        # {argument name: (algo, decoding method)}, None when not decoding
+        self.decoders = decoders
+        # {argument name: ((check, method name, validator), ...)}
+        # None when no check is expected
+        self.checks = checks
+
+    def __call__(self, query):
+        self.decode(query)
+        self.validate(query)
+
+    def decode(self, query, listener=None):
+        """
+        Replace the arguments of the query by their decoded values,
+        timing each decoding for a PipelineListener.
+        """
+        if self.decoders is None:
+            return
+        arguments = query.arguments
+        decoded = None
+        for argument_name in arguments:
+            if argument_name not in self.declared:
+                raise ArgumentError(
+                    'Wrong ressource configuration: key not found for '
+                    'method %s' % self.method)
+            if argument_name in self.decoders:
+                algo, decode = self.decoders[argument_name]
+                if listener is not None:
+                    start = monotonic()
+                try:
+                    if decode is None:
+                        raise AttributeError(algo)
+                    if decoded is None:
+                        decoded = dict(arguments)
+                    decoded[argument_name] = decode(
+                        arguments[argument_name])
+                except AttributeError:
+                    error = DecodeAlgorithmNotFoundError(algo)
+                    if listener is not None:
+                        listener.decode(query, argument_name,
+                                        monotonic() - start, error)
+                    raise error
+                if listener is not None:
+                    listener.decode(query, argument_name,
+                                    monotonic() - start)
+        if decoded is not None:
+            # the received arguments are left untouched
+            query["arguments"] = decoded
+
+    def validate(self, query):
+        """
+        Run the checks of the arguments.
+        """
+        if self.checks is None:
+            return
+        arguments = query.arguments
+        errors = {}
+        for argument_name in arguments:
+            try:
+                check_list = self.checks[argument_name]
+            except KeyError:
+                raise ArgumentError("unexpected argument %s" % argument_name)
+            value = arguments[argument_name]
+            for check, check_method_name, validator in check_list:
+                try:
+                    if validator is None:
+                        raise AttributeError(check_method_name)
+                    if not validator(value):
+                        errors[argument_name] = check
+                except AttributeError:
+                    raise ArgumentCheckMethodNotFoundError(check_method_name)
+                except Exception as e:
+                    raise CheckMethodError(e)
+
+        if errors:
+            raise ArgumentError("The check list did not pass", errors)
+
+
 class CheckACL(Check):
 
     """
@@ -164,6 +476,18 @@ class CheckACL(Check):
             raise NoACLMatchedError(
                 "%s/%s" % (self.ressource, self.method))
 
+    @classmethod
+    def compile(cls, query, ressources, sources, acl,
+                sha1check=True, ipcheck=True, **options):
+        # ACLs do not depend on the request: once allowed, always allowed
+        try:
+            cls(query, ressources, sources, acl)()
+        except Exception:
+            return super(CheckACL, cls).compile(
+                query, ressources, sources, acl,
+                sha1check=sha1check, ipcheck=ipcheck, **options)
+        return None
+
 
 class CheckRequest(Check):
 
@@ -229,6 +553,33 @@ class CheckRequest(Check):
         except KeyError as k:
             raise ArgumentError("key not found in sources")
 
+    @classmethod
+    def compile(cls, query, ressources, sources, acl,
+                sha1check=True, ipcheck=True, **options):
+        fallback = super(CheckRequest, cls).compile(
+            query, ressources, sources, acl,
+            sha1check=sha1check, ipcheck=ipcheck, **options)
+        try:
+            if query.ressource not in ressources.keys() or\
+                    query.method not in ressources[query.ressource]:
+                return fallback
+            targeted_method = ressources[query.ressource][query.method]
+            args = targeted_method.get("arguments")
+            if args is not None and not all(isinstance(v, dict)
+                                            for v in args.values()):
+                return fallback
+        except Exception:
+            return fallback
+
+        return CompiledRequest(
+            query.method, targeted_method,
+            targeted_method.get("request method")
+            if "request method" in targeted_method else NOT_SPECIFIED,
+            "arguments" in targeted_method,
+            frozenset(k for k, v in (args or {}).items()
+                      if v.get('optional') is not True),
+            frozenset(args.keys() if args is not None else ()))
+
     def all_required_args_found(self, required):
         received = self.required_received_params(required).keys()
         expected = self.required_params(required).keys()
@@ -245,6 +596,49 @@ class CheckRequest(Check):
                 self.required_params(args).keys()}
 
 
+class CompiledRequest(object):
+
+    """
+    Per request part of CheckRequest.
+    """
+
+    def __init__(self, method, targeted_method, http_method, has_arguments,
+                 required, allowed):
+        self.method = method
+        self.targeted_method = targeted_method
+        self.http_method = http_method
+        self.has_arguments = has_arguments
+        self.required = required
+        self.allowed = allowed
+
+    def __call__(self, query):
+        if self.http_method is not NOT_SPECIFIED and\
+                query.request_method != self.http_method:
+            raise HTTPMethodError(self.http_method)
+
+        if not self.has_arguments:
+            return
+
+        arguments = query.arguments
+        if not self.targeted_method['arguments'] and arguments != {}:
+            raise ArgumentError("%s only supports no arguments "
+                                "requests, received : %s" % (
+                                    self.method, arguments))
+
+        if not isinstance(arguments, dict):
+            raise ArgumentError("%s is not a supported format" % (
+                self.targeted_method))
+
+        if not self.required.issubset(arguments):
+            raise ArgumentError("received arguments do no match :"
+                                " %s required arguments : %s)" % (
+                                    arguments,
+                                    self.targeted_method["arguments"]))
+
+        if not self.allowed.issuperset(arguments):
+            raise ArgumentError("exceeding parameters")
+
+
 class CheckSource(Check):
     """
     Check source ensures that the right api_key is found
@@ -315,3 +709,64 @@ class CheckSource(Check):
             raise SourceNotFoundError("key was not found in sources")
         except TypeError as t:
             raise SourceNotFoundError("key was not found in sources")
+
+    @classmethod
+    def compile(cls, query, ressources, sources, acl,
+                sha1check=True, ipcheck=True, **options):
+        fallback = super(CheckSource, cls).compile(
+            query, ressources, sources, acl,
+            sha1check=sha1check, ipcheck=ipcheck, **options)
+        try:
+            check = cls(query, ressources, sources, acl,
+                        sha1check=sha1check, ipcheck=ipcheck)
+            if is_simple_request_and_source_not_found(query.source, sources):
+                return fallback
+            allow_list = IPAllowList(get_ip_entry(query.source, sources))\
+                if check.ipcheck else None
+            verifiers = None
+            if query.source != ALL_KEYWORD and check.sha1check:
+                verifiers = []
+                for target in sources_list_or_list(query.source):
+                    api_keys = api_keys_list(sources[target])
+                    if api_keys is None:
+                        return fallback
+                    verifiers.append(SignatureVerifier(
+                        api_keys, options.get('signature_cache_size', 0)))
+        except Exception:
+            return fallback
+
+        return CompiledSource(allow_list, verifiers)
+
+
+class CompiledSource(object):
+
+    """
+    Per request part of CheckSource.
+    """
+
+    def __init__(self, allow_list, verifiers):
+        # None when the ip is not checked
+        self.allow_list = allow_list
+        # verifier of each targeted source, None when not signed
+        self.verifiers = verifiers
+
+    def __call__(self, query):
+        try:
+            if self.allow_list is not None and\
+                    not self.allow_list.match(query.remote_ip):
+                raise IPNotAuthorizedError(query.remote_ip)
+
+            if self.verifiers is not None:
+                canonical = canonical_arguments(query.arguments)
+                # The request has to be allowed for all the sources it targets
+                for verifier in self.verifiers:
+                    if not verifier.verify(query.signature, canonical):
+                        raise WrongSignatureError(query.signature)
+        except KeyError as k:
+            raise SourceNotFoundError("key was not found in sources")
+        except TypeError as t:
+            raise SourceNotFoundError("key was not found in sources")
+
+
+# Order in which the PluginsRunner applies the checks
+CHECKS = (CheckACL, CheckArguments, CheckRequest, CheckSource)
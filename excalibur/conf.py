@@ -79,3 +79,8 @@ class Acl(object):
         except AttributeError as ae:
             raise KeyError()
         return ret
+
+    def keys(self):
+        """
+        """
+        return self.__dict__.keys()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration snapshots of a PluginsRunner, and their reloading.
+"""
+
+import collections
+import os
+import threading
+
+from excalibur.breaker import breaker_options, plugin_breakers
+from excalibur.exceptions import ExcaliburError
+from excalibur.utils import PLUGIN_NAME_SEPARATOR
+
+CONFIGURATION_KEYS = ("acl", "sources", "ressources")
+
+
+def file_state(path):
+    """
+    Identify a version of a configuration file, None when the file
+    cannot be found.
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def order_plugins(source):
+    """
+    Plugins of a source entry. With a plugins_order entry, only the
+    plugins it lists, in its order.
+    """
+    plugins_order = source.get('plugins_order')
+    if not plugins_order:
+        return source["plugins"]
+    plugins = source["plugins"]
+    if not isinstance(plugins_order, (list, tuple)):
+        return collections.OrderedDict(sorted(
+            {k: v for k, v in plugins.items() if k in plugins_order}.items(),
+            key=lambda x: plugins_order.index(x[0])))
+    # the first occurrence of a plugin gives its position
+    return collections.OrderedDict(
+        (name, plugins[name])
+        for name in collections.OrderedDict.fromkeys(plugins_order)
+        if name in plugins)
+
+
+class ConfigurationSnapshot(object):
+
+    """
+    acl, sources and ressources of a runner, with the validation plans,
+    signature verifiers and dispatch tables compiled from them.
+    A snapshot is not modified once in use: reloading builds a new one,
+    swapped in by the runner while the requests in progress finish with
+    the previous one.
+    """
+
+    def __init__(self, acl, sources, ressources, origins, states):
+        self.acl = acl
+        self.sources = sources
+        self.ressources = ressources
+        # {key: file path or raw yaml the content was loaded from}
+        self.origins = origins
+        # {key: file_state when loaded, None for raw yaml}
+        self.states = states
+        self.plans = {}
+        self.verifiers = {}
+        # {(project, source, ressource, method): PluginCall tuple}
+        self.dispatch = {}
+        # {(project, source): plugins of the source, ordered}
+        self.plugins_lists = {}
+        # {(project, source): ((source|plugin, parameters sets), ...)}
+        self.prefixed_plugins_lists = {}
+        # {(project, source, ressource, method): PluginCache or None}
+        self.caches = {}
+        # {(project, source): {plugin: CircuitBreaker tuple}}
+        self.breakers = {}
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def replace(self, contents=None, origins=None, states=None):
+        """
+        New snapshot with the given contents, origins and states
+        replaced, and nothing compiled.
+        """
+        values = {}
+        for key in CONFIGURATION_KEYS:
+            values[key] = (contents or {}).get(key, self[key])
+        return ConfigurationSnapshot(
+            origins=dict(self.origins, **(origins or {})),
+            states=dict(self.states, **(states or {})), **values)
+
+    def source_plugins(self, project, name, source):
+        """
+        Plugins of the source entry named name, in plugins_order.
+        """
+        plugins = self.plugins_lists.get((project, name))
+        if plugins is None:
+            plugins = self.plugins_lists[(project, name)] =\
+                order_plugins(source)
+        return plugins
+
+    def prefixed_plugins(self, project, name, source):
+        """
+        (source|plugin, parameters sets) of the source entry named name,
+        as listed by multiple sources and all requests.
+        """
+        plugins = self.prefixed_plugins_lists.get((project, name))
+        if plugins is None:
+            plugins = self.prefixed_plugins_lists[(project, name)] = tuple(
+                (name + PLUGIN_NAME_SEPARATOR + key, value)
+                for key, value in source['plugins'].items())
+        return plugins
+
+    def source_breakers(self, project, name, source):
+        """
+        Circuit breakers of the plugins of the source entry named name,
+        shared by its ressources methods.
+        """
+        breakers = self.breakers.get((project, name))
+        if breakers is None:
+            options = source.get('plugins_options')
+            breakers = {}
+            for plugin_name, parameters_sets in (
+                    source.get('plugins') or {}).items():
+                plugin_options = breaker_options(options, plugin_name)
+                if plugin_options is not None:
+                    breakers[plugin_name] = plugin_breakers(
+                        plugin_name, parameters_sets, plugin_options)
+            breakers = self.breakers.setdefault((project, name), breakers)
+        return breakers
+
+    def clear_caches(self):
+        """
+        Drop the cached plugins results.
+        """
+        for cache in list(self.caches.values()):
+            if cache is not None:
+                cache.clear()
+        self.caches.clear()
+
+    def projects(self):
+        """
+        Names of the projects, none for a flat sources.yml.
+        """
+        return [project for project in self.sources.keys()
+                if isinstance(self.sources[project], dict) and
+                "sources" in self.sources[project]]
+
+    def plan_keys(self):
+        """
+        (project, source, ressource, method) of the single source
+        requests allowed in acl.yml.
+        """
+        projects = self.projects()
+        acls = [(project, self.acl[project]) for project in projects
+                if project in self.acl.keys()] if projects else\
+            [(None, self.acl)]
+        if "default" in projects and "default" in self.acl.keys():
+            # requests without project target the default one
+            acls.append((None, self.acl["default"]))
+        keys = []
+        for project, acl in acls:
+            for source in acl.keys():
+                if not isinstance(acl[source], dict):
+                    continue
+                for ressource, methods in acl[source].items():
+                    if isinstance(methods, list):
+                        keys.extend((project, source, ressource, method)
+                                    for method in methods)
+        return keys
+
+    def plugins_functions(self):
+        """
+        {plugin name: names of the ressource_method functions the
+        plugin is called with}, for the plugins of every source.
+        """
+        projects = self.projects()
+        sources = [(project, self.sources[project]["sources"])
+                   for project in projects] if projects else\
+            [(None, self.sources)]
+        functions = {}
+        for project, project_sources in sources:
+            for source in project_sources.keys():
+                for plugin_name in (project_sources[source] or {}).get(
+                        "plugins") or ():
+                    functions.setdefault(plugin_name, set())
+        for project, source, ressource, method in self.plan_keys():
+            try:
+                plugins = self.sources[project]["sources"][source]["plugins"]\
+                    if project else self.sources[source]["plugins"]
+            except (KeyError, TypeError):
+                continue
+            for plugin_name in plugins or ():
+                functions[plugin_name].add("%s_%s" % (ressource, method))
+        return functions
+
+    def changes(self):
+        """
+        Return {key: file_state} for the files modified since loaded.
+        """
+        changes = {}
+        for key, state in self.states.items():
+            if state is not None:
+                current = file_state(self.origins[key])
+                if current != state:
+                    changes[key] = current
+        return changes
+
+
+class ConfigurationWatcher(object):
+
+    """
+    Thread polling the configuration files of a runner every interval
+    seconds, and reloading the modified ones. A failed reload leaves
+    the configuration unchanged and is kept in error, it is retried
+    once the files are modified again.
+    """
+
+    def __init__(self, runner, interval=1.0):
+        self.runner = runner
+        self.interval = interval
+        self.error = None
+        self.__failed = None
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.watch, name="excalibur-configuration-watcher")
+        self.__thread.daemon = True
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+
+    def watch(self):
+        while not self.__stop.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """
+        Reload the modified files, return the reloaded keys.
+        """
+        changes = self.runner.configuration.changes()
+        if not changes or changes == self.__failed:
+            return []
+        try:
+            reloaded = self.runner.reload_configuration()
+        except ExcaliburError as e:
+            self.__failed = changes
+            self.error = e
+            return []
+        self.__failed = None
+        self.error = None
+        return reloaded
@@ -9,17 +9,30 @@ that is specified in dedicated yaml files.
 """
 
 import collections
+from concurrent.futures import ThreadPoolExecutor,\
+    TimeoutError as FutureTimeoutError
 from functools import reduce
-from importlib import import_module
+import gc
+import threading
 
+from excalibur.cache import MemoryCache, PluginCache, cache_options
+from excalibur.listener import Listeners
 from excalibur.loader import ConfigurationLoader, PluginLoader
-from excalibur.check import CheckACL,\
-    CheckArguments, CheckRequest, CheckSource
+from excalibur.metrics import MetricsRegistry
+from excalibur.check import ValidationPlan
+from excalibur.configuration import CONFIGURATION_KEYS,\
+    ConfigurationSnapshot, ConfigurationWatcher, file_state
+from excalibur.flight import SingleFlight, query_key, shared_result
+from excalibur.scheduler import PluginScheduler
+from excalibur.signature import SignatureVerifier, key_id_index
+from excalibur.stream import PluginStream
 from excalibur.decode import DecodeArguments
-from excalibur.exceptions import PluginRunnerError, WrongSignatureError
+from excalibur.exceptions import ExcaliburError, PluginRunnerError,\
+    WrongSignatureError
 from excalibur.utils import add_args_then_encode, get_api_keys, ALL_KEYWORD,\
     PLUGIN_NAME_SEPARATOR, SOURCE_SEPARATOR, get_sources_for_all,\
-    data_or_errors
+    call_plugin, call_plugin_batch, plugin_calls,\
+    call_deadline, monotonic, thread_call, timeout_result
 
 
 from excalibur.conf import Sources
@@ -32,94 +45,390 @@ class PluginsRunner(object):
     """
     # 22/04/2014 :checksign defaults to false
 
+    # maximum number of validation plans kept by a runner
+    plans_cache_size = 4096
+
     def __init__(self, acl, sources, ressources,
                  plugins_module, check_signature=True, check_ip=True,
-                 raw_yaml_content=False):
+                 raw_yaml_content=False, plugin_lifecycle='request',
+                 plugin_pool_size=4, max_workers=None, plugin_timeout=None,
+                 signature_cache_size=0, snapshot_dir=None,
+                 watch_interval=None, preload=False,
+                 cache_backend=MemoryCache, coalesce=False, listener=None,
+                 metrics=False, request_timeout=None, process_workers=None,
+                 timeout_workers=32):
         self.__raw_yaml_content = raw_yaml_content
-        self["acl"] = acl
-        self["sources"] = sources
-        self["ressources"] = ressources
+        # called with max_entries for each cached ressource method
+        self.__cache_backend = cache_backend
+        self.__snapshot_dir = snapshot_dir
+        self.__signature_cache_size = signature_cache_size
+        self.__configuration = None
+        self.__reload_lock = threading.Lock()
         self["plugins_module"] = plugins_module
         self["check_signature"] = check_signature
         self["check_ip"] = check_ip
+        self.__configuration = self.load_configuration(
+            {"acl": acl, "sources": sources, "ressources": ressources})
+        self.__plugin_timeout = plugin_timeout
+        # seconds a query may run when it does not set its own timeout
+        self.__request_timeout = request_timeout
+        self.__plugin_loader = PluginLoader(plugins_module,
+                                            lifecycle=plugin_lifecycle,
+                                            pool_size=plugin_pool_size,
+                                            process_workers=process_workers)
+        # latency histograms and counters, fed like a listener
+        self.__metrics = MetricsRegistry() if metrics else None
+        # PipelineListener receiving the timings of the requests
+        self.listener = listener
+        # Plugins run concurrently when max_workers is set
+        self.__max_workers = max_workers
+        self.__executor = ThreadPoolExecutor(max_workers)\
+            if max_workers else None
+        self.__scheduler = PluginScheduler(
+            self.__executor, self.__plugin_loader, plugin_timeout)\
+            if max_workers else None
+        # Plugins with a timeout run in this pool without max_workers
+        self.__timeout_workers = timeout_workers
+        self.__timeout_executor = None
+        self.__timeout_lock = threading.Lock()
+        # Identical concurrent queries share their results
+        self.__flights = SingleFlight() if coalesce else None
+        self.__async_flights = None
+        # Broken plugins are reported when the runner is built
+        if preload:
+            self.warmup()
+        # Configuration files are reloaded when modified
+        self.__watcher = None
+        if watch_interval:
+            self.__watcher = ConfigurationWatcher(self, watch_interval)
+            self.__watcher.start()
+
+    @property
+    def configuration(self):
+        """
+        Current ConfigurationSnapshot.
+        """
+        return self.__configuration
 
     @property
     def acl(self):
-        return self.__acl
+        return self.__configuration.acl
 
     @property
     def ressources(self):
-        return self.__ressources
+        return self.__configuration.ressources
 
     @property
     def plugins_module(self):
         return self.__plugins_module
 
-    def project_sources(self, project):
-        return self.__sources[project]["sources"]
+    @property
+    def plugin_loader(self):
+        return self.__plugin_loader
+
+    @property
+    def executor(self):
+        return self.__executor
+
+    @property
+    def plugin_timeout(self):
+        return self.__plugin_timeout
+
+    @property
+    def request_timeout(self):
+        return self.__request_timeout
+
+    def request_deadline(self, query):
+        """
+        monotonic() time by which the plugins of the query have to
+        answer, from its timeout or the runner's request_timeout.
+        """
+        timeout = query.timeout if query.timeout is not None\
+            else self.__request_timeout
+        return monotonic() + timeout if timeout is not None else None
+
+    @property
+    def listener(self):
+        return self.__listener
+
+    @listener.setter
+    def listener(self, listener):
+        self.__listener = listener
+        listeners = [other for other in (self.__metrics, listener)
+                     if other is not None]
+        self.__plugin_loader.listener = Listeners(*listeners)\
+            if len(listeners) > 1 else (listeners or [None])[0]
+
+    @property
+    def pipeline_listener(self):
+        """
+        Listener timing the requests: the listener, the metrics
+        registry, both or None.
+        """
+        return self.__plugin_loader.listener
 
-    def plugins(self, source, signature, arguments=None, project=None):
+    @property
+    def metrics(self):
+        """
+        MetricsRegistry of the runner, None without metrics.
+        """
+        return self.__metrics
+
+    @property
+    def flights(self):
+        return self.__flights
+
+    @property
+    def async_flights(self):
+        """
+        AsyncSingleFlight of the asyncio path, None without coalesce.
+        """
+        if self.__flights is not None and self.__async_flights is None:
+            from excalibur import aio
+            self.__async_flights = aio.AsyncSingleFlight()
+        return self.__async_flights
+
+    @property
+    def watcher(self):
+        return self.__watcher
+
+    def reload_plugins(self):
+        """
+        Drop the plugins instances and reimport their modules.
+        """
+        self.__plugin_loader.reload()
+        # the reimported plugins may define other functions
+        self.__configuration.dispatch.clear()
+        self.__configuration.clear_caches()
+
+    def warmup(self, instantiate=False, max_workers=None, strict=True):
+        """
+        Import in parallel every plugin of sources.yml, with instantiate
+        get an instance of each, and look for the ressource_method
+        functions allowed in acl.yml for their sources.
+        Return {plugin name: {"import": seconds, "instantiate": seconds,
+        "missing": [function names], "error": PluginLoaderError}}.
+        With strict, a plugin failing to load raises a PluginLoaderError.
+        """
+        functions = self.__configuration.plugins_functions()
+        reports = self.__plugin_loader.warmup(
+            sorted(functions), instantiate, max_workers)
+        for plugin_name, report in reports.items():
+            plugin = None if report["error"] else\
+                self.__plugin_loader.get_plugin_class(plugin_name)
+            report["missing"] = sorted(
+                function for function in functions[plugin_name]
+                if plugin is not None and not hasattr(plugin, function))
+        errors = [report["error"] for report in reports.values()
+                  if report["error"] is not None]
+        if strict and errors:
+            raise errors[0]
+        return reports
+
+    def close(self):
+        """
+        Stop the plugins threads and teardown the plugins instances.
+        """
+        if self.__watcher is not None:
+            self.__watcher.stop()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+        with self.__timeout_lock:
+            timeout_executor, self.__timeout_executor =\
+                self.__timeout_executor, None
+        if timeout_executor is not None:
+            timeout_executor.shutdown(wait=True)
+        self.__plugin_loader.close()
+
+    def load_configuration(self, origins, current=None):
+        """
+        Load the given files (or raw yaml) in a new snapshot of the
+        current configuration. Known plans and verifiers are compiled
+        for the new snapshot, so that requests do not wait for them.
+        """
+        states, contents = {}, {}
+        for key, origin in origins.items():
+            # the state is read first, a file modified while being
+            # loaded is reloaded again
+            states[key] = None if self.__raw_yaml_content else\
+                file_state(origin)
+            contents[key] = self.resolve(origin, key)
+        if current is None:
+            return ConfigurationSnapshot(origins=origins, states=states,
+                                         **contents)
+
+        configuration = current.replace(contents, origins, states)
+        self.compile(configuration, list(current.plans),
+                     list(current.verifiers))
+        return configuration
+
+    def compile(self, configuration, plan_keys, projects):
+        """
+        Build the validation plans of plan_keys and the verifiers of
+        projects. Errors are left to the requests. The plugins of
+        multiple sources and all requests depend on their signature,
+        they are dispatched by the requests.
+        """
+        for (project, source, ressource, method) in plan_keys:
+            template = Query(source, None, ressource, method, None,
+                             project=project)
+            try:
+                self.validation_plan(template, configuration)
+                if source != ALL_KEYWORD and SOURCE_SEPARATOR not in source:
+                    self.dispatch(template, configuration)
+            except Exception:
+                pass
+        for project in projects:
+            try:
+                self.api_key_verifiers(project, configuration=configuration)
+            except Exception:
+                pass
+
+    def compile_configuration(self):
+        """
+        Build the validation plans of the single source requests
+        allowed in acl.yml, and the verifiers of every project,
+        instead of waiting for the first requests.
+        """
+        configuration = self.__configuration
+        self.compile(configuration, configuration.plan_keys(),
+                     configuration.projects())
+
+    def freeze(self):
+        """
+        Prepare the runner to be shared by pre-forked workers: the whole
+        configuration is compiled, then the objects tracked by the
+        garbage collector are moved to a permanent generation (python
+        3.7+) that collections in the workers do not write to.
+        Call it in the master process, before forking.
+        """
+        self.compile_configuration()
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+    def reload_configuration(self, acl=None, sources=None, ressources=None):
+        """
+        Reload the given configuration files (or raw yaml), by default
+        the files modified since they were loaded, and swap them in.
+        Requests in progress finish with the previous configuration.
+        Return the reloaded keys. On a ConfigurationLoaderError, the
+        configuration is left unchanged.
+        """
+        with self.__reload_lock:
+            current = self.__configuration
+            origins = dict((key, value) for key, value in (
+                ("acl", acl), ("sources", sources),
+                ("ressources", ressources)) if value is not None)
+            if not origins:
+                origins = dict((key, current.origins[key])
+                               for key in current.changes())
+            if not origins:
+                return []
+            self.__configuration = self.load_configuration(origins, current)
+            return sorted(origins)
+
+    def project_sources(self, project, configuration=None):
+        configuration = configuration or self.__configuration
+        return configuration.sources[project]["sources"]
+
+    def plugins(self, source, signature, arguments=None, project=None,
+                key_id=None, configuration=None):
         """
         returns allowed plugins
         """
+        configuration = configuration or self.__configuration
         try:
             if source != ALL_KEYWORD and SOURCE_SEPARATOR not in source:
-                plugins = self.sources(signature,
-                                       project,
-                                       arguments)[source]
-                plugins_order = plugins.get('plugins_order')
-
-                if plugins_order:
-                    # Order the plugins by the plugins_order entry in the YAML
-                    # if the plugin name is in plugins_order
-                    return collections.OrderedDict(sorted(
-                        {k: v for k,v in plugins["plugins"].items()\
-                            if k in plugins_order}.items(),
-                        key=lambda x: plugins_order.index(x[0])))
-                else:
-                    return plugins["plugins"]
+                # Order the plugins by the plugins_order entry in the YAML
+                # if the plugin name is in plugins_order
+                return configuration.source_plugins(
+                    project, source, self.sources(signature,
+                                                  project,
+                                                  arguments,
+                                                  configuration)[source])
             else:
-                sources = get_sources_for_all(signature,
-                                              self.__sources[project],
-                                              arguments,
-                                              self.__check_signature)
+                sources = self.matched_sources(signature, arguments, project,
+                                               key_id, configuration)
                 clean_plugin_list = {}
                 for source_key, values in sources.items():
-                    for key, value in values['plugins'].items():
-                        clean_plugin_list[
-                            source_key + PLUGIN_NAME_SEPARATOR + key] = value
+                    clean_plugin_list.update(configuration.prefixed_plugins(
+                        project, source_key, values))
 
                 return clean_plugin_list
         except KeyError:
             raise PluginRunnerError("no such plugin found")
 
-    def sources(self, signature, project=None, arguments=None):
+    def matched_sources(self, signature, arguments=None, project=None,
+                        key_id=None, configuration=None):
+        """
+        Sources of the project targeted by a multiple sources or all
+        request, those matching the signature when it is checked.
+        """
+        configuration = configuration or self.__configuration
+        return get_sources_for_all(
+            signature, configuration.sources[project], arguments,
+            self.__check_signature,
+            self.api_key_verifiers(project, key_id, configuration))
+
+    def api_key_verifiers(self, project, key_id=None, configuration=None):
+        """
+        Signature verifiers of the project's sources, built once.
+        None when some apikey entries cannot be compiled.
+        With a key_id, only the sources registering it are returned,
+        looked up in an index.
+        """
+        configuration = configuration or self.__configuration
+        try:
+            verifiers, index = configuration.verifiers[project]
+        except KeyError:
+            sources = configuration.sources[project]["sources"]
+            verifiers = SignatureVerifier.for_sources(
+                sources, self.__signature_cache_size)
+            index = key_id_index(sources, verifiers)\
+                if verifiers is not None else None
+            configuration.verifiers[project] = (verifiers, index)
+        if key_id is None or index is None:
+            return verifiers
+        return index.get(key_id, collections.OrderedDict())
+
+    def sources(self, signature, project=None, arguments=None,
+                configuration=None):
         """
         Since the sources are either registered at top-level
         in the matching yml file or distibuted by projects
         sources() works as a filter to return either the whole
         yml, or the matching entries.
         """
+        configuration = configuration or self.__configuration
 
         project = project or (
-            'default' if 'default' in self.__sources.keys() else project)
+            'default' if 'default' in configuration.sources.keys()
+            else project)
 
         if project:
             try:
-                return self.project_sources(project)
+                return self.project_sources(project, configuration)
             except KeyError:
                 raise PluginRunnerError("no such source found")
         else:
-            return self.__sources
+            return configuration.sources
 
     def __setitem__(self, key, value):
+        if key in CONFIGURATION_KEYS:
+            self.reload_configuration(**{key: value})
+            return
         setattr(self, "_" + self.__class__.__name__ + "__" + key,
                 self.resolve(value, key))
+        # compiled checks depend on the whole configuration
+        if self.__configuration is not None:
+            self.__configuration = self.__configuration.replace()
 
     def resolve(self, file_, key):
-        return ConfigurationLoader(file_, self.__raw_yaml_content, key=key
+        return ConfigurationLoader(file_, self.__raw_yaml_content, key=key,
+                                   snapshot_dir=self.__snapshot_dir
                                   ).content if\
-            key in ["acl", "sources", "ressources"]\
+            key in CONFIGURATION_KEYS\
             else file_
 
     def sources_names(self, project=None):
@@ -132,63 +441,420 @@ class PluginsRunner(object):
             except KeyError:
                 raise PluginRunnerError("no such source found")
         else:
-            return sorted(self.__sources.keys())
+            return sorted(self.__configuration.sources.keys())
 
     def check_all(func):
         """
         Check all yml
+        The query is checked and run with the same configuration,
+        even when it is reloaded meanwhile.
         """
 
-        def checks(self, query):
-            module = import_module('excalibur.check')
-            check_list = [
-                'CheckSource',
-                'CheckACL',
-                'CheckRequest',
-                'CheckArguments'
-            ]
-
-            def checker(method_name):
-                checker = getattr(module, method_name)
-                checker(query, self.__ressources,
-                        self.sources(*query("checks")),
-                        self.__acl,
-                        sha1check=self.__check_signature,
-                        ipcheck=self.__check_ip)()
-            list(map(checker, [method_name for method_name in dir(module) if
-                               method_name in check_list]))
-            return func(self, query)
+        def checks(self, query, configuration=None):
+            configuration = configuration or self.__configuration
+            self.validation_plan(query, configuration)(
+                query, self.__plugin_loader.listener)
+            return func(self, query, configuration)
 
         return checks
 
+    def validation_plan(self, query, configuration=None):
+        """
+        Return the checks compiled for the query's project, source,
+        ressource and method. Plans are built on first use and
+        cached, except those targeting an invalid configuration.
+        """
+        configuration = configuration or self.__configuration
+        plans = configuration.plans
+        key = (query.project, query.source, query.ressource, query.method)
+        plan = plans.get(key)
+        if plan is None:
+            template = Query(query.source, None, query.ressource,
+                             query.method, None, project=query.project)
+            plan = ValidationPlan.compile(
+                template, configuration.ressources,
+                self.sources(*query("checks"), configuration=configuration),
+                configuration.acl, sha1check=self.__check_signature,
+                ipcheck=self.__check_ip,
+                signature_cache_size=self.__signature_cache_size)
+            if plan.compiled and len(plans) < self.plans_cache_size:
+                plans[key] = plan
+        return plan
+
+    def dispatch(self, query, configuration=None):
+        """
+        Return the PluginCall of each plugin implementing the query's
+        ressource method, in the order of the plugins list.
+        The table of a single source request is built once, those of
+        multiple sources and all requests depend on the signature.
+        """
+        configuration = configuration or self.__configuration
+        if query.source == ALL_KEYWORD or SOURCE_SEPARATOR in query.source:
+            try:
+                sources = self.match_sources(query, configuration)
+                return sum((self.source_calls(query, name, values,
+                                              configuration)
+                            for name, values in sources.items()), ())
+            except KeyError:
+                raise PluginRunnerError("no such plugin found")
+
+        key = (query.project, query.source, query.ressource, query.method)
+        calls = configuration.dispatch.get(key)
+        if calls is None:
+            plugins = self.plugins(*query("plugins"),
+                                   configuration=configuration)
+            source = self.sources(query.signature, query.project,
+                                  configuration=configuration)[query.source]
+            cache = self.plugin_cache(query.project, query.source, source,
+                                      query.ressource, query.method,
+                                      configuration)
+            calls = plugin_calls(self.__plugin_loader, plugins,
+                                 query.function_name, cache,
+                                 source.get('plugins_options'),
+                                 configuration.source_breakers(
+                                     query.project, query.source, source))
+            if all(call.implemented for call in calls) and\
+                    len(configuration.dispatch) < self.plans_cache_size:
+                configuration.dispatch[key] = calls
+        return calls
+
+    def match_sources(self, query, configuration):
+        """
+        matched_sources of a multiple sources or all query, timed as
+        the MatchSources check by the listener: a WrongSignatureError
+        rejects the query there.
+        """
+        listener = self.__plugin_loader.listener
+        if listener is None:
+            return self.matched_sources(query.signature, query.arguments,
+                                        query.project, query.key_id,
+                                        configuration)
+        start = monotonic()
+        try:
+            sources = self.matched_sources(query.signature, query.arguments,
+                                           query.project, query.key_id,
+                                           configuration)
+        except Exception as e:
+            listener.check(query, "MatchSources", monotonic() - start, e)
+            raise
+        listener.check(query, "MatchSources", monotonic() - start)
+        return sources
+
+    def source_calls(self, query, name, source, configuration):
+        """
+        PluginCall of a source matched by a multiple sources or all
+        request, built once per source.
+        """
+        key = (query.project, name, query.ressource, query.method,
+               PLUGIN_NAME_SEPARATOR)
+        calls = configuration.dispatch.get(key)
+        if calls is None:
+            calls = plugin_calls(
+                self.__plugin_loader, collections.OrderedDict(
+                    configuration.prefixed_plugins(query.project, name,
+                                                   source)),
+                query.function_name,
+                self.plugin_cache(query.project, name, source,
+                                  query.ressource, query.method,
+                                  configuration),
+                source.get('plugins_options'),
+                configuration.source_breakers(query.project, name, source))
+            if all(call.implemented for call in calls):
+                configuration.dispatch[key] = calls
+        return calls
+
+    def plugin_cache(self, project, name, source, ressource, method,
+                     configuration):
+        """
+        PluginCache of the source entry named name for a ressource
+        method, None when its results are not cached.
+        """
+        key = (project, name, ressource, method)
+        try:
+            return configuration.caches[key]
+        except KeyError:
+            pass
+        options = cache_options(configuration.ressources, source,
+                                ressource, method)
+        cache = PluginCache.from_options(key, options, self.__cache_backend)\
+            if options is not None else None
+        return configuration.caches.setdefault(key, cache)
+
     @check_all
-    def __call__(self, query):
-        data, errors = self.run(query)
+    def __call__(self, query, configuration=None):
+        if self.__flights is not None:
+            # checks were run for this query, the plugins may not be
+            result, _ = self.__flights(
+                query_key(query, configuration),
+                lambda: self.run(query, configuration))
+            return shared_result(result)
+        data, errors = self.run(query, configuration)
         return data, errors
 
-    def run(self, query):
+    @check_all
+    def stream(self, query, configuration=None):
+        """
+        Check the query and return a PluginStream yielding the
+        (plugin name, chunk) of its plugins as they produce them.
+        Iterators returned by plugins are yielded item by item, without
+        being materialized. Plugins run one after the other, caches are
+        not used. The deadline of the query starts with the stream.
+        """
+        return PluginStream(self.__plugin_loader, query,
+                            self.dispatch(query, configuration),
+                            self.request_deadline(query),
+                            self.__plugin_timeout)
+
+    def acall(self, query, configuration=None):
+        """
+        Coroutine counterpart of __call__, to be awaited in asyncio
+        applications, see excalibur.aio.
+        """
+        # Python 2 does not support the coroutines syntax
+        from excalibur import aio
+        return aio.call(self, query, configuration)
+
+    def arun(self, query, configuration=None):
+        """
+        Coroutine counterpart of run.
+        """
+        from excalibur import aio
+        return aio.run(self, query, configuration)
+
+    def run(self, query, configuration=None, deadline=None):
         """
         Takes the query as argument and
         browses plugins to execute methods it requires.
         run is indeed excalibur's core.
         Returns obtained data and errors from all
         launched plugins.
+        deadline is the monotonic() time by which the plugins answer,
+        from the query's timeout by default.
         """
         data, errors = collections.OrderedDict(), collections.OrderedDict()
-        # Load plugins
-        loader = PluginLoader(self.__plugins_module)
+        loader = self.__plugin_loader
+        if deadline is None:
+            deadline = self.request_deadline(query)
 
         # Get required plugins depending on the sources.yml depth
-        plugins = self.plugins(*query("plugins"))
-        plugins_list = plugins.keys()
+        calls = self.dispatch(query, configuration)
+
+        if self.__scheduler is not None:
+            return self.__scheduler(query, calls, deadline)
 
         # Actually browse plugins to launch required methods
-        for name in plugins_list:
-            params = plugins[name]
-            (data, errors) = data_or_errors(loader, name, query,
-                                            params, data, errors)
+        for call in calls:
+            if deadline is None and call.timeout is None and\
+                    self.__plugin_timeout is None:
+                (data, errors) = call_plugin(loader, call, query, data,
+                                             errors)
+            else:
+                self.call_within(call, query, data, errors, deadline)
         return data, errors
 
+    def timeout_executor(self):
+        """
+        Pool of timeout_workers threads running the plugins with a
+        timeout, created on first use. Its threads are reused, and so
+        are their instances with the thread lifecycle.
+        """
+        with self.__timeout_lock:
+            if self.__timeout_executor is None:
+                self.__timeout_executor = ThreadPoolExecutor(
+                    self.__timeout_workers)
+            return self.__timeout_executor
+
+    def call_within(self, call, query, data, errors, deadline=None):
+        """
+        Run a plugin in the timeout executor until its timeout or the
+        request's deadline. A plugin running late is reported in errors
+        with a PluginTimeoutError, and left to finish in its thread.
+        """
+        timeout = call.timeout if call.timeout is not None\
+            else self.__plugin_timeout
+        end = call_deadline(timeout, deadline)
+        if end is None:
+            return call_plugin(self.__plugin_loader, call, query, data,
+                               errors)
+        message = "did not answer before the request deadline"\
+            if end == deadline else "did not answer within %ss" % timeout
+        remaining = end - monotonic()
+        if remaining <= 0:
+            plugin_data, plugin_errors = timeout_result(query, call.name,
+                                                        message)
+        else:
+            # the plugin writes in its own dicts, left aside when late
+            threads = []
+            future = self.timeout_executor().submit(
+                thread_call, threads, call_plugin, self.__plugin_loader,
+                call, query, collections.OrderedDict(data),
+                collections.OrderedDict(), end)
+            try:
+                plugin_data, plugin_errors = future.result(remaining)
+            except FutureTimeoutError:
+                # still queued, the plugin is not called
+                future.cancel()
+                plugin_data, plugin_errors = timeout_result(
+                    query, call.name, message, call.breakers,
+                    threads[0] if threads else None)
+        data.update(plugin_data)
+        errors.update(plugin_errors)
+        return data, errors
+
+    def call_batch_within(self, call, queries, results, deadlines):
+        """
+        call_plugin_batch until the plugin's timeout or the earliest
+        deadline of the queries, like call_within. When the plugin is
+        late, every query is reported with a PluginTimeoutError.
+        """
+        timeout = call.timeout if call.timeout is not None\
+            else self.__plugin_timeout
+        deadlines = [deadline for deadline in deadlines
+                     if deadline is not None]
+        deadline = min(deadlines) if deadlines else None
+        end = call_deadline(timeout, deadline)
+        if end is None:
+            return call_plugin_batch(self.__plugin_loader, call, queries,
+                                     results)
+        message = "did not answer before the request deadline"\
+            if end == deadline else "did not answer within %ss" % timeout
+        remaining = end - monotonic()
+        batch_results = None
+        threads = []
+        if remaining > 0:
+            # the plugin fills its own dicts, left aside when late
+            future = self.timeout_executor().submit(
+                thread_call, threads, call_plugin_batch,
+                self.__plugin_loader, call, queries,
+                [(collections.OrderedDict(data),
+                  collections.OrderedDict(errors))
+                 for data, errors in results], end)
+            try:
+                batch_results = future.result(remaining)
+            except FutureTimeoutError:
+                future.cancel()
+        if batch_results is None:
+            batch_results = [timeout_result(query, call.name, message,
+                                            call.breakers,
+                                            threads[0] if threads else None)
+                             for query in queries]
+        for (data, errors), (plugin_data, plugin_errors) in zip(
+                results, batch_results):
+            data.update(plugin_data)
+            errors.update(plugin_errors)
+        return results
+
+    def run_batch(self, queries, max_workers=None, configuration=None):
+        """
+        Check and run queries with the same configuration. They are
+        grouped by project, source, ressource and method: the checks and
+        the plugins of a group are looked up once, and the plugins
+        defining a ressource_method_batch function are called once per
+        group. The plugins of different queries run in a pool of
+        max_workers threads, by default as many as the runner's pool.
+        The batch has its own pool, the queries running plugins in the
+        runner's pool would wait for each other otherwise.
+        Returns the (data, errors) of each query in order, or the
+        ExcaliburError raised by its checks or its plugins.
+        The timeouts of the queries start with the batch.
+        """
+        configuration = configuration or self.__configuration
+        deadlines = [self.request_deadline(query) for query in queries]
+        groups = collections.OrderedDict()
+        for position, query in enumerate(queries):
+            groups.setdefault((query.project, query.source, query.ressource,
+                               query.method), []).append(position)
+        max_workers = max_workers or self.__max_workers
+        executor = ThreadPoolExecutor(max_workers) if max_workers else None
+        results = [None] * len(queries)
+        try:
+            for positions in groups.values():
+                group_results = self.run_group(
+                    [queries[position] for position in positions],
+                    executor, configuration,
+                    [deadlines[position] for position in positions])
+                for position, result in zip(positions, group_results):
+                    results[position] = result
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return results
+
+    def run_group(self, queries, executor=None, configuration=None,
+                  deadlines=None):
+        """
+        (data, errors) or ExcaliburError of each query of a run_batch
+        group, deadlines being the monotonic() deadlines of the queries.
+        """
+        configuration = configuration or self.__configuration
+        deadlines = deadlines or [None] * len(queries)
+        results = [None] * len(queries)
+        try:
+            plan = self.validation_plan(queries[0], configuration)
+        except ExcaliburError as e:
+            return [e] * len(queries)
+        accepted = []
+        for position, query in enumerate(queries):
+            try:
+                plan(query, self.__plugin_loader.listener)
+                accepted.append(position)
+            except ExcaliburError as e:
+                results[position] = e
+        if not accepted:
+            return results
+
+        def run(function, positions):
+            return list(executor.map(function, positions) if executor
+                        else map(function, positions))
+
+        query = queries[accepted[0]]
+        if query.source == ALL_KEYWORD or SOURCE_SEPARATOR in query.source:
+            # plugins depend on the sources matched by each signature
+            def run_query(position):
+                try:
+                    return self.run(queries[position], configuration,
+                                    deadlines[position])
+                except ExcaliburError as e:
+                    return e
+            for position, result in zip(accepted,
+                                        run(run_query, accepted)):
+                results[position] = result
+            return results
+
+        try:
+            calls = self.dispatch(query, configuration)
+        except ExcaliburError as e:
+            for position in accepted:
+                results[position] = e
+            return results
+        for position in accepted:
+            results[position] = (collections.OrderedDict(),
+                                 collections.OrderedDict())
+        for call in calls:
+            # queries whose plugins raised are not run further
+            accepted = [position for position in accepted
+                        if not isinstance(results[position], ExcaliburError)]
+            if call.batch and call.cache is None:
+                try:
+                    self.call_batch_within(
+                        call, [queries[position] for position in accepted],
+                        [results[position] for position in accepted],
+                        [deadlines[position] for position in accepted])
+                except ExcaliburError as e:
+                    for position in accepted:
+                        results[position] = e
+                continue
+
+            def run_call(position):
+                try:
+                    self.call_within(call, queries[position],
+                                     *results[position],
+                                     deadline=deadlines[position])
+                except ExcaliburError as e:
+                    results[position] = e
+            run(run_call, accepted)
+        return results
+
 
 class Query(object):
 
@@ -205,7 +871,9 @@ class Query(object):
                  request_method,
                  signature=None,
                  project=None,
-                 arguments=None):
+                 arguments=None,
+                 key_id=None,
+                 timeout=None):
 
         self["project"] = project
         self["source"] = source
@@ -215,6 +883,9 @@ class Query(object):
         self["ressource"] = ressource
         self["method"] = method
         self["request_method"] = request_method
+        self["key_id"] = key_id
+        # seconds the plugins of the query may run
+        self["timeout"] = timeout
 
     def __str__(self):
         exposed_attrs = ['project', 'source', 'remote_ip', 'signature',
@@ -231,7 +902,7 @@ class Query(object):
         return (self[y] for y in attr_list)
 
     def for_(self, what):
-        list_1 = ['source', 'signature', 'arguments', 'project']
+        list_1 = ['source', 'signature', 'arguments', 'project', 'key_id']
         list_2 = ['signature', 'project', 'arguments']
         return {"plugins": self.getattrsubset(list_1),
                 "checks": self.getattrsubset(list_2)
@@ -273,6 +944,14 @@ class Query(object):
     def request_method(self):
         return self.__request_method
 
+    @property
+    def key_id(self):
+        return self.__key_id
+
+    @property
+    def timeout(self):
+        return self.__timeout
+
     def __setitem__(self, key, value):
         setattr(self, "_" + self.__class__.__name__ + "__" + key,
                 value)
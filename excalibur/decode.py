@@ -6,6 +6,7 @@ caracteres speciaux non geres par
 les urls.
 """
 from excalibur.exceptions import ArgumentError, DecodeAlgorithmNotFoundError
+from excalibur.utils import method_arguments
 import base64
 
 
@@ -31,11 +32,15 @@ class DecodeArguments(object):
         """
         Pour chacun des arguments passes, regarde s'il doit etre decode.
         Et si c'est le cas, appelle la methode correspondante.
+        Les valeurs decodees remplacent les arguments de la requete dans
+        une copie, le dictionnaire recu n'est pas modifie.
         """
+        query = k[0]
         self.ressources = k[1]
-        self.ressource = k[0].ressource
-        self.method_name = k[0].method
-        self.arguments = k[0].arguments
+        sources = k[2] if len(k) > 2 else kw.get("sources")
+        self.ressource = query.ressource
+        self.method_name = query.method
+        self.arguments = query.arguments
 
         if self.ressource not in self.ressources.keys():
             raise ArgumentError("ressource not found")
@@ -46,14 +51,18 @@ class DecodeArguments(object):
         # "arguments
         try:
             if "arguments" in ressource[self.method_name].keys():
-                arguments = ressource[self.method_name]["arguments"]
+                arguments = method_arguments(
+                    self.ressources, sources, query.source,
+                    self.ressource, self.method_name)
                 if arguments:
+                    decoded = dict(self.arguments)
                     for argument_name in self.arguments:
                         if "encoding" in arguments[argument_name]:
                             algo = arguments[argument_name]["encoding"]
                             method = getattr(self, "decode_" + algo)
-                            self.arguments[argument_name] = method(
+                            decoded[argument_name] = method(
                                 self.arguments[argument_name])
+                    query["arguments"] = decoded
         except KeyError:
             raise ArgumentError('Wrong ressource configuration: key not found for method %s' % self.method_name)
         except AttributeError:
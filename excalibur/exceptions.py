@@ -225,3 +225,51 @@ class DecodeAlgorithmNotFoundError(ExcaliburInternalError):
 
     def __str__(self):
         return self.message
+
+
+class PluginTimeoutError(ExcaliburInternalError):
+
+    """
+    plugin did not answer in time
+    """
+
+    def __init__(self, message, *args, **kwargs):
+        super(PluginTimeoutError, self).__init__(*args, **kwargs)
+        self.message = '%s : %s' % (self.__class__.__name__, message)
+
+    def __str__(self):
+        return self.message
+
+
+class CircuitOpenError(ExcaliburInternalError):
+
+    """
+    plugin not called while its circuit breaker is open
+    """
+
+    def __init__(self, message, *args, **kwargs):
+        super(CircuitOpenError, self).__init__(*args, **kwargs)
+        self.message = '%s : %s' % (self.__class__.__name__, message)
+
+    def __str__(self):
+        return self.message
+
+
+class PluginProcessError(ExcaliburInternalError):
+
+    """
+    plugin failed in a worker process with an exception that could not
+    be sent back
+    """
+
+    def __init__(self, message, *args, **kwargs):
+        super(PluginProcessError, self).__init__(*args, **kwargs)
+        self.original_message = message
+        self.message = '%s : %s' % (self.__class__.__name__, message)
+
+    def __str__(self):
+        return self.message
+
+    def __reduce__(self):
+        # sent back from the worker processes
+        return (self.__class__, (self.original_message,))
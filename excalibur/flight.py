@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Coalescing of identical concurrent queries: while a query runs, the
+same queries wait for its data and errors instead of calling the
+plugins again.
+"""
+
+import collections
+import threading
+
+from excalibur.cache import freeze
+
+
+def query_key(query, configuration):
+    """
+    Identify the queries sharing their results: same configuration,
+    target, arguments and credentials.
+    """
+    return (configuration, query.project, query.source, query.ressource,
+            query.method, query.request_method, query.signature,
+            query.key_id, freeze(query.arguments))
+
+
+def shared_result(result):
+    """
+    Copy of the data and errors of a query, for each query sharing
+    them.
+    """
+    data, errors = result
+    return collections.OrderedDict(data), collections.OrderedDict(errors)
+
+
+class Flight(object):
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    """
+    Run function once for concurrent calls with the same key, the
+    other calls wait for its result or exception.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__flights = {}
+
+    def __len__(self):
+        return len(self.__flights)
+
+    def __call__(self, key, function):
+        """
+        Return (result, shared), shared when another call computed it.
+        """
+        with self.__lock:
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+            flight.done.set()
+        return flight.result, False
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled ip entries of the sources.
+Patterns are regular expressions matched against the beginning of the
+client ip, or networks in CIDR notation (10.0.0.0/8).
+Patterns written as plain ips stay regular expressions, they are only
+looked up in a set first so that known clients are found at once.
+"""
+
+from bisect import bisect_right
+import ipaddress
+import re
+
+import six
+
+# backreferences cannot be combined in a single expression
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def parse_network(pattern):
+    """
+    Network of a CIDR pattern, None for regular expressions.
+    """
+    if '/' not in pattern:
+        return None
+    try:
+        return ipaddress.ip_network(six.text_type(pattern), strict=False)
+    except ValueError:
+        return None
+
+
+def parse_ip(value):
+    try:
+        return ipaddress.ip_address(six.text_type(value))
+    except ValueError:
+        return None
+
+
+class NetworkRanges(object):
+
+    """
+    Networks as sorted and merged integer intervals, by ip version.
+    """
+
+    def __init__(self, networks):
+        self.ranges = {}
+        for version in set(network.version for network in networks):
+            intervals = sorted(
+                (int(network.network_address),
+                 int(network.broadcast_address))
+                for network in networks if network.version == version)
+            merged = [list(intervals[0])]
+            for start, end in intervals[1:]:
+                if start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.ranges[version] = (tuple(start for start, _ in merged),
+                                    tuple(end for _, end in merged))
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    __nonzero__ = __bool__
+
+    def __contains__(self, ip):
+        address = parse_ip(ip)
+        if address is None or address.version not in self.ranges:
+            return False
+        starts, ends = self.ranges[address.version]
+        value = int(address)
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+
+class Expressions(object):
+
+    """
+    Regular expressions compiled in a single alternation when possible.
+    """
+
+    def __init__(self, patterns):
+        self.regexes = ()
+        if not patterns:
+            return
+        try:
+            if any(BACKREFERENCE.search(pattern) for pattern in patterns):
+                raise re.error("backreference")
+            self.regexes = (re.compile(
+                "|".join("(?:%s)" % pattern for pattern in patterns)),)
+        except re.error:
+            self.regexes = tuple(re.compile(pattern) for pattern in patterns)
+
+    def match(self, ip):
+        for regex in self.regexes:
+            if regex.match(ip) is not None:
+                return True
+        return False
+
+
+class IPMatcher(object):
+
+    """
+    Compiled ip entry of a source.
+    """
+
+    def __init__(self, patterns):
+        networks = []
+        expressions = []
+        exact = set()
+        for pattern in patterns:
+            network = parse_network(pattern)
+            if network is not None:
+                networks.append(network)
+                continue
+            expressions.append(pattern)
+            if parse_ip(pattern) is not None:
+                exact.add(pattern)
+        self.exact = frozenset(exact)
+        self.networks = NetworkRanges(networks)
+        self.expressions = Expressions(expressions)
+
+    def match(self, ip):
+        if ip in self.exact:
+            return True
+        if self.networks and ip in self.networks:
+            return True
+        return self.expressions.match(ip)
+
+
+class IPAllowList(object):
+
+    """
+    The client ip has to be allowed by each of the ip entries,
+    which happens when a request targets many sources.
+    """
+
+    def __init__(self, ip_lists):
+        matchers = {}
+        for ip_list in ip_lists:
+            patterns = tuple(ip_list)
+            if patterns not in matchers:
+                matchers[patterns] = IPMatcher(patterns)
+        self.matchers = tuple(matchers.values())
+
+    def match(self, ip):
+        for matcher in self.matchers:
+            if not matcher.match(ip):
+                return False
+        return True
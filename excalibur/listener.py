@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the requests of a PluginsRunner. A listener given
+to the runner receives the duration of each stage; without listener
+the stages are not timed.
+"""
+
+
+class PipelineListener(object):
+
+    """
+    Receives the duration of the stages of the requests, in seconds
+    measured with a monotonic clock, and the exception raised by the
+    stage if any. Methods are called in the threads running the
+    requests, and must be quick. Subclasses override the stages they
+    need.
+    """
+
+    def check(self, query, name, seconds, error=None):
+        """
+        A check of the validation plan: CheckACL, CheckArguments,
+        CheckRequest or CheckSource, or MatchSources, the sources of a
+        multiple sources or all request matching its signature.
+        """
+
+    def decode(self, query, argument_name, seconds, error=None):
+        """
+        The decoding of an argument.
+        """
+
+    def plugin_load(self, plugin_name, seconds, error=None):
+        """
+        Getting an instance of a plugin, imported and created if needed.
+        """
+
+    def plugin_call(self, query, plugin_name, parameters_index, seconds,
+                    error=None):
+        """
+        The call of a plugin method with a parameters set.
+        """
+
+
+class Listeners(PipelineListener):
+
+    """
+    Forward the timings to several listeners.
+    """
+
+    def __init__(self, *listeners):
+        self.listeners = list(listeners)
+
+    def check(self, *args, **kwargs):
+        for listener in self.listeners:
+            listener.check(*args, **kwargs)
+
+    def decode(self, *args, **kwargs):
+        for listener in self.listeners:
+            listener.decode(*args, **kwargs)
+
+    def plugin_load(self, *args, **kwargs):
+        for listener in self.listeners:
+            listener.plugin_load(*args, **kwargs)
+
+    def plugin_call(self, *args, **kwargs):
+        for listener in self.listeners:
+            listener.plugin_call(*args, **kwargs)
@@ -3,37 +3,130 @@
 Class to load configuration and plugins
 """
 
+from excalibur import conf
 from excalibur.exceptions import ExcaliburError, ConfigurationLoaderError,\
     PluginLoaderError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
 import importlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+from six.moves import cPickle as pickle
+from six.moves import reload_module
 import yaml
 
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
+# libyaml parser when pyyaml was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+logger = logging.getLogger(__name__)
+
 
 class ConfigurationLoader(object):
 
     """
     load config from yaml
+    With a snapshot_dir, the parsed content of a file is saved in a
+    snapshot, and read from it as long as the file's mtime and content
+    hash are unchanged. Snapshots are pickles: the directory must only
+    be writable by the application.
     """
 
-    def __init__(self, myyaml, raw_yaml_content=False, key=None):
+    # changed when the snapshots format changes
+    snapshot_version = 1
+
+    def __init__(self, myyaml, raw_yaml_content=False, key=None,
+                 snapshot_dir=None):
         """
         Load yaml file, or raw yaml if raw_yaml_content is True
         """
-        prefix = ""
-        if key:
-            prefix = """!!python/object:excalibur.conf.""" + key.title() + """
-"""
         try:
             if not raw_yaml_content:
-                with open(myyaml, "r") as configuration_file:
-                    self.__content = yaml.load(
-                        prefix + configuration_file.read())
+                content = self.load_file(myyaml, snapshot_dir)
             else:
-                self.__content = yaml.load(prefix + myyaml)
+                content = yaml.load(myyaml, Loader=YAML_LOADER)
+            self.__content = self.build(content, key)
         except Exception as e:
             raise ConfigurationLoaderError(
                 "error with the configuration loader: %s" % myyaml)
 
+    @staticmethod
+    def build(content, key):
+        """
+        Instance of the excalibur.conf class named after key, holding
+        the top-level entries of content. content itself without key.
+        """
+        if not key:
+            return content
+        if not isinstance(content, dict):
+            raise ConfigurationLoaderError("%s is not a mapping" % key)
+        cls = getattr(conf, key.title())
+        instance = cls.__new__(cls)
+        instance.__dict__.update(content)
+        return instance
+
+    def load_file(self, path, snapshot_dir=None):
+        with open(path, "rb") as configuration_file:
+            raw = configuration_file.read()
+        if snapshot_dir is None:
+            return yaml.load(raw, Loader=YAML_LOADER)
+
+        mtime = os.stat(path).st_mtime
+        digest = hashlib.sha1(raw).hexdigest()
+        snapshot = self.snapshot_path(path, snapshot_dir)
+        try:
+            with open(snapshot, "rb") as snapshot_file:
+                version, snapshot_mtime, snapshot_digest, content =\
+                    pickle.load(snapshot_file)
+            if (version, snapshot_mtime, snapshot_digest) ==\
+                    (self.snapshot_version, mtime, digest):
+                return content
+        except Exception:
+            # missing, outdated or corrupted snapshot
+            pass
+
+        content = yaml.load(raw, Loader=YAML_LOADER)
+        self.write_snapshot(snapshot, (self.snapshot_version, mtime,
+                                       digest, content))
+        return content
+
+    @staticmethod
+    def snapshot_path(path, snapshot_dir):
+        name = hashlib.sha1(
+            os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(snapshot_dir, name + ".snapshot")
+
+    @staticmethod
+    def write_snapshot(snapshot, data):
+        """
+        Write the snapshot atomically, failures only cost a parsing
+        on the next load.
+        """
+        try:
+            directory = os.path.dirname(snapshot)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            descriptor, temporary = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(descriptor, "wb") as snapshot_file:
+                    pickle.dump(data, snapshot_file,
+                                pickle.HIGHEST_PROTOCOL)
+                os.rename(temporary, snapshot)
+            except Exception:
+                os.remove(temporary)
+                raise
+        except Exception:
+            pass
+
     @property
     def content(self):
         """
@@ -46,21 +139,306 @@ class PluginLoader(object):
 
     """
     Create plugin instance
+    The lifecycle decides how instances are shared between requests:
+    - request: a new instance each time a plugin is required
+    - singleton: one instance per plugin
+    - thread: one instance per plugin and per thread
+    - pool: at most pool_size instances per plugin, checked out
+      by get_plugin and given back by release
+    Plugins may define setup() and teardown() methods, called
+    when an instance is created and when it is discarded.
+    The plugins with executor: process run in the worker processes
+    of get_process_pool.
     """
 
-    def __init__(self, plugin_module):
+    lifecycles = ('request', 'singleton', 'thread', 'pool')
+
+    def __init__(self, plugin_module, lifecycle='request', pool_size=4,
+                 process_workers=None):
+        if lifecycle not in self.lifecycles:
+            raise PluginLoaderError("unknown plugin lifecycle %s" % lifecycle)
         self.plugin_module = plugin_module
+        self.lifecycle = lifecycle
+        self.pool_size = pool_size
+        # PipelineListener timing get_plugin
+        self.listener = None
+        # number of worker processes, the number of CPUs by default
+        self.process_workers = process_workers
+        self.__process_pool = None
+        self.__lock = threading.RLock()
+        self.__classes = {}
+        self.__instances = {}
+        self.__local = threading.local()
+        self.__thread_instances = []
+        self.__pools = {}
+        self.__checked_out = {}
 
     def get_plugin(self, plugin_name):
         """
         return plugin instance
+        Instances obtained this way should be given back with release.
         """
+        listener = self.listener
+        if listener is None:
+            return self.acquire_plugin(plugin_name)
+        start = monotonic()
+        try:
+            instance = self.acquire_plugin(plugin_name)
+        except Exception as e:
+            listener.plugin_load(plugin_name, monotonic() - start, e)
+            raise
+        listener.plugin_load(plugin_name, monotonic() - start)
+        return instance
+
+    def acquire_plugin(self, plugin_name):
+        """
+        get_plugin for the lifecycle, untimed
+        """
+        if self.lifecycle == 'singleton':
+            with self.__lock:
+                if plugin_name not in self.__instances:
+                    self.__instances[plugin_name] = self.create_plugin(
+                        plugin_name)
+                return self.__instances[plugin_name]
+        elif self.lifecycle == 'thread':
+            instances = self.__local.__dict__.setdefault('instances', {})
+            if plugin_name not in instances:
+                instances[plugin_name] = self.create_plugin(plugin_name)
+                with self.__lock:
+                    self.__thread_instances.append(
+                        (plugin_name, instances[plugin_name]))
+            return instances[plugin_name]
+        elif self.lifecycle == 'pool':
+            with self.__lock:
+                if plugin_name not in self.__pools:
+                    self.__pools[plugin_name] = PluginPool(
+                        plugin_name, self.create_plugin, self.pool_size)
+                pool = self.__pools[plugin_name]
+            instance = pool.checkout()
+            with self.__lock:
+                self.__checked_out[id(instance)] = pool
+            return instance
+        return self.create_plugin(plugin_name)
+
+    def release(self, plugin_name, instance):
+        """
+        give back an instance obtained with get_plugin
+        A failing teardown is logged: release is called once the plugin
+        answered, its results are kept.
+        """
+        try:
+            if self.lifecycle == 'pool':
+                with self.__lock:
+                    pool = self.__checked_out.pop(id(instance), None)
+                if pool is not None:
+                    pool.checkin(instance)
+            elif self.lifecycle == 'request':
+                teardown_plugin(plugin_name, instance)
+        except PluginLoaderError as e:
+            logger.error("%s", e)
+
+    @contextmanager
+    def plugin(self, plugin_name):
+        """
+        get_plugin and release as a context manager
+        """
+        instance = self.get_plugin(plugin_name)
+        try:
+            yield instance
+        finally:
+            self.release(plugin_name, instance)
+
+    def get_plugin_class(self, plugin_name):
+        """
+        return plugin class, imported once
+        """
+        try:
+            return self.__classes[plugin_name]
+        except KeyError:
+            pass
         try:
             module = importlib.import_module(
                 "%s.%s" % (self.plugin_module, plugin_name))
             plugin = getattr(module, plugin_name)
-            return plugin()
         except Exception as e:
             raise PluginLoaderError(
                 "Plugin %s failed to load: %s" % (plugin_name, e))
-    
+        self.__classes[plugin_name] = plugin
+        return plugin
+
+    def create_plugin(self, plugin_name):
+        """
+        instantiate the plugin and call its setup method if any
+        """
+        plugin = self.get_plugin_class(plugin_name)
+        try:
+            instance = plugin()
+            setup = getattr(instance, 'setup', None)
+            if callable(setup):
+                setup()
+            return instance
+        except Exception as e:
+            raise PluginLoaderError(
+                "Plugin %s failed to load: %s" % (plugin_name, e))
+
+    def warmup(self, plugin_names, instantiate=False, max_workers=None):
+        """
+        Import the plugins in a thread pool, and with instantiate get
+        one instance of each, kept by the singleton and pool lifecycles.
+        Return {plugin name: {"import": seconds, "instantiate": seconds,
+        "error": PluginLoaderError}}, None when not measured or no error.
+        """
+        def load(plugin_name):
+            report = {"import": None, "instantiate": None, "error": None}
+            try:
+                start = monotonic()
+                self.get_plugin_class(plugin_name)
+                report["import"] = monotonic() - start
+                if instantiate:
+                    start = monotonic()
+                    with self.plugin(plugin_name):
+                        pass
+                    report["instantiate"] = monotonic() - start
+            except PluginLoaderError as e:
+                report["error"] = e
+            return report
+
+        plugin_names = list(OrderedDict.fromkeys(plugin_names))
+        if not plugin_names:
+            return OrderedDict()
+        executor = ThreadPoolExecutor(max_workers or min(len(plugin_names),
+                                                         32))
+        try:
+            reports = list(executor.map(load, plugin_names))
+        finally:
+            executor.shutdown(wait=True)
+        return OrderedDict(zip(plugin_names, reports))
+
+    def get_process_pool(self):
+        """
+        return the ProcessPool of the plugins with executor: process,
+        created on first use
+        """
+        with self.__lock:
+            if self.__process_pool is None:
+                if sys.version_info < (3, 7):
+                    raise PluginLoaderError(
+                        "executor: process requires Python 3.7 or later")
+                # the process module imports the loader
+                from excalibur.process import ProcessPool
+                self.__process_pool = ProcessPool(self.plugin_module,
+                                                  self.process_workers)
+            return self.__process_pool
+
+    def close(self):
+        """
+        teardown all the cached instances and stop the worker processes
+        Pooled instances still checked out are torn down when released.
+        """
+        with self.__lock:
+            instances = list(self.__instances.items()) +\
+                self.__thread_instances
+            pools = list(self.__pools.values())
+            process_pool = self.__process_pool
+            self.__instances = {}
+            self.__thread_instances = []
+            self.__local = threading.local()
+            self.__pools = {}
+            self.__process_pool = None
+        if process_pool is not None:
+            process_pool.shutdown()
+        for pool in pools:
+            instances += pool.close()
+        errors = []
+        for plugin_name, instance in instances:
+            try:
+                teardown_plugin(plugin_name, instance)
+            except PluginLoaderError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def reload(self):
+        """
+        drop all the instances and reimport the plugins modules,
+        typically after a deployment
+        """
+        self.close()
+        with self.__lock:
+            classes = self.__classes
+            self.__classes = {}
+        for plugin_name, plugin in classes.items():
+            try:
+                reload_module(importlib.import_module(plugin.__module__))
+            except Exception as e:
+                raise PluginLoaderError(
+                    "Plugin %s failed to load: %s" % (plugin_name, e))
+
+
+class PluginPool(object):
+
+    """
+    Bounded pool of instances of a plugin
+    """
+
+    def __init__(self, plugin_name, factory, size):
+        self.plugin_name = plugin_name
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.created = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def checkout(self):
+        """
+        return an idle instance, create one if the pool is not full,
+        wait for an instance to be released otherwise
+        """
+        with self.condition:
+            while not self.idle and self.created >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return self.factory(self.plugin_name)
+        except Exception:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+
+    def checkin(self, instance):
+        with self.condition:
+            if not self.closed:
+                self.idle.append(instance)
+                self.condition.notify()
+                return
+            self.created -= 1
+            self.condition.notify()
+        teardown_plugin(self.plugin_name, instance)
+
+    def close(self):
+        """
+        return the idle instances, which have to be torn down
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.created -= len(idle)
+            self.condition.notify_all()
+        return [(self.plugin_name, instance) for instance in idle]
+
+
+def teardown_plugin(plugin_name, instance):
+    """
+    call the plugin's teardown method if any
+    """
+    teardown = getattr(instance, 'teardown', None)
+    if callable(teardown):
+        try:
+            teardown()
+        except Exception as e:
+            raise PluginLoaderError(
+                "Plugin %s failed to teardown: %s" % (plugin_name, e))
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregated metrics of the requests of a PluginsRunner: latency
+histograms and counters with a fixed memory footprint, rendered in the
+Prometheus text format or as a dict.
+"""
+
+import bisect
+import threading
+
+from excalibur.exceptions import ExcaliburClientError
+from excalibur.listener import PipelineListener
+from excalibur.utils import ALL_KEYWORD, SOURCE_SEPARATOR
+
+# upper bounds in seconds of the histograms buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+PLUGIN_LABELS = ("project", "source", "plugin", "ressource", "method")
+
+
+class Histogram(object):
+
+    """
+    Observations counted in fixed buckets, plus their count and sum.
+    Not thread-safe by itself, the registry holds the lock.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # the last count is for the observations above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def buckets(self):
+        """
+        Cumulative (upper bound, count), the last bound being "+Inf".
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+def metric_source(query):
+    """
+    Source label of a query. Multiple sources and all requests are
+    counted together, the list of sources is chosen by the client.
+    """
+    if query.source == ALL_KEYWORD or SOURCE_SEPARATOR in query.source:
+        return ALL_KEYWORD
+    return query.source
+
+
+def escape(value):
+    return ("%s" % ("" if value is None else value)).replace(
+        "\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def labels(names, values, **extra):
+    pairs = list(zip(names, values)) + sorted(extra.items())
+    return "{%s}" % ",".join('%s="%s"' % (name, escape(value))
+                             for name, value in pairs)
+
+
+class MetricsRegistry(PipelineListener):
+
+    """
+    Listener aggregating the timings of a runner:
+    - a latency histogram and success and error counters per project,
+      source, plugin, ressource and method
+    - a latency histogram per check
+    - a counter per ExcaliburClientError subclass raised by the checks
+    Labels only take values allowed by the configuration, so the memory
+    used does not grow with the traffic.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        # {PLUGIN_LABELS values: [Histogram, successes, errors]}
+        self.__plugins = {}
+        # {check name: Histogram}
+        self.__checks = {}
+        # {error class name: count}
+        self.__rejections = {}
+
+    def check(self, query, name, seconds, error=None):
+        with self.__lock:
+            histogram = self.__checks.get(name)
+            if histogram is None:
+                histogram = self.__checks[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if isinstance(error, ExcaliburClientError):
+                error_name = error.__class__.__name__
+                self.__rejections[error_name] =\
+                    self.__rejections.get(error_name, 0) + 1
+
+    def plugin_call(self, query, plugin_name, parameters_index, seconds,
+                    error=None):
+        key = (query.project, metric_source(query), plugin_name,
+               query.ressource, query.method)
+        with self.__lock:
+            metric = self.__plugins.get(key)
+            if metric is None:
+                metric = self.__plugins[key] = [Histogram(self.buckets), 0, 0]
+            metric[0].observe(seconds)
+            metric[2 if error is not None else 1] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__plugins.clear()
+            self.__checks.clear()
+            self.__rejections.clear()
+
+    def as_dict(self):
+        """
+        {"plugins": [{labels..., "count", "sum", "buckets", "success",
+        "error"}], "checks": {check name: {"count", "sum", "buckets"}},
+        "rejections": {error class name: count}}
+        """
+        def histogram_dict(histogram):
+            return {"count": histogram.count, "sum": histogram.sum,
+                    "buckets": histogram.buckets()}
+
+        with self.__lock:
+            plugins = []
+            for key in sorted(self.__plugins, key=repr):
+                histogram, successes, errors = self.__plugins[key]
+                metric = dict(zip(PLUGIN_LABELS, key))
+                metric.update(histogram_dict(histogram))
+                metric.update(success=successes, error=errors)
+                plugins.append(metric)
+            return {
+                "plugins": plugins,
+                "checks": dict((name, histogram_dict(histogram))
+                               for name, histogram in self.__checks.items()),
+                "rejections": dict(self.__rejections)}
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        metrics = self.as_dict()
+        lines = []
+
+        def histogram_lines(name, names, values, metric):
+            for bound, count in metric["buckets"]:
+                lines.append("%s_bucket%s %s" % (
+                    name, labels(names, values, le=bound), count))
+            lines.append("%s_sum%s %r" % (name, labels(names, values),
+                                          metric["sum"]))
+            lines.append("%s_count%s %s" % (name, labels(names, values),
+                                            metric["count"]))
+
+        lines.extend([
+            "# HELP excalibur_plugin_call_seconds Duration of the plugins "
+            "calls.",
+            "# TYPE excalibur_plugin_call_seconds histogram"])
+        for metric in metrics["plugins"]:
+            histogram_lines("excalibur_plugin_call_seconds", PLUGIN_LABELS,
+                            [metric[name] for name in PLUGIN_LABELS], metric)
+        lines.extend([
+            "# HELP excalibur_plugin_calls_total Plugins calls by outcome.",
+            "# TYPE excalibur_plugin_calls_total counter"])
+        for metric in metrics["plugins"]:
+            values = [metric[name] for name in PLUGIN_LABELS]
+            for outcome in ("success", "error"):
+                lines.append("excalibur_plugin_calls_total%s %s" % (
+                    labels(PLUGIN_LABELS, values, outcome=outcome),
+                    metric[outcome]))
+        lines.extend([
+            "# HELP excalibur_check_seconds Duration of the checks.",
+            "# TYPE excalibur_check_seconds histogram"])
+        for name in sorted(metrics["checks"]):
+            histogram_lines("excalibur_check_seconds", ("check",), (name,),
+                            metrics["checks"][name])
+        lines.extend([
+            "# HELP excalibur_rejections_total Requests rejected by the "
+            "checks, by error.",
+            "# TYPE excalibur_rejections_total counter"])
+        for name in sorted(metrics["rejections"]):
+            lines.append("excalibur_rejections_total%s %s" % (
+                labels(("error",), (name,)), metrics["rejections"][name]))
+        return "\n".join(lines) + "\n"
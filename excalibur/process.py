@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Execution of the plugins declared with executor: process in their
+plugins_options, for CPU bound work: their methods run in a pool of
+worker processes, each keeping one instance per plugin.
+Only the plugin's name, parameters sets, arguments and data are sent
+to the workers, pickled once with the highest protocol, and its data,
+exceptions and timings are sent back.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing.util import Finalize
+import pickle
+import threading
+
+from excalibur.exceptions import CircuitOpenError, PluginProcessError
+from excalibur.loader import PluginLoader
+from excalibur.utils import format_error, monotonic, record_result
+
+# PluginLoader of a worker process, keeping the plugins instances
+_worker_loader = None
+
+
+def init_worker(plugins_module):
+    global _worker_loader
+    _worker_loader = PluginLoader(plugins_module, lifecycle='singleton')
+    # teardown the instances when the worker exits
+    Finalize(_worker_loader, _worker_loader.close, exitpriority=10)
+
+
+def sendable(error):
+    """
+    The exception, or a PluginProcessError when it does not survive
+    pickling.
+    """
+    try:
+        pickle.loads(pickle.dumps(error, pickle.HIGHEST_PROTOCOL))
+        return error
+    except Exception:
+        return PluginProcessError("%s: %s" % (error.__class__.__name__,
+                                              error))
+
+
+def run_call(payload):
+    """
+    Run in a worker the parameters sets of a plugin call without
+    result, and return the pickled [(index, data, exception, seconds)].
+    """
+    (plugin_name, data_key, function_name, parameters_sets, results,
+     arguments, data, source, project, remaining) = pickle.loads(payload)
+    deadline = monotonic() + remaining if remaining is not None else None
+    outcomes = []
+    with _worker_loader.plugin(plugin_name) as plugin:
+        function = getattr(plugin, function_name, None)
+        for index, parameters in enumerate(parameters_sets):
+            result = results[index]
+            if result is not None or function is None:
+                if result is not None and result[0] is not None:
+                    data[data_key] = result[0]
+                continue
+            kwargs = {"data": data, "source": source, "project": project}
+            if deadline is not None:
+                kwargs["timeout"] = max(deadline - monotonic(), 0)
+            start = monotonic()
+            try:
+                plugin_data = function(parameters, arguments, **kwargs)
+                error = None
+            except Exception as e:
+                plugin_data, error = None, sendable(e)
+            outcomes.append((index, plugin_data, error, monotonic() - start))
+            if plugin_data is not None:
+                data[data_key] = plugin_data
+    return pickle.dumps(outcomes, pickle.HIGHEST_PROTOCOL)
+
+
+class ProcessPool(object):
+
+    """
+    Worker processes of a runner, started with its first process
+    plugin call. Workers are spawned rather than forked, the runner
+    having threads.
+    """
+
+    def __init__(self, plugins_module, max_workers=None, mp_context=None):
+        self.plugins_module = plugins_module
+        self.max_workers = max_workers
+        self.mp_context = mp_context or multiprocessing.get_context("spawn")
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def executor(self):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=self.mp_context,
+                    initializer=init_worker, initargs=(self.plugins_module,))
+            return self.__executor
+
+    def submit(self, call, query, data, results, deadline=None):
+        """
+        Future of the pickled outcomes of run_call.
+        """
+        payload = pickle.dumps(
+            (call.plugin_name, call.data_key, call.function_name,
+             call.parameters_sets, results, query.arguments, data,
+             query.source, query.project,
+             deadline - monotonic() if deadline is not None else None),
+            pickle.HIGHEST_PROTOCOL)
+        try:
+            return self.executor().submit(run_call, payload)
+        except BrokenProcessPool:
+            # a worker died, the next pool replaces it
+            self.restart()
+            return self.executor().submit(run_call, payload)
+
+    def restart(self):
+        """
+        Stop the workers, new ones are started by the next call, with
+        the plugins modules imported again.
+        """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def prepare_call(call, query):
+    """
+    (cache keys, results) of a call before it is sent to a worker:
+    the cached (data, error) of its parameters sets, and the errors of
+    those whose circuit breaker is open. None for the others.
+    """
+    keys = None
+    results = [None] * len(call.parameters_sets)
+    if call.cache is not None:
+        keys = call.cache.keys(query, call)
+        results = [call.cache.get(key) for key in keys]
+    if call.breakers is not None:
+        for index, breaker in enumerate(call.breakers):
+            if results[index] is None:
+                try:
+                    breaker.check()
+                except CircuitOpenError as e:
+                    results[index] = (None, format_error(query, e, index))
+    return keys, results
+
+
+def record_outcomes(plugin_loader, call, query, keys, results, outcomes,
+                    data, errors):
+    """
+    Register the results of a call, updating its cache, circuit
+    breakers and listener with the outcomes of the worker.
+    """
+    listener = plugin_loader.listener
+    for index, plugin_data, error, seconds in outcomes:
+        breaker = call.breakers[index] if call.breakers is not None\
+            else None
+        if listener is not None:
+            listener.plugin_call(query, call.plugin_name, index, seconds,
+                                 error)
+        if error is not None:
+            if breaker is not None:
+                breaker.failure(error)
+            results[index] = (None, format_error(query, error, index))
+        else:
+            if breaker is not None:
+                breaker.success()
+            results[index] = (plugin_data, None)
+        if keys is not None:
+            call.cache.set(keys[index], results[index])
+    if call.breakers is not None:
+        # the parameters sets sent without outcome
+        for index, result in enumerate(results):
+            if result is None:
+                call.breakers[index].release()
+    for result in results:
+        if result is not None:
+            record_result(call, result, data, errors)
+    return data, errors
+
+
+def call_process_plugin(plugin_loader, call, query, data, errors,
+                        deadline=None):
+    """
+    call_plugin in a worker process of the plugin loader's process pool.
+    Errors of the pool itself are reported without parameters index.
+    """
+    keys, results = prepare_call(call, query)
+    outcomes = []
+    if None in results:
+        try:
+            pool = plugin_loader.get_process_pool()
+            outcomes = pickle.loads(
+                pool.submit(call, query, data, results, deadline).result())
+        except BrokenProcessPool as e:
+            pool.restart()
+            errors[call.plugin_name] = format_error(query, e, None)
+        except Exception as e:
+            errors[call.plugin_name] = format_error(query, e, None)
+    return record_outcomes(plugin_loader, call, query, keys, results,
+                           outcomes, data, errors)
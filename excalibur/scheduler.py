@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent execution of the plugins of a query.
+"""
+
+import collections
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from excalibur.exceptions import PluginRunnerError
+from excalibur.utils import PLUGIN_NAME_SEPARATOR, call_deadline,\
+    call_plugin, get_ident, monotonic, separator_contained,\
+    set_plugin_name, timeout_result
+
+
+def plugins_dependencies(plugin_loader, names):
+    """
+    Map each plugin to the plugins it depends on. With multiple
+    sources, a plugin depends on the plugins of its own source.
+    Raise a PluginRunnerError on circular dependencies.
+    """
+    def source_of(name):
+        return name.split(PLUGIN_NAME_SEPARATOR)[0]\
+            if separator_contained(name) else None
+
+    dependencies = {}
+    for name in names:
+        plugin = plugin_loader.get_plugin_class(set_plugin_name(name))
+        required = getattr(plugin, 'depends_on', ())
+        dependencies[name] = [
+            other for other in names if other != name and
+            set_plugin_name(other) in required and
+            source_of(other) == source_of(name)]
+
+    resolved = set()
+    pending = list(names)
+    while pending:
+        ready = [name for name in pending
+                 if resolved.issuperset(dependencies[name])]
+        if not ready:
+            raise PluginRunnerError(
+                "circular dependencies between plugins %s" % pending)
+        resolved.update(ready)
+        pending = [name for name in pending if name not in resolved]
+    return dependencies
+
+
+class PluginScheduler(object):
+
+    """
+    Runs the plugins of a query in a thread pool and returns the same
+    ordered data and errors as a sequential run.
+    Plugins reading the data argument declare the plugins they need
+    with a depends_on class attribute, a list of plugin names. They are
+    started once those plugins are done and receive their data only.
+    A plugin running for more than its timeout (or timeout seconds), or
+    beyond the request's deadline, is reported in errors with a
+    PluginTimeoutError, its thread is left to finish in the pool and
+    the timeout is counted by its circuit breakers.
+    """
+
+    def __init__(self, executor, plugin_loader, timeout=None):
+        self.executor = executor
+        self.plugin_loader = plugin_loader
+        self.timeout = timeout
+
+    def run_plugin(self, call, query, data, deadlines, threads, deadline):
+        threads[call.name] = get_ident()
+        deadlines[call.name] = call_deadline(
+            call.timeout if call.timeout is not None else self.timeout,
+            deadline)
+        return call_plugin(self.plugin_loader, call, query, data,
+                           collections.OrderedDict(), deadlines[call.name])
+
+    def __call__(self, query, calls, deadline=None):
+        """
+        Run the PluginCall of a query, by the monotonic() deadline of
+        the request if any.
+        """
+        calls = collections.OrderedDict((call.name, call) for call in calls)
+        names = list(calls.keys())
+        dependencies = plugins_dependencies(self.plugin_loader, names)
+        results = {}
+        pending = list(names)
+        running = {}
+        # {name: monotonic() time by which the started plugin answers}
+        deadlines = {}
+        # {name: ident of the thread running the plugin}
+        threads = {}
+
+        while pending or running:
+            if deadline is not None and monotonic() >= deadline:
+                # the plugins waiting for others are not started
+                for name in pending:
+                    results[name] = timeout_result(
+                        query, name,
+                        "did not answer before the request deadline")
+                pending = []
+            # Start the plugins whose dependencies are done, in order
+            for name in [name for name in pending if
+                         all(d in results for d in dependencies[name])]:
+                pending.remove(name)
+                received = collections.OrderedDict()
+                for other in names:
+                    if other in dependencies[name]:
+                        received.update(results[other][0])
+                # the plugin adds its own data to received
+                received_names = set(received)
+                future = self.executor.submit(
+                    self.run_plugin, calls[name], query, received, deadlines,
+                    threads, deadline)
+                running[future] = (name, received_names)
+
+            done, _ = wait(running, timeout=self.next_timeout(
+                running, deadlines, calls, deadline),
+                return_when=FIRST_COMPLETED)
+            for future in done:
+                name, received_names = running.pop(future)
+                data, errors = future.result()
+                results[name] = (collections.OrderedDict(
+                    (k, v) for k, v in data.items()
+                    if k not in received_names), errors)
+            now = monotonic()
+            for future, (name, _) in list(running.items()):
+                # plugins still queued in the pool only have the
+                # request's deadline
+                end = deadlines.get(name, deadline)
+                if end is not None and now >= end:
+                    del running[future]
+                    future.cancel()
+                    results[name] = timeout_result(
+                        query, name, self.timeout_message(
+                            calls[name], end, deadline),
+                        calls[name].breakers, threads.get(name))
+
+        data, errors = collections.OrderedDict(), collections.OrderedDict()
+        for name in names:
+            data.update(results[name][0])
+            errors.update(results[name][1])
+        return data, errors
+
+    def timeout_message(self, call, end, deadline):
+        if end == deadline:
+            return "did not answer before the request deadline"
+        return "did not answer within %ss" % (
+            call.timeout if call.timeout is not None else self.timeout)
+
+    def next_timeout(self, running, deadlines, calls, deadline=None):
+        """
+        Time left before the first running plugin times out.
+        """
+        now = monotonic()
+        ends = [] if deadline is None else [deadline]
+        for name, _ in running.values():
+            if name in deadlines:
+                if deadlines[name] is not None:
+                    ends.append(deadlines[name])
+                continue
+            # not started yet: its deadline is at least its timeout away
+            timeout = calls[name].timeout if calls[name].timeout is not None\
+                else self.timeout
+            if timeout is not None:
+                ends.append(now + timeout)
+        return max(0, min(ends) - now) if ends else None
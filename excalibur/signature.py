@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Signature verification.
+A signature is the sha1 of the api key followed by the sorted
+arguments names and values (see utils.add_args_then_encode).
+The sha1 state of each api key is computed once when the
+configuration is compiled; a request only hashes its arguments,
+serialized once whatever the number of keys to try.
+"""
+
+import collections
+import hashlib
+import threading
+
+
+def canonical_arguments(arguments):
+    """
+    The arguments part of the signed string, as bytes.
+    """
+    return "".join(name + arguments[name]
+                   for name in sorted(arguments)).encode("utf-8")
+
+
+def api_keys_list(entry):
+    """
+    apikey entry of a source as a list, None if it cannot be compiled
+    """
+    api_keys = entry['apikey']
+    api_keys = api_keys if type(api_keys) is list else [api_keys]
+    if not all(isinstance(api_key, str) for api_key in api_keys):
+        return None
+    return api_keys
+
+
+class SignatureVerifier(object):
+
+    """
+    Verify signatures made with any of a set of api keys.
+    With cache_size, the last verified (signature, arguments) pairs are
+    kept so that repeated requests skip hashing.
+    """
+
+    def __init__(self, api_keys, cache_size=0):
+        self.digests = tuple(hashlib.sha1(api_key.encode("utf-8"))
+                             for api_key in api_keys)
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def signatures(self, canonical):
+        """
+        Expected signatures for canonical arguments.
+        """
+        signatures = []
+        for digest in self.digests:
+            digest = digest.copy()
+            digest.update(canonical)
+            signatures.append(digest.hexdigest())
+        return signatures
+
+    def verify(self, signature, canonical):
+        if not self.cache_size:
+            return signature in self.signatures(canonical)
+
+        key = (signature, canonical)
+        with self.lock:
+            if key in self.cache:
+                self.cache[key] = self.cache.pop(key)
+                return True
+        if signature not in self.signatures(canonical):
+            return False
+        with self.lock:
+            self.cache[key] = True
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return True
+
+    @classmethod
+    def for_sources(cls, sources, cache_size=0):
+        """
+        Verifiers of all the sources, by source name.
+        None if a source has no valid apikey entry.
+        """
+        verifiers = collections.OrderedDict()
+        for name, entry in sources.items():
+            try:
+                api_keys = api_keys_list(entry)
+            except (KeyError, TypeError):
+                return None
+            if api_keys is None:
+                return None
+            verifiers[name] = cls(api_keys, cache_size)
+        return verifiers
+
+
+def key_id_index(sources, verifiers):
+    """
+    Verifiers by key id then by source name, for the sources
+    registering one or many key ids in a key_id entry.
+    """
+    index = {}
+    for name, entry in sources.items():
+        key_ids = entry.get('key_id', [])
+        for key_id in key_ids if type(key_ids) is list else [key_ids]:
+            index.setdefault(key_id, collections.OrderedDict())[name] =\
+                verifiers[name]
+    return index
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming execution of the plugins of a query: their data is yielded
+as it is produced instead of being gathered in one dict.
+"""
+
+import collections
+
+import six
+
+from excalibur.exceptions import PluginTimeoutError
+from excalibur.utils import call_deadline, call_function, format_error,\
+    monotonic, timed_call, timeout_result
+
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
+
+
+def stream_plugin(plugin_loader, call, query, data, errors, end=None,
+                  message=None):
+    """
+    Generator counterpart of utils.call_plugin, yielding (data key,
+    chunk): each item of an iterator returned by the plugin, other data
+    at once. Iterators are not added to data, the next plugins only
+    receive the other data.
+    end is the monotonic() time by which the plugin answers. The plugin
+    runs in the thread iterating, so it is not interrupted: once late,
+    its data and next chunks are dropped and it is reported with a
+    PluginTimeoutError and message, counted by its circuit breaker.
+    """
+    def late():
+        return end is not None and monotonic() >= end
+
+    def timed_out(breaker):
+        if breaker is not None:
+            breaker.failure(PluginTimeoutError("%s %s" % (call.name,
+                                                          message)))
+        errors.update(timeout_result(query, call.name, message)[1])
+
+    listener = plugin_loader.listener
+    breakers = call.breakers
+    with plugin_loader.plugin(call.plugin_name) as plugin:
+        function = getattr(plugin, call.function_name, None)
+        if function is None:
+            return
+        for index, parameters in enumerate(call.parameters_sets):
+            if late():
+                errors.update(timeout_result(query, call.name, message)[1])
+                return
+            breaker = breakers[index] if breakers is not None else None
+            try:
+                if breaker is not None:
+                    breaker.check()
+                if listener is None:
+                    plugin_data = call_function(function, parameters, query,
+                                                data, end)
+                else:
+                    # iterators are timed until they are returned
+                    plugin_data = timed_call(listener, function,
+                                             call.plugin_name, index,
+                                             parameters, query, data, end)
+            except Exception as e:
+                if breaker is not None:
+                    breaker.failure(e)
+                errors[call.plugin_name] = format_error(query, e, index)
+                continue
+            if late():
+                close_iterator(plugin_data)
+                timed_out(breaker)
+                return
+            if not isinstance(plugin_data, Iterator):
+                if breaker is not None:
+                    breaker.success()
+                if plugin_data is not None:
+                    data[call.data_key] = plugin_data
+                    yield call.data_key, plugin_data
+                continue
+            try:
+                for chunk in plugin_data:
+                    if late():
+                        close_iterator(plugin_data)
+                        timed_out(breaker)
+                        return
+                    yield call.data_key, chunk
+            except GeneratorExit:
+                # closed by the consumer
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except Exception as e:
+                if breaker is not None:
+                    breaker.failure(e)
+                # the chunks already yielded are kept
+                errors[call.plugin_name] = format_error(query, e, index)
+            else:
+                if breaker is not None:
+                    breaker.success()
+
+
+def close_iterator(plugin_data):
+    close = getattr(plugin_data, 'close', None)
+    if isinstance(plugin_data, Iterator) and callable(close):
+        close()
+
+
+class PluginStream(six.Iterator):
+
+    """
+    Iterate over the (plugin name, chunk) of the plugins of a query,
+    run one after the other when the previous one is exhausted.
+    errors is filled as plugins fail, and complete once the iteration
+    is over. Plugins are stopped at their timeout (or plugin_timeout
+    seconds) or the monotonic() deadline of the request, see
+    stream_plugin.
+    """
+
+    def __init__(self, plugin_loader, query, calls, deadline=None,
+                 plugin_timeout=None):
+        self.query = query
+        self.errors = collections.OrderedDict()
+        self.deadline = deadline
+        self.plugin_timeout = plugin_timeout
+        self.__events = self.events(plugin_loader, calls)
+
+    def events(self, plugin_loader, calls):
+        data = collections.OrderedDict()
+        for call in calls:
+            timeout = call.timeout if call.timeout is not None\
+                else self.plugin_timeout
+            end = call_deadline(timeout, self.deadline)
+            message = "did not answer before the request deadline"\
+                if end is not None and end == self.deadline\
+                else "did not answer within %ss" % timeout
+            for event in stream_plugin(plugin_loader, call, self.query,
+                                       data, self.errors, end, message):
+                yield event
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.__events)
+
+    def close(self):
+        """
+        Stop the plugin in progress and release its instance.
+        """
+        self.__events.close()
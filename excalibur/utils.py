@@ -2,15 +2,33 @@
 """
 Cross-classes utils
 """
+import collections
+import copy
 from functools import reduce
 import hashlib
 import traceback
-import re
-from excalibur.exceptions import WrongSignatureError
+from excalibur.exceptions import CircuitOpenError, PluginLoaderError,\
+    PluginTimeoutError, WrongSignatureError
+from excalibur.ip import IPAllowList
+from excalibur.signature import canonical_arguments
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
 
 ALL_KEYWORD = "all"
 PLUGIN_NAME_SEPARATOR = "|"
 SOURCE_SEPARATOR = ","
+# suffix of the vectorized ressource_method functions of the plugins
+BATCH_SUFFIX = "_batch"
+# executor in plugins_options of the plugins run in worker processes
+PROCESS_EXECUTOR = "process"
 
 
 def add_args_then_encode(x, y, arguments):
@@ -108,14 +126,14 @@ def ip_found_in_sources(source, sources, request_ip):
     """
     checks if the ip is found in sources.
     """
-    ip_authorized = True
+    return ip_found_in_lists(get_ip_entry(source, sources), request_ip)
 
-    all_ip_lists = get_ip_entry(source, sources)
 
-    for ip_list in all_ip_lists:
-        if not [ip for ip in ip_list if re.match(ip, request_ip)]:
-            ip_authorized = False
-    return ip_authorized
+def ip_found_in_lists(all_ip_lists, request_ip):
+    """
+    checks if the ip matches at least one pattern of every list.
+    """
+    return IPAllowList(all_ip_lists).match(request_ip)
 
 
 def get_api_keys_by_sources(sources, targets):
@@ -129,11 +147,78 @@ def get_api_keys_by_sources(sources, targets):
     return {target: get_keys(target) for target in targets}
 
 
-def get_data(plugin, f_name, parameters, query, data):
+def get_data(plugin, f_name, parameters, query, data, deadline=None):
     f = getattr(plugin, f_name)
+    if deadline is not None:
+        return call_function(f, parameters, query, data, deadline)
     return f(parameters, query.arguments, data=data, source=query.source, project=query.project)
 
 
+def call_function(function, parameters, query, data, deadline=None):
+    """
+    Call a plugin function. With a deadline, the seconds left are given
+    as timeout keyword argument, for the plugin's own backend calls.
+    """
+    if deadline is None:
+        return function(parameters, query.arguments, data=data,
+                        source=query.source, project=query.project)
+    return function(parameters, query.arguments, data=data,
+                    source=query.source, project=query.project,
+                    timeout=max(deadline - monotonic(), 0))
+
+
+def call_deadline(timeout, deadline=None):
+    """
+    monotonic() time by which a plugin starting now has to answer,
+    within timeout seconds and the request's deadline. None when not
+    limited.
+    """
+    if timeout is None:
+        return deadline
+    end = monotonic() + timeout
+    return end if deadline is None else min(end, deadline)
+
+
+def timeout_result(query, name, message, breakers=None, ident=None):
+    """
+    (data, errors) of a plugin reported with a PluginTimeoutError.
+    With the circuit breakers of the plugin, the timeout is counted as
+    a failure of the call running in the thread ident.
+    """
+    error = PluginTimeoutError("%s %s" % (name, message))
+    if breakers is not None and ident is not None:
+        for breaker in breakers:
+            breaker.timeout(ident, error)
+    return (collections.OrderedDict(), collections.OrderedDict(
+        [(set_plugin_name(name), format_error(query, error, None))]))
+
+
+def thread_call(threads, function, *args):
+    """
+    Call function in a thread of a pool, appending the ident of the
+    thread to the list threads, for the circuit breakers.
+    """
+    threads.append(get_ident())
+    return function(*args)
+
+
+def timed_call(listener, function, plugin_name, index, parameters, query,
+               data, deadline=None):
+    """
+    Call a plugin function, giving its duration to a PipelineListener.
+    """
+    start = monotonic()
+    try:
+        plugin_data = call_function(function, parameters, query, data,
+                                    deadline)
+    except Exception as e:
+        listener.plugin_call(query, plugin_name, index, monotonic() - start,
+                             e)
+        raise
+    listener.plugin_call(query, plugin_name, index, monotonic() - start)
+    return plugin_data
+
+
 def set_targeted_sources(t, name, value, args, sign):
     api_keys = get_api_keys(value, args)
     if sign in api_keys:
@@ -141,7 +226,11 @@ def set_targeted_sources(t, name, value, args, sign):
 
 
 def get_sources_for_all(signature, data_project,
-                        arguments, check_signature):
+                        arguments, check_signature, verifiers=None):
+    """
+    verifiers are the signature.SignatureVerifier of the project's
+    sources by name, used instead of hashing every api key from scratch.
+    """
 
     apikey_present = [it["apikey"]
                       for it in list(data_project["sources"].values())
@@ -149,8 +238,14 @@ def get_sources_for_all(signature, data_project,
 
     if apikey_present and check_signature:
         sources = {}
-        [set_targeted_sources(sources, name, value, arguments, signature) for
-         name, value in data_project["sources"].items()]
+        if verifiers is not None:
+            canonical = canonical_arguments(arguments)
+            for name, verifier in verifiers.items():
+                if verifier.verify(signature, canonical):
+                    sources[name] = data_project["sources"][name]
+        else:
+            [set_targeted_sources(sources, name, value, arguments, signature)
+             for name, value in data_project["sources"].items()]
         if not sources:
             raise WrongSignatureError(signature)
         return sources
@@ -196,33 +291,311 @@ def plugin_data_format(plugin_data, data, bool, raw_plugin_name, plugin_name):
 
 
 def data_or_errors(plugin_loader, plugin_name, query, parameters_sets, data,
-                   errors):
+                   errors, deadline=None, breakers=None):
     """
     real core of the application that tries to execute the plugin's code or 
     continue
+    breakers are the CircuitBreaker of the parameters sets, if any.
     """
     f_name = query.function_name
     raw_plugin_name = plugin_name
     separated = separator_contained(plugin_name)
     plugin_name = set_plugin_name(plugin_name)
-    plugin = plugin_loader.get_plugin(plugin_name)
+    listener = plugin_loader.listener
+
+    with plugin_loader.plugin(plugin_name) as plugin:
+        for index, parameters in enumerate(parameters_sets):
+            # Initialize returned data to None
+            plugin_data = None
+            if hasattr(plugin, f_name):
+                breaker = breakers[index] if breakers is not None else None
+                # Get data
+                try:
+                    if breaker is not None:
+                        breaker.check()
+                    if listener is None:
+                        plugin_data = get_data(plugin, f_name, parameters,
+                                               query, data, deadline)
+                    else:
+                        plugin_data = timed_call(
+                            listener, getattr(plugin, f_name), plugin_name,
+                            index, parameters, query, data, deadline)
+                    if breaker is not None:
+                        breaker.success()
+                # Or register exception
+                except Exception as e:
+                    if breaker is not None:
+                        breaker.failure(e)
+                    errors[plugin_name] = format_error(query, e, index)
+                # Register data by plugin name
+                data = plugin_data_format(plugin_data, data, separated,
+                                          raw_plugin_name, plugin_name)
+    return data, errors
+
+
+class PluginCall(object):
 
-    for index, parameters in enumerate(parameters_sets):
-        # Initialize returned data to None
-        plugin_data = None
-        if hasattr(plugin, f_name):
-            # Get data
+    """
+    Call of a plugin for a ressource method, computed once:
+    - name: the plugin's key in the plugins list, source|plugin for
+      multiple sources and all requests
+    - plugin_name: the plugin to load, also the key of its errors
+    - data_key: the key of its data
+    - implemented: whether the plugin class defines the function, None
+      when only an instance can tell
+    - cache: the PluginCache of its results, None when not cached
+    - batch: whether the plugin class defines the function suffixed
+      with _batch, called once for the queries of a batch
+    - timeout: seconds the plugin may run, from the plugins_options
+      entry of its source, None for the runner's plugin_timeout
+    - breakers: the CircuitBreaker of each parameters set, None
+      without breaker entry in its plugins_options
+    - process: whether it runs in the worker processes of the plugin
+      loader's process pool, from the executor of its plugins_options
+    """
+
+    __slots__ = ('name', 'plugin_name', 'data_key', 'function_name',
+                 'parameters_sets', 'implemented', 'cache', 'batch',
+                 'timeout', 'breakers', 'process')
+
+    def __init__(self, name, function_name, parameters_sets, implemented,
+                 cache=None, batch=False, timeout=None, breakers=None,
+                 process=False):
+        self.name = name
+        self.plugin_name = set_plugin_name(name)
+        self.data_key = name
+        self.function_name = function_name
+        self.parameters_sets = parameters_sets
+        self.implemented = implemented
+        self.cache = cache
+        self.batch = batch
+        self.timeout = timeout
+        self.breakers = breakers
+        self.process = process
+
+
+def plugin_timeout(options, plugin_name):
+    """
+    timeout of a plugin in the plugins_options entry of a source:
+        plugins_options:
+            Plugin1:
+                timeout: 2.5
+    """
+    try:
+        return options[plugin_name]['timeout']
+    except (KeyError, TypeError):
+        return None
+
+
+def plugin_executor(options, plugin_name):
+    """
+    executor of a plugin in the plugins_options entry of a source,
+    process to run it in worker processes:
+        plugins_options:
+            Plugin1:
+                executor: process
+    """
+    try:
+        return options[plugin_name]['executor']
+    except (KeyError, TypeError):
+        return None
+
+
+def plugin_calls(plugin_loader, plugins, function_name, cache=None,
+                 options=None, breakers=None):
+    """
+    PluginCall of the plugins, without those whose class does not
+    define function_name. options is the plugins_options entry of
+    their source, breakers the circuit breakers of its plugins.
+    """
+    calls = []
+    for name, parameters_sets in plugins.items():
+        try:
+            plugin = plugin_loader.get_plugin_class(set_plugin_name(name))
+            implemented = hasattr(plugin, function_name) or (
+                None if hasattr(plugin, '__getattr__') else False)
+            batch = implemented is True and\
+                hasattr(plugin, function_name + BATCH_SUFFIX)
+        except PluginLoaderError:
+            # raised when the request runs
+            implemented = None
+            batch = False
+        if implemented is not False:
+            plugin_name = set_plugin_name(name)
+            calls.append(PluginCall(
+                name, function_name, parameters_sets, implemented, cache,
+                batch, plugin_timeout(options, plugin_name),
+                breakers.get(plugin_name) if breakers else None,
+                plugin_executor(options, plugin_name) == PROCESS_EXECUTOR))
+    return tuple(calls)
+
+
+def call_plugin(plugin_loader, call, query, data, errors, deadline=None):
+    """
+    data_or_errors for a PluginCall
+    deadline is the monotonic() time by which the plugin has to answer,
+    given to the plugin function as a timeout keyword argument.
+    """
+    if call.process:
+        from excalibur.process import call_process_plugin
+        return call_process_plugin(plugin_loader, call, query, data, errors,
+                                   deadline)
+    if call.implemented is None:
+        return data_or_errors(plugin_loader, call.name, query,
+                              call.parameters_sets, data, errors, deadline,
+                              call.breakers)
+    if call.cache is not None:
+        return call_cached_plugin(plugin_loader, call, query, data, errors,
+                                  deadline)
+
+    listener = plugin_loader.listener
+    breakers = call.breakers
+    with plugin_loader.plugin(call.plugin_name) as plugin:
+        function = getattr(plugin, call.function_name)
+        for index, parameters in enumerate(call.parameters_sets):
+            breaker = breakers[index] if breakers is not None else None
             try:
-                plugin_data = get_data(plugin, f_name, parameters, query, data)
-            # Or register exception
+                if breaker is not None:
+                    breaker.check()
+                if listener is None and deadline is None:
+                    plugin_data = function(parameters, query.arguments,
+                                           data=data, source=query.source,
+                                           project=query.project)
+                elif listener is None:
+                    plugin_data = call_function(function, parameters, query,
+                                                data, deadline)
+                else:
+                    plugin_data = timed_call(listener, function,
+                                             call.plugin_name, index,
+                                             parameters, query, data,
+                                             deadline)
             except Exception as e:
-                errors[plugin_name] = format_error(query, e, index)
-            # Register data by plugin name
-            data = plugin_data_format(plugin_data, data, separated,
-                                      raw_plugin_name, plugin_name)
+                if breaker is not None:
+                    breaker.failure(e)
+                errors[call.plugin_name] = format_error(query, e, index)
+                continue
+            if breaker is not None:
+                breaker.success()
+            if plugin_data is not None:
+                data[call.data_key] = plugin_data
+    return data, errors
+
+
+def record_result(call, result, data, errors):
+    """
+    Register the (data, error) of a plugin call.
+    """
+    plugin_data, error = result
+    if error is not None:
+        errors[call.plugin_name] = error
+    elif plugin_data is not None:
+        data[call.data_key] = plugin_data
+
+
+def call_cached_plugin(plugin_loader, call, query, data, errors,
+                       deadline=None):
+    """
+    call_plugin reading the results of its cache first, the plugin is
+    only instantiated when some are missing.
+    """
+    keys = call.cache.keys(query, call)
+    results = [call.cache.get(key) for key in keys]
+    if None not in results:
+        for result in results:
+            record_result(call, result, data, errors)
+        return data, errors
+
+    listener = plugin_loader.listener
+    breakers = call.breakers
+    with plugin_loader.plugin(call.plugin_name) as plugin:
+        function = getattr(plugin, call.function_name)
+        for index, parameters in enumerate(call.parameters_sets):
+            result = results[index]
+            if result is None:
+                breaker = breakers[index] if breakers is not None else None
+                try:
+                    if breaker is not None:
+                        breaker.check()
+                    if listener is None:
+                        plugin_data = call_function(function, parameters,
+                                                    query, data, deadline)
+                    else:
+                        plugin_data = timed_call(listener, function,
+                                                 call.plugin_name, index,
+                                                 parameters, query, data,
+                                                 deadline)
+                    result = (plugin_data, None)
+                except CircuitOpenError as e:
+                    # not cached, the plugin is called once closed
+                    record_result(call, (None, format_error(query, e, index)),
+                                  data, errors)
+                    continue
+                except Exception as e:
+                    result = (None, format_error(query, e, index))
+                    if breaker is not None:
+                        breaker.failure(e)
+                else:
+                    if breaker is not None:
+                        breaker.success()
+                call.cache.set(keys[index], result)
+            record_result(call, result, data, errors)
     return data, errors
 
 
+def call_plugin_batch(plugin_loader, call, queries, results, deadline=None):
+    """
+    Call the _batch function of a plugin once per parameters set with
+    the arguments of all the queries, which targets the same source,
+    ressource and method. It returns the data of each query, or an
+    exception reported in its errors. results are the (data, errors)
+    of the queries. With a deadline, the seconds left are given as
+    timeout keyword argument.
+    """
+    query = queries[0]
+    listener = plugin_loader.listener
+    breakers = call.breakers
+    with plugin_loader.plugin(call.plugin_name) as plugin:
+        function = getattr(plugin, call.function_name + BATCH_SUFFIX)
+        for index, parameters in enumerate(call.parameters_sets):
+            breaker = breakers[index] if breakers is not None else None
+            try:
+                if breaker is not None:
+                    breaker.check()
+                start = monotonic()
+                kwargs = {}
+                if deadline is not None:
+                    kwargs["timeout"] = max(deadline - start, 0)
+                batch_data = function(
+                    parameters, [query.arguments for query in queries],
+                    data=[data for data, errors in results],
+                    source=query.source, project=query.project, **kwargs)
+                if listener is not None:
+                    # one timing for the queries of the batch
+                    listener.plugin_call(query, call.plugin_name, index,
+                                         monotonic() - start)
+                if len(batch_data) != len(queries):
+                    raise ValueError(
+                        "%s returned %s results for %s queries" % (
+                            call.function_name + BATCH_SUFFIX,
+                            len(batch_data), len(queries)))
+            except Exception as e:
+                if breaker is not None:
+                    breaker.failure(e)
+                for query, (data, errors) in zip(queries, results):
+                    errors[call.plugin_name] = format_error(query, e, index)
+                continue
+            if breaker is not None:
+                breaker.success()
+            for query, plugin_data, (data, errors) in zip(
+                    queries, batch_data, results):
+                if isinstance(plugin_data, Exception):
+                    errors[call.plugin_name] = format_error(
+                        query, plugin_data, index)
+                elif plugin_data is not None:
+                    data[call.data_key] = plugin_data
+    return results
+
+
 def dict_merge(d1, d2):
     """update first dict with second recursively"""
     d1 = d1 or {}
@@ -240,3 +613,25 @@ def get_nested_dict_value(d, keys, default=None):
         return reduce(dict.__getitem__ , keys, d)
     except (KeyError, TypeError):
         return default
+
+
+def method_arguments(ressources, sources, source, ressource, method):
+    """
+    Arguments of a ressource method updated with the arguments entry of
+    the source. The configuration is left untouched: the merge is made
+    on copies, and only when the source overrides arguments.
+    """
+    try:
+        targeted_ressource = ressources[ressource]
+    except (KeyError, TypeError):
+        targeted_ressource = None
+    arguments = get_nested_dict_value(targeted_ressource,
+                                      (method, 'arguments'))
+    try:
+        source_arguments = sources[source]['arguments']
+    except (KeyError, TypeError):
+        source_arguments = None
+    if not isinstance(arguments, dict) or not source_arguments:
+        return arguments
+    return dict_merge(copy.deepcopy(arguments),
+                      copy.deepcopy(source_arguments))
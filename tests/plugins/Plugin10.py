@@ -0,0 +1,18 @@
+import time
+
+
+class Plugin10(object):
+
+    # number of queries of each batch call
+    batches = []
+
+    def actions_action1(self, parameters, arguments, *args, **kwargs):
+        return "p10ok1 %s" % arguments["login"]
+
+    def actions_action1_batch(self, parameters, arguments_list, *args,
+                              **kwargs):
+        Plugin10.batches.append(len(arguments_list))
+        time.sleep(parameters.get("sleep", 0))
+        return [ValueError("unknown login") if arguments["login"] == "fail"
+                else "p10ok1 %s" % arguments["login"]
+                for arguments in arguments_list]
@@ -0,0 +1,11 @@
+import time
+
+
+class Plugin11(object):
+
+    def actions_action1(self, parameters, arguments, *args, **kwargs):
+        for row in range(parameters["rows"]):
+            if row == parameters.get("fail_at"):
+                raise ValueError("cannot read row %s" % row)
+            time.sleep(parameters.get("sleep", 0))
+            yield {"row": row, "login": arguments["login"]}
@@ -0,0 +1,18 @@
+import asyncio
+import time
+
+
+class Plugin12(object):
+
+    # timeout keyword argument of each call
+    timeouts = []
+
+    def actions_action1(self, parameters, arguments, *args, **kwargs):
+        Plugin12.timeouts.append(kwargs.get("timeout"))
+        time.sleep(parameters.get("sleep", 0))
+        return "p12ok1"
+
+    async def actions_action2(self, parameters, arguments, *args, **kwargs):
+        Plugin12.timeouts.append(kwargs.get("timeout"))
+        await asyncio.sleep(parameters.get("sleep", 0))
+        return "p12ok2"
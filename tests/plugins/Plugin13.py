@@ -0,0 +1,11 @@
+class Plugin13(object):
+
+    # spores of the calls, and of the backends down
+    calls = []
+    down = set()
+
+    def actions_action1(self, parameters, arguments, *args, **kwargs):
+        Plugin13.calls.append(parameters["spore"])
+        if parameters["spore"] in Plugin13.down:
+            raise IOError("%s is down" % parameters["spore"])
+        return "p13ok1 %s" % parameters["spore"]
@@ -0,0 +1,24 @@
+import os
+
+
+class BackendError(Exception):
+
+    def __init__(self, backend, code):
+        super(BackendError, self).__init__("%s answered %s" % (backend,
+                                                               code))
+
+
+class Plugin14(object):
+
+    def setup(self):
+        self.calls = 0
+
+    def actions_action1(self, parameters, arguments, *args, **kwargs):
+        self.calls += 1
+        if parameters.get("fail") == "value":
+            raise ValueError("p14 wrong value")
+        if parameters.get("fail") == "backend":
+            raise BackendError("backend14", 500)
+        return {"pid": os.getpid(), "calls": self.calls,
+                "data": sorted(kwargs["data"]),
+                "timeout": kwargs.get("timeout") is not None}
@@ -0,0 +1,13 @@
+class Plugin4(object):
+
+    setups = 0
+    teardowns = 0
+
+    def setup(self):
+        Plugin4.setups += 1
+
+    def teardown(self):
+        Plugin4.teardowns += 1
+
+    def actions_action1(self, parameters, *args, **kwargs):
+        return "p4ok1"
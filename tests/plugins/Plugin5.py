@@ -0,0 +1,13 @@
+import threading
+import time
+
+
+class Plugin5(object):
+
+    # (instance id, thread ident) of each call
+    calls = []
+
+    def actions_action1(self, parameters, *args, **kwargs):
+        Plugin5.calls.append((id(self), threading.current_thread().ident))
+        time.sleep(parameters.get('sleep', 0))
+        return "p5ok1"
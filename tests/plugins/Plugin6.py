@@ -0,0 +1,6 @@
+class Plugin6(object):
+
+    depends_on = ['Plugin5']
+
+    def actions_action1(self, parameters, arguments, data=None, **kwargs):
+        return "p6 read %s" % data.get('Plugin5')
@@ -0,0 +1,18 @@
+import asyncio
+
+
+class Plugin7(object):
+
+    cancelled = False
+
+    async def actions_action1(self, parameters, *args, **kwargs):
+        await asyncio.sleep(parameters.get('sleep', 0))
+        return "p7ok1"
+
+    async def actions_action2(self, parameters, *args, **kwargs):
+        try:
+            await asyncio.sleep(parameters.get('sleep', 0) * 10)
+        except asyncio.CancelledError:
+            Plugin7.cancelled = True
+            raise
+        return "p7ok2"
@@ -0,0 +1,6 @@
+class Plugin8(object):
+
+    def __getattr__(self, name):
+        if name == "actions_action1":
+            return lambda parameters, *args, **kwargs: "p8ok1"
+        raise AttributeError(name)
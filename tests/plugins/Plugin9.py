@@ -0,0 +1,16 @@
+import time
+
+
+class Plugin9(object):
+
+    # (method, spore) of each call
+    calls = []
+
+    def actions_action1(self, parameters, arguments, *args, **kwargs):
+        Plugin9.calls.append(("action1", parameters["spore"]))
+        time.sleep(parameters.get("sleep", 0))
+        return "p9ok1 %s" % arguments["login"]
+
+    def actions_action2(self, parameters, *args, **kwargs):
+        Plugin9.calls.append(("action2", parameters["spore"]))
+        raise Exception("error plugin 9 action 2 !")
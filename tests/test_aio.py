@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import WrongSignatureError
+from excalibur.utils import monotonic
+
+
+class AsyncRunnerTest(TestCase):
+
+    def setUp(self):
+        self.query = Query(source="etab1",
+                           remote_ip="127.0.0.1",
+                           signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                           arguments={"login": "testzombie1", },
+                           ressource="actions",
+                           method="action1",
+                           request_method="GET"
+                           )
+        self.query2 = Query(source="etab1",
+                            remote_ip="127.0.0.1",
+                            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                            arguments={"login": "testzombie1", },
+                            ressource="actions",
+                            method="action2",
+                            request_method="GET"
+                            )
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_async.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            plugin_timeout=0.5)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_acall(self):
+        start = monotonic()
+        data, errors = self.loop.run_until_complete(
+            self.plugin_runner.acall(self.query))
+        # Plugin5 and Plugin7 wait concurrently
+        self.assertLess(monotonic() - start, 0.2)
+        self.assertListEqual(['Plugin6', 'Plugin7', 'Plugin5', 'Plugin1'],
+                             list(data.keys()))
+        self.assertEqual(data['Plugin6'], 'p6 read p5ok1')
+        self.assertEqual(data['Plugin7'], 'p7ok1')
+        self.assertEqual(errors, {})
+
+    def test_acall_checks(self):
+        query = Query(source="etab1",
+                      remote_ip="127.0.0.1",
+                      signature="ERROR",
+                      arguments={"login": "testzombie1", },
+                      ressource="actions",
+                      method="action1",
+                      request_method="GET"
+                      )
+        with self.assertRaises(WrongSignatureError):
+            self.loop.run_until_complete(self.plugin_runner.acall(query))
+
+    def test_arun_timeout_and_errors(self):
+        data, errors = self.loop.run_until_complete(
+            self.plugin_runner.arun(self.query2))
+        self.assertEqual(data, {})
+        self.assertEqual(errors['Plugin1']['error_message'],
+                         'error plugin 1 action 2 !')
+        self.assertEqual(errors['Plugin7']['error'], 'PluginTimeoutError')
+        self.assertTrue(
+            self.plugin_runner.plugin_loader.get_plugin_class(
+                'Plugin7').cancelled)
+
+    def test_thread_lifecycle(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_async.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            plugin_lifecycle="thread",
+            max_workers=8)
+        self.addCleanup(plugin_runner.close)
+        calls = plugin_runner.plugin_loader.get_plugin_class("Plugin5").calls
+        del calls[:]
+
+        async def acalls():
+            return await asyncio.gather(*[plugin_runner.acall(self.query)
+                                          for _ in range(8)])
+
+        for data, errors in self.loop.run_until_complete(acalls()):
+            self.assertEqual(data["Plugin5"], "p5ok1")
+        # each instance is used by the thread it belongs to
+        threads = {}
+        for instance, thread in calls:
+            threads.setdefault(instance, set()).add(thread)
+        self.assertEqual(len(calls), 8)
+        self.assertGreater(len(threads), 1)
+        self.assertTrue(all(len(idents) == 1
+                            for idents in threads.values()))
+
+
+if __name__ == '__main__':
+    main()
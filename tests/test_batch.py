@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import IPNotAuthorizedError, NoACLMatchedError,\
+    PluginLoaderError
+from excalibur.utils import monotonic
+
+
+class RunBatchTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_batch.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+        self.batches()[:] = []
+
+    def batches(self):
+        return self.plugin_runner.plugin_loader.get_plugin_class(
+            "Plugin10").batches
+
+    def query(self, source="etab1", login="testzombie1", method="action1",
+              remote_ip="127.0.0.1"):
+        return Query(source=source,
+                     remote_ip=remote_ip,
+                     arguments={"login": login, },
+                     ressource="actions",
+                     method=method,
+                     request_method="GET")
+
+    def test_run_batch(self):
+        results = self.plugin_runner.run_batch([
+            self.query(),
+            self.query("etab2"),
+            self.query(login="testzombie2"),
+            self.query(remote_ip="10.0.0.1"),
+            self.query(login="fail"),
+            self.query("etab2", method="action2")])
+        self.assertEqual(results[0], (
+            {"Plugin1": "p1ok1", "Plugin10": "p10ok1 testzombie1"}, {}))
+        self.assertEqual(results[1], ({"Plugin1": "p1ok1"}, {}))
+        self.assertEqual(results[2][0]["Plugin10"], "p10ok1 testzombie2")
+        self.assertIsInstance(results[3], IPNotAuthorizedError)
+        data, errors = results[4]
+        self.assertEqual(data, {"Plugin1": "p1ok1"})
+        self.assertEqual(errors["Plugin10"]["error_message"], "unknown login")
+        self.assertEqual(errors["Plugin10"]["arguments"], {"login": "fail"})
+        self.assertIsInstance(results[5], NoACLMatchedError)
+        # one call for the 3 accepted queries of etab1
+        self.assertEqual(self.batches(), [3])
+
+    def test_plugin_error_per_query(self):
+        results = self.plugin_runner.run_batch([
+            self.query("etab3"), self.query(), self.query("etab3")])
+        self.assertIsInstance(results[0], PluginLoaderError)
+        self.assertIsInstance(results[2], PluginLoaderError)
+        self.assertEqual(results[1][0]["Plugin1"], "p1ok1")
+
+    def test_batch_timeout(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_batch_timeout.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+        start = monotonic()
+        results = plugin_runner.run_batch([self.query(), self.query()])
+        self.assertLess(monotonic() - start, 0.4)
+        for data, errors in results:
+            self.assertEqual(data, {"Plugin1": "p1ok1"})
+            self.assertEqual(errors["Plugin10"]["error"],
+                             "PluginTimeoutError")
+
+    def test_same_results_as_calls(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl_projects.yml",
+            "./tests/data/sources_projects.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+        queries = [self.query(source) for source in ("etab1", "etab1,etab2",
+                                                     "etab1", "all")]
+        for query in queries:
+            query["project"] = "project1"
+        expected = [plugin_runner(query) for query in queries]
+        self.assertEqual(plugin_runner.run_batch(queries, max_workers=2),
+                         expected)
+
+
+    def test_runner_pool(self):
+        # queries running in the runner's pool would wait for each other
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl_projects.yml",
+            "./tests/data/sources_projects.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False,
+            max_workers=2)
+        self.addCleanup(plugin_runner.close)
+        queries = [self.query("all") for _ in range(4)] +\
+            [self.query("etab1")]
+        for query in queries:
+            query["project"] = "project1"
+        expected = [plugin_runner(query) for query in queries]
+        self.assertEqual(plugin_runner.run_batch(queries), expected)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from unittest import TestCase, main
+
+from excalibur.breaker import CircuitBreaker, breaker_options
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import CircuitOpenError, PluginTimeoutError
+from excalibur.utils import get_ident
+
+
+class CircuitBreakerTest(TestCase):
+
+    def test_breaker_options(self):
+        self.assertIsNone(breaker_options(None, "Plugin1"))
+        self.assertIsNone(breaker_options({"Plugin1": {}}, "Plugin1"))
+        self.assertEqual(breaker_options({"Plugin1": {"breaker": True}},
+                                         "Plugin1"), {})
+
+    def test_states(self):
+        breaker = CircuitBreaker("Plugin1", 0, failures=2, open_seconds=0.05)
+        breaker.failure(IOError())
+        breaker.check()
+        self.assertEqual(breaker.state, "closed")
+        breaker.failure(IOError())
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.check()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half-open")
+        # a single call probes the backend
+        breaker.check()
+        with self.assertRaises(CircuitOpenError):
+            breaker.check()
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_failed_probe_opens(self):
+        breaker = CircuitBreaker("Plugin1", 0, failures=1, open_seconds=0.05)
+        breaker.failure(IOError())
+        time.sleep(0.06)
+        breaker.check()
+        breaker.failure(IOError())
+        self.assertEqual(breaker.state, "open")
+
+    def test_exceptions(self):
+        breaker = CircuitBreaker("Plugin1", 0, failures=1,
+                                 exceptions=["OSError"])
+        breaker.failure(ValueError())
+        self.assertEqual(breaker.state, "closed")
+        # subclasses are failures too
+        breaker.failure(ConnectionError())
+        self.assertEqual(breaker.state, "open")
+
+    def test_timeout(self):
+        breaker = CircuitBreaker("Plugin1", 0, failures=1, open_seconds=5)
+        # no call running in this thread
+        breaker.timeout(get_ident(), PluginTimeoutError("late"))
+        self.assertEqual(breaker.state, "closed")
+        breaker.check()
+        breaker.timeout(get_ident(), PluginTimeoutError("late"))
+        self.assertEqual(breaker.state, "open")
+        # the late call answering does not close the breaker
+        breaker.success()
+        self.assertEqual(breaker.state, "open")
+
+
+class RunnerBreakerTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_breaker.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+        self.plugin = self.plugin_runner.plugin_loader.get_plugin_class(
+            "Plugin13")
+        self.plugin.calls[:] = []
+        self.plugin.down.clear()
+        self.query = Query(source="etab1",
+                           remote_ip="127.0.0.1",
+                           arguments={"login": "testzombie1", },
+                           ressource="actions",
+                           method="action1",
+                           request_method="GET")
+
+    def test_open_parameters_set_fails_at_once(self):
+        self.plugin.down.add("backend1")
+        for _ in range(2):
+            data, errors = self.plugin_runner(self.query)
+            self.assertEqual(errors["Plugin13"]["error"], "OSError")
+        self.assertEqual(self.plugin.calls, ["backend1", "backend2"] * 2)
+        del self.plugin.calls[:]
+        data, errors = self.plugin_runner(self.query)
+        # backend2 has its own breaker
+        self.assertEqual(self.plugin.calls, ["backend2"])
+        self.assertEqual(data, {"Plugin13": "p13ok1 backend2",
+                                "Plugin1": "p1ok1"})
+        self.assertEqual(errors["Plugin13"]["error"], "CircuitOpenError")
+        self.assertEqual(errors["Plugin13"]["parameters_index"], 0)
+
+        # the probe closes the breaker once the backend is up
+        self.plugin.down.clear()
+        time.sleep(0.2)
+        self.assertEqual(self.plugin_runner(self.query)[1], {})
+        self.assertEqual(self.plugin_runner(self.query)[1], {})
+
+    def test_acall(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.plugin.down.add("backend2")
+        for _ in range(3):
+            data, errors = loop.run_until_complete(
+                self.plugin_runner.acall(self.query))
+        self.assertEqual(self.plugin.calls,
+                         ["backend1", "backend2"] * 2 + ["backend1"])
+        self.assertEqual(errors["Plugin13"]["error"], "CircuitOpenError")
+        self.assertEqual(errors["Plugin13"]["parameters_index"], 1)
+
+    def late_query(self):
+        return Query(source="etab2",
+                     remote_ip="127.0.0.1",
+                     arguments={"login": "testzombie1", },
+                     ressource="actions",
+                     method="action1",
+                     request_method="GET")
+
+    def test_timeout_opens(self):
+        for max_workers in (None, 2):
+            plugin_runner = PluginsRunner(
+                "./tests/data/acl.yml",
+                "./tests/data/sources_breaker.yml",
+                "./tests/data/ressources.yml",
+                "tests.plugins",
+                check_signature=False,
+                max_workers=max_workers)
+            self.addCleanup(plugin_runner.close)
+            errors = plugin_runner(self.late_query())[1]
+            self.assertEqual(errors["Plugin12"]["error"],
+                             "PluginTimeoutError")
+            # the late plugin answers, its timeout is still counted
+            time.sleep(0.35)
+            start = time.time()
+            errors = plugin_runner(self.late_query())[1]
+            self.assertEqual(errors["Plugin12"]["error"], "CircuitOpenError")
+            self.assertLess(time.time() - start, 0.05)
+
+    def test_acall_timeout_opens(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        errors = loop.run_until_complete(
+            self.plugin_runner.acall(self.late_query()))[1]
+        self.assertEqual(errors["Plugin12"]["error"], "PluginTimeoutError")
+        errors = loop.run_until_complete(
+            self.plugin_runner.acall(self.late_query()))[1]
+        self.assertEqual(errors["Plugin12"]["error"], "CircuitOpenError")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest import TestCase, main
+
+from excalibur.cache import MISSING, CacheBackend, MemoryCache, freeze
+from excalibur.core import PluginsRunner, Query
+
+
+class SharedCache(CacheBackend):
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key):
+        return self.store.get(key, MISSING)
+
+    def set(self, key, value, ttl=None):
+        self.store[key] = value
+
+    def clear(self):
+        self.store.clear()
+
+
+class MemoryCacheTest(TestCase):
+
+    def test_lru(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        # b is the least recently used
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = MemoryCache()
+        cache.set("a", 1, ttl=0)
+        cache.set("b", 2, ttl=300)
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(cache.get("b"), 2)
+        cache.clear()
+        self.assertIs(cache.get("b"), MISSING)
+
+    def test_freeze(self):
+        self.assertEqual(freeze({"b": ["1", "2"], "a": "0"}),
+                         freeze({"a": "0", "b": ["1", "2"]}))
+        self.assertNotEqual(freeze({"a": ["1", "2"]}),
+                            freeze({"a": ["2", "1"]}))
+
+
+class PluginCacheTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_cache.yml",
+            "./tests/data/ressourceswithcache.yml",
+            "tests.plugins",
+            check_signature=False)
+        self.calls()[:] = []
+
+    def calls(self):
+        return self.plugin_runner.plugin_loader.get_plugin_class(
+            "Plugin9").calls
+
+    def query(self, source="etab1", method="action1", login="testzombie1"):
+        return Query(source=source,
+                     remote_ip="127.0.0.1",
+                     arguments={"login": login, },
+                     ressource="actions",
+                     method=method,
+                     request_method="GET")
+
+    def test_cached_results(self):
+        data, errors = self.plugin_runner(self.query())
+        self.assertEqual(data, {"Plugin9": "p9ok1 testzombie1"})
+        self.assertEqual(self.plugin_runner(self.query()), (data, errors))
+        # one call per parameters set
+        self.assertEqual(self.calls(), [("action1", "S3CR3T"),
+                                         ("action1", "S3CR3T2")])
+        self.plugin_runner(self.query(login="testzombie2"))
+        self.assertEqual(len(self.calls()), 4)
+
+    def test_max_entries(self):
+        for login in ("testzombie1", "testzombie1", "testzombie2"):
+            self.plugin_runner(self.query(login=login))
+        self.assertEqual(len(self.calls()), 4)
+        # 2 entries: the parameters sets of the last arguments
+        self.plugin_runner(self.query(login="testzombie1"))
+        self.assertEqual(len(self.calls()), 6)
+
+    def test_errors_not_cached(self):
+        data, errors = self.plugin_runner(self.query(method="action2"))
+        self.assertEqual(errors["Plugin9"]["error_message"],
+                         "error plugin 9 action 2 !")
+        self.plugin_runner(self.query(method="action2"))
+        self.assertEqual(len(self.calls()), 4)
+
+    def test_source_override(self):
+        self.plugin_runner(self.query("etab2"))
+        self.plugin_runner(self.query("etab2"))
+        self.assertEqual(len(self.calls()), 2)
+
+    def test_reload(self):
+        self.plugin_runner(self.query())
+        self.plugin_runner.reload_plugins()
+        self.assertFalse(self.plugin_runner.configuration.caches)
+        self.plugin_runner(self.query())
+        # the reimported plugin is called
+        self.assertEqual(len(self.calls()), 2)
+
+    def test_shared_backend(self):
+        store = {}
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_cache.yml",
+            "./tests/data/ressourceswithcache.yml",
+            "tests.plugins",
+            check_signature=False,
+            cache_backend=lambda max_entries: SharedCache(store))
+        plugin_runner(self.query())
+        self.assertEqual(len(store), 2)
+        self.assertEqual(self.plugin_runner(self.query()),
+                         plugin_runner(self.query()))
+        self.assertEqual(len(self.calls()), 4)
+
+    def test_acall(self):
+        loop = asyncio.new_event_loop()
+        try:
+            data, errors = loop.run_until_complete(
+                self.plugin_runner.acall(self.query()))
+            self.assertEqual(
+                loop.run_until_complete(
+                    self.plugin_runner.acall(self.query())),
+                (data, errors))
+        finally:
+            loop.close()
+        self.assertEqual(data, {"Plugin9": "p9ok1 testzombie1"})
+        self.assertEqual(len(self.calls()), 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,14 +10,17 @@ import six
 from excalibur.decode import DecodeArguments
 from excalibur.loader import ConfigurationLoader
 from excalibur.check import CheckSource, CheckACL, CheckRequest, \
-    CheckArguments, Check
+    CheckArguments, Check, ValidationPlan, RuntimeCheck,\
+    register_argument_check, unregister_argument_check
 from excalibur.exceptions import SourceNotFoundError, IPNotAuthorizedError,\
     WrongSignatureError, NoACLMatchedError, RessourceNotFoundError,\
     MethodNotFoundError, HTTPMethodError, ArgumentError, \
     ArgumentCheckMethodNotFoundError, ExcaliburError, \
-    DecodeAlgorithmNotFoundError
+    DecodeAlgorithmNotFoundError, CheckMethodError
 from excalibur.core import PluginsRunner, Query
-from excalibur.utils import ALL_KEYWORD
+from excalibur.utils import ALL_KEYWORD, add_args_then_encode
+from excalibur.signature import SignatureVerifier, canonical_arguments
+from excalibur.ip import IPMatcher, IPAllowList
 
 
 class CheckTest(TestCase):
@@ -888,6 +891,374 @@ class CheckTest(TestCase):
             error = e
         self.assertIsNone(error)
 
+    def test_overwritten_args_per_source(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_with_overwritten_args_per_etab.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+
+        def query(source):
+            return Query(
+                source=source,
+                remote_ip="127.0.0.1",
+                arguments={'login': 'zombie'},
+                ressource="actions",
+                method="action1",
+                request_method="GET"
+            )
+        for _ in range(2):
+            with self.assertRaises(ArgumentError):
+                plugin_runner(query("etab1"))
+            plugin_runner(query("etab2"))
+            with self.assertRaises(ArgumentError):
+                CheckArguments(query("etab1"), plugin_runner.ressources,
+                               plugin_runner.sources(None), None)()
+            CheckArguments(query("etab2"), plugin_runner.ressources,
+                           plugin_runner.sources(None), None)()
+        self.assertEqual(
+            plugin_runner.ressources["actions"]["action1"]["arguments"],
+            {"login": {"checks": {"min length": 2, "max length": 50}}})
+
+    def test_decoding_leaves_arguments_untouched(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressourceswithencodingrequired.yml",
+            "tests.plugins",
+            check_signature=False)
+        arguments = {"login": base64.b64encode(b"testzombie1")}
+        for check in (plugin_runner.validation_plan(self.query3),
+                      lambda query: CheckArguments(
+                          query, plugin_runner.ressources, None, None)()):
+            query = Query(
+                source="etab1",
+                remote_ip="127.0.0.1",
+                arguments=arguments,
+                ressource="actions",
+                method="action1",
+                request_method="GET")
+            check(query)
+            self.assertEqual(query.arguments["login"], "testzombie1")
+            self.assertEqual(arguments["login"],
+                             base64.b64encode(b"testzombie1"))
+
+
+class ValidationPlanTest(TestCase):
+
+    def setUp(self):
+        self.query = Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+            arguments={"login": "testzombie1", },
+            ressource="actions",
+            method="action1",
+            request_method="GET"
+        )
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+
+    def test_plan_compiled_and_cached(self):
+        plan = self.plugin_runner.validation_plan(self.query)
+        self.assertIsInstance(plan, ValidationPlan)
+        self.assertTrue(plan.compiled)
+        self.assertEqual(plan.key, (None, "etab1", "actions", "action1"))
+        self.assertFalse([stage for stage in plan.stages
+                          if isinstance(stage, RuntimeCheck)])
+        self.assertIs(plan, self.plugin_runner.validation_plan(self.query))
+
+    def test_plan_checks_each_request(self):
+        self.plugin_runner(self.query)
+        query = Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            signature="ERROR",
+            arguments={"login": "testzombie1", },
+            ressource="actions",
+            method="action1",
+            request_method="GET"
+        )
+        with self.assertRaises(WrongSignatureError):
+            self.plugin_runner(query)
+        query = Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+            arguments={"login": "t", },
+            ressource="actions",
+            method="action1",
+            request_method="GET"
+        )
+        with self.assertRaises(ArgumentError):
+            self.plugin_runner(query)
+        query = Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+            arguments={"login": "testzombie1", },
+            ressource="actions",
+            method="action1",
+            request_method="POST"
+        )
+        with self.assertRaises(HTTPMethodError):
+            self.plugin_runner(query)
+
+    def test_plan_invalid_configuration_not_cached(self):
+        query = Query(
+            source="etabnull",
+            remote_ip="127.0.0.1",
+            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+            arguments={"login": "testzombie1", },
+            ressource="actions",
+            method="action1",
+            request_method="GET"
+        )
+        plan = self.plugin_runner.validation_plan(query)
+        self.assertFalse(plan.compiled)
+        self.assertIsNot(plan, self.plugin_runner.validation_plan(query))
+        with self.assertRaises(NoACLMatchedError):
+            self.plugin_runner(query)
+
+    def test_plan_decodes_arguments(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressourceswithencodingrequired.yml",
+            "tests.plugins",
+            check_signature=False)
+        query = Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            arguments={"login": base64.b64encode(b"testzombie1")},
+            ressource="actions",
+            method="action1",
+            request_method="GET")
+        plugin_runner.validation_plan(query)(query)
+        self.assertEqual(query.arguments["login"], "testzombie1")
+
+
+class ArgumentChecksTest(TestCase):
+
+    def setUp(self):
+        register_argument_check(
+            "is email", lambda expected: lambda value:
+            ("@" in value) == expected)
+
+        @register_argument_check("max bytes")
+        def max_bytes(size):
+            return lambda value: len(value.encode("utf-8")) <= size
+
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressourceswithcustomchecks.yml",
+            "tests.plugins",
+            check_signature=False)
+
+    def tearDown(self):
+        unregister_argument_check("is email")
+        unregister_argument_check("max bytes")
+
+    def query(self, **arguments):
+        return Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            arguments=arguments,
+            ressource="actions",
+            method="action1",
+            request_method="GET")
+
+    def assertChecks(self, query, errors):
+        for check in (
+                self.plugin_runner.validation_plan(query),
+                lambda query: CheckArguments(
+                    query, self.plugin_runner.ressources,
+                    self.plugin_runner.sources(None), None)()):
+            if errors is None:
+                check(query)
+                continue
+            with self.assertRaises(ArgumentError) as context:
+                check(query)
+            self.assertEqual(context.exception.args[0], errors)
+
+    def test_registered_checks(self):
+        self.assertChecks(self.query(login="testzombie1"), None)
+        self.assertChecks(
+            self.query(login="testzombie1", mail="zombie@unistra.fr"), None)
+        self.assertChecks(self.query(login="testzombie1", mail="zombie"),
+                          {"mail": "is email"})
+        self.assertChecks(
+            self.query(login="testzombie1",
+                       mail=u"z\u00e9\u00e9\u00e9\u00e9\u00e9@unistra.fr"),
+            {"mail": "max bytes"})
+        self.assertChecks(self.query(login="testzombie3"),
+                          {"login": "value in"})
+
+    def test_unregistered_check(self):
+        unregister_argument_check("is email")
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressourceswithcustomchecks.yml",
+            "tests.plugins",
+            check_signature=False)
+        plugin_runner(self.query(login="testzombie1"))
+        with self.assertRaises(ArgumentCheckMethodNotFoundError):
+            plugin_runner(self.query(login="testzombie1", mail="a@b.fr"))
+
+    def test_compiled_once(self):
+        built = []
+
+        @register_argument_check("is email")
+        def is_email(expected):
+            built.append(expected)
+            return lambda value: "@" in value
+
+        query = self.query(login="testzombie1", mail="zombie@unistra.fr")
+        self.plugin_runner(query)
+        self.plugin_runner(self.query(login="testzombie1",
+                                      mail="zombie@unistra.fr"))
+        self.assertEqual(built, [True])
+
+    def test_invalid_parameter(self):
+        register_argument_check("max bytes", lambda size: 1 / 0)
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressourceswithcustomchecks.yml",
+            "tests.plugins",
+            check_signature=False)
+        plugin_runner(self.query(login="testzombie1"))
+        with self.assertRaises(CheckMethodError):
+            plugin_runner(self.query(login="testzombie1", mail="a@b.fr"))
+
+
+class SignatureVerifierTest(TestCase):
+
+    def setUp(self):
+        self.arguments = {"login": "testzombie1", "name": "zombie"}
+        self.signature = add_args_then_encode(
+            "S3CR3T2", sorted(self.arguments), self.arguments)
+
+    def test_verify(self):
+        verifier = SignatureVerifier(["S3CR3T", "S3CR3T2"])
+        canonical = canonical_arguments(self.arguments)
+        self.assertTrue(verifier.verify(self.signature, canonical))
+        self.assertFalse(verifier.verify("ERROR", canonical))
+        self.assertFalse(SignatureVerifier(["S3CR3T"]).verify(
+            self.signature, canonical))
+
+    def test_verify_cache(self):
+        verifier = SignatureVerifier(["S3CR3T2"], cache_size=1)
+        canonical = canonical_arguments(self.arguments)
+        self.assertTrue(verifier.verify(self.signature, canonical))
+        self.assertIn((self.signature, canonical), verifier.cache)
+        self.assertFalse(verifier.verify("ERROR", canonical))
+        self.assertEqual(len(verifier.cache), 1)
+        other = canonical_arguments({"login": "other"})
+        other_signature = add_args_then_encode(
+            "S3CR3T2", ["login"], {"login": "other"})
+        self.assertTrue(verifier.verify(other_signature, other))
+        self.assertEqual(list(verifier.cache), [(other_signature, other)])
+
+    def test_for_sources(self):
+        verifiers = SignatureVerifier.for_sources(
+            {"etab1": {"apikey": "S3CR3T"},
+             "etab2": {"apikey": ["S3CR3T", "S3CR3T2"]}})
+        self.assertEqual(list(verifiers), ["etab1", "etab2"])
+        self.assertEqual(len(verifiers["etab2"].digests), 2)
+        self.assertIsNone(SignatureVerifier.for_sources(
+            {"etab1": {"apikey": "S3CR3T"}, "etab2": {}}))
+
+    def test_runner_signature_cache(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            signature_cache_size=10)
+        query = Query(
+            source="etab1",
+            remote_ip="127.0.0.1",
+            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+            arguments={"login": "testzombie1", },
+            ressource="actions",
+            method="action1",
+            request_method="GET"
+        )
+        plugin_runner(query)
+        plugin_runner(query)
+        verifier = [stage for stage in
+                    plugin_runner.validation_plan(query).stages
+                    if hasattr(stage, "verifiers")][0].verifiers[0]
+        self.assertEqual(len(verifier.cache), 1)
+
+
+class IPMatcherTest(TestCase):
+
+    def test_regex_syntax(self):
+        matcher = IPMatcher(["127.0.0.1", r"^192\.168\.1\.\d+$"])
+        self.assertTrue(matcher.match("127.0.0.1"))
+        # plain ips are still regular expressions matching the beginning
+        self.assertTrue(matcher.match("127.0.0.10"))
+        self.assertTrue(matcher.match("192.168.1.12"))
+        self.assertFalse(matcher.match("192.168.10.1"))
+        self.assertFalse(IPMatcher([]).match("127.0.0.1"))
+
+    def test_backreferences(self):
+        matcher = IPMatcher([r"(\d)\1\.", "127.0.0.1"])
+        self.assertTrue(matcher.match("11.0.0.1"))
+        self.assertFalse(matcher.match("12.0.0.1"))
+
+    def test_cidr(self):
+        matcher = IPMatcher(["10.0.0.0/8", "192.168.0.0/24",
+                             "192.168.1.0/24", "2001:db8::/32"])
+        self.assertTrue(matcher.match("10.255.1.1"))
+        self.assertTrue(matcher.match("192.168.1.200"))
+        self.assertTrue(matcher.match("2001:db8::5"))
+        self.assertFalse(matcher.match("11.0.0.1"))
+        self.assertFalse(matcher.match("192.168.2.1"))
+        self.assertFalse(matcher.match("not an ip"))
+
+    def test_allow_list(self):
+        allow_list = IPAllowList([["127.0.0.1", "10.0.0.0/8"],
+                                  ["10.0.0.0/16"]])
+        self.assertTrue(allow_list.match("10.0.1.1"))
+        self.assertFalse(allow_list.match("10.1.0.1"))
+        self.assertFalse(allow_list.match("127.0.0.1"))
+        self.assertTrue(IPAllowList([]).match("127.0.0.1"))
+
+    def test_check_source_cidr(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_cidr.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+
+        def query(remote_ip):
+            return Query(
+                source="etab1",
+                remote_ip=remote_ip,
+                signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                arguments={"login": "testzombie1", },
+                ressource="actions",
+                method="action1",
+                request_method="GET"
+            )
+        for remote_ip in ["127.0.0.1", "10.1.2.3", "192.168.1.7"]:
+            plugin_runner(query(remote_ip))
+        for remote_ip in ["11.1.2.3", "192.168.2.7"]:
+            with self.assertRaises(IPNotAuthorizedError):
+                plugin_runner(query(remote_ip))
+            with self.assertRaises(IPNotAuthorizedError):
+                CheckSource(query(remote_ip), None,
+                            plugin_runner.sources(None), None)()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import ConfigurationLoaderError,\
+    SourceNotFoundError
+
+ETAB2 = """
+etab2:
+    apikey: S3CR3T2
+    ip:
+            - 127.0.0.1
+    plugins:
+        Plugin1:
+            -   spore: S3CR3T2
+                token: S3CR3T2
+"""
+
+
+class ConfigurationReloadTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sources = os.path.join(self.directory, "sources.yml")
+        with open("./tests/data/sources.yml") as sources:
+            etab1 = sources.read().split("etab2:")[0]
+        with open(self.sources, "w") as sources:
+            sources.write(etab1)
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            self.sources,
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+
+    def tearDown(self):
+        self.plugin_runner.close()
+        shutil.rmtree(self.directory)
+
+    def query(self, source):
+        return Query(source=source,
+                     remote_ip="127.0.0.1",
+                     arguments={"login": "testzombie1", },
+                     ressource="actions",
+                     method="action1",
+                     request_method="GET")
+
+    def add_etab2(self):
+        with open(self.sources, "a") as sources:
+            sources.write(ETAB2)
+
+    def test_reload_modified_files(self):
+        self.assertEqual(self.plugin_runner.reload_configuration(), [])
+        with self.assertRaises(SourceNotFoundError):
+            self.plugin_runner(self.query("etab2"))
+        self.add_etab2()
+        self.assertEqual(self.plugin_runner.reload_configuration(),
+                         ["sources"])
+        data, errors = self.plugin_runner(self.query("etab2"))
+        self.assertEqual(data, {"Plugin1": "p1ok1"})
+        self.assertEqual(self.plugin_runner.sources_names(),
+                         ["etab1", "etab2"])
+        self.assertEqual(self.plugin_runner.reload_configuration(), [])
+
+    def test_reload_swaps_snapshot(self):
+        self.plugin_runner(self.query("etab1"))
+        previous = self.plugin_runner.configuration
+        acl = previous.acl
+        self.add_etab2()
+        self.plugin_runner.reload_configuration()
+        configuration = self.plugin_runner.configuration
+        self.assertIsNot(configuration, previous)
+        # only the modified file is parsed again
+        self.assertIs(configuration.acl, acl)
+        # known plans are compiled before the swap
+        self.assertIn((None, "etab1", "actions", "action1"),
+                      configuration.plans)
+        # a request started with the previous snapshot finishes with it
+        with self.assertRaises(SourceNotFoundError):
+            self.plugin_runner(self.query("etab2"), previous)
+        self.assertEqual(len(previous.sources.keys()), 1)
+
+    def test_reload_error(self):
+        previous = self.plugin_runner.configuration
+        with open(self.sources, "a") as sources:
+            sources.write("etab2:\t[error]\n")
+        with self.assertRaises(ConfigurationLoaderError):
+            self.plugin_runner.reload_configuration()
+        self.assertIs(self.plugin_runner.configuration, previous)
+        self.plugin_runner(self.query("etab1"))
+
+    def test_reload_given_file(self):
+        self.plugin_runner.reload_configuration(
+            sources="./tests/data/sources.yml")
+        self.plugin_runner(self.query("etab2"))
+        self.plugin_runner["sources"] = self.sources
+        with self.assertRaises(SourceNotFoundError):
+            self.plugin_runner(self.query("etab2"))
+
+    def test_watcher(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            self.sources,
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False,
+            watch_interval=0.01)
+        try:
+            watcher = plugin_runner.watcher
+            with open(self.sources, "a") as sources:
+                sources.write("etab2:\t[error]\n")
+            for _ in range(100):
+                if watcher.error is not None:
+                    break
+                time.sleep(0.01)
+            self.assertIsInstance(watcher.error, ConfigurationLoaderError)
+            with open(self.sources, "w") as sources:
+                sources.write(ETAB2)
+            for _ in range(100):
+                if "etab2" in plugin_runner.configuration.sources.keys():
+                    break
+                time.sleep(0.01)
+            self.assertEqual(plugin_runner.sources_names(), ["etab2"])
+            self.assertIsNone(watcher.error)
+        finally:
+            plugin_runner.close()
+
+
+class ConfigurationFreezeTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl_projects.yml",
+            "./tests/data/sources_projects.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+
+    def tearDown(self):
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+
+    def test_compile_configuration(self):
+        configuration = self.plugin_runner.configuration
+        self.plugin_runner.compile_configuration()
+        # etab3 is allowed in acl.yml but has no source
+        self.assertEqual(sorted(configuration.plans), [
+            ("project1", "etab1", "actions", "action1"),
+            ("project1", "etab1", "actions", "action2"),
+            ("project1", "etab2", "actions", "action1"),
+            ("project2", "etab1", "actions", "action1"),
+            ("project2", "etab1", "actions", "action2")])
+        self.assertEqual(sorted(configuration.verifiers),
+                         ["project1", "project2"])
+
+    def test_freeze(self):
+        self.plugin_runner.freeze()
+        self.assertTrue(self.plugin_runner.configuration.plans)
+        if hasattr(gc, "get_freeze_count"):
+            self.assertGreater(gc.get_freeze_count(), 0)
+
+    def test_forked_worker(self):
+        if not hasattr(os, "fork"):
+            self.skipTest("fork is not available")
+        self.plugin_runner.freeze()
+        query = Query(source="etab1",
+                      remote_ip="127.0.0.1",
+                      signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                      arguments={"login": "testzombie1", },
+                      ressource="actions",
+                      method="action1",
+                      request_method="GET",
+                      project="project1")
+        pid = os.fork()
+        if pid == 0:
+            try:
+                data, errors = self.plugin_runner(query)
+                os._exit(0 if data["Plugin1"] == "p1ok1" else 1)
+            except BaseException:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+
+if __name__ == '__main__':
+    main()
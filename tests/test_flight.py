@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import IPNotAuthorizedError
+from excalibur.flight import SingleFlight
+
+
+class SingleFlightTest(TestCase):
+
+    def test_error_shared(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError("fail")
+
+        with self.assertRaises(ValueError):
+            flights("key", fail)
+        self.assertEqual(len(flights), 0)
+        self.assertEqual(flights("key", lambda: 1), (1, False))
+
+
+class CoalesceTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_coalesce.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False,
+            coalesce=True)
+        self.calls()[:] = []
+
+    def calls(self):
+        return self.plugin_runner.plugin_loader.get_plugin_class(
+            "Plugin9").calls
+
+    def query(self, login="testzombie1", remote_ip="127.0.0.1"):
+        return Query(source="etab1",
+                     remote_ip=remote_ip,
+                     arguments={"login": login, },
+                     ressource="actions",
+                     method="action1",
+                     request_method="GET")
+
+    def test_concurrent_queries(self):
+        queries = [self.query() for _ in range(5)] +\
+            [self.query(login="testzombie2")]
+        with ThreadPoolExecutor(len(queries)) as executor:
+            results = list(executor.map(self.plugin_runner, queries))
+        self.assertEqual(results[0], ({"Plugin9": "p9ok1 testzombie1"}, {}))
+        self.assertTrue(all(result == results[0] for result in results[:5]))
+        # each query gets its own dicts
+        self.assertIsNot(results[0][0], results[1][0])
+        self.assertEqual(results[5][0], {"Plugin9": "p9ok1 testzombie2"})
+        self.assertEqual(len(self.calls()), 2)
+        self.assertEqual(len(self.plugin_runner.flights), 0)
+        # later queries run again
+        self.plugin_runner(self.query())
+        self.assertEqual(len(self.calls()), 3)
+
+    def test_checks_run_per_query(self):
+        with ThreadPoolExecutor(2) as executor:
+            allowed = executor.submit(self.plugin_runner, self.query())
+            denied = executor.submit(self.plugin_runner,
+                                     self.query(remote_ip="10.0.0.1"))
+            self.assertEqual(allowed.result()[0],
+                             {"Plugin9": "p9ok1 testzombie1"})
+            with self.assertRaises(IPNotAuthorizedError):
+                denied.result()
+
+    def test_acall(self):
+        async def queries():
+            return await asyncio.gather(*[
+                self.plugin_runner.acall(self.query()) for _ in range(5)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(queries())
+        finally:
+            loop.close()
+        self.assertEqual(results,
+                         [({"Plugin9": "p9ok1 testzombie1"}, {})] * 5)
+        self.assertEqual(len(self.calls()), 1)
+        self.assertEqual(len(self.plugin_runner.async_flights), 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import IPNotAuthorizedError
+from excalibur.listener import Listeners, PipelineListener
+
+
+class RecordingListener(PipelineListener):
+
+    def __init__(self):
+        self.events = []
+
+    def check(self, query, name, seconds, error=None):
+        self.events.append(("check", name, error))
+
+    def decode(self, query, argument_name, seconds, error=None):
+        self.events.append(("decode", argument_name, error))
+
+    def plugin_load(self, plugin_name, seconds, error=None):
+        self.events.append(("load", plugin_name, error))
+
+    def plugin_call(self, query, plugin_name, parameters_index, seconds,
+                    error=None):
+        self.events.append(("call", plugin_name, parameters_index,
+                            error.__class__.__name__ if error else None))
+
+
+class ListenerTest(TestCase):
+
+    def setUp(self):
+        self.listener = RecordingListener()
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressourceswithencodingrequired.yml",
+            "tests.plugins",
+            check_signature=False,
+            listener=self.listener)
+
+    def query(self, method="action1", remote_ip="127.0.0.1"):
+        return Query(source="etab1",
+                     remote_ip=remote_ip,
+                     arguments={"login": base64.b64encode(b"testzombie1")},
+                     ressource="actions",
+                     method=method,
+                     request_method="GET")
+
+    def test_stages(self):
+        self.plugin_runner(self.query())
+        # allowed ACLs are not checked again
+        self.assertEqual(self.listener.events, [
+            ("decode", "login", None),
+            ("check", "CheckArguments", None),
+            ("check", "CheckRequest", None),
+            ("check", "CheckSource", None),
+            ("load", "Plugin1", None),
+            ("call", "Plugin1", 0, None),
+            ("load", "Plugin2", None),
+            ("call", "Plugin2", 0, None)])
+
+    def test_errors(self):
+        self.plugin_runner(self.query("action2"))
+        self.assertIn(("call", "Plugin1", 0, "Exception"),
+                      self.listener.events)
+        self.listener.events[:] = []
+        with self.assertRaises(IPNotAuthorizedError):
+            self.plugin_runner(self.query(remote_ip="10.0.0.1"))
+        self.assertIsInstance(self.listener.events[-1][2],
+                              IPNotAuthorizedError)
+
+    def test_acall(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.plugin_runner.acall(self.query()))
+        finally:
+            loop.close()
+        self.assertEqual(
+            [event for event in self.listener.events if event[0] == "call"],
+            [("call", "Plugin1", 0, None), ("call", "Plugin2", 0, None)])
+
+    def test_listeners(self):
+        other = RecordingListener()
+        self.plugin_runner.listener = Listeners(self.listener, other)
+        self.plugin_runner(self.query())
+        self.assertEqual(len(other.events), 8)
+        self.assertEqual(other.events, self.listener.events)
+        self.plugin_runner.listener = None
+        self.plugin_runner(self.query())
+        self.assertEqual(len(other.events), 8)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from unittest import TestCase, main
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, main, mock
+from excalibur.conf import Sources
+from excalibur.core import PluginsRunner
 from excalibur.loader import ConfigurationLoader, PluginLoader
 from excalibur.exceptions import ConfigurationLoaderError, PluginLoaderError
 from tests.plugins.Plugin1 import Plugin1
@@ -62,6 +68,75 @@ class ConfigurationLoaderRawTest(TestCase):
             ConfigurationLoader(self.content_wrong, raw_yaml_content=True)
 
 
+class ConfigurationSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot_dir = os.path.join(self.directory, "snapshots")
+        self.path = os.path.join(self.directory, "sources.yml")
+        shutil.copy("./tests/data/sources.yml", self.path)
+        self.expected = ConfigurationLoader(
+            "./tests/data/sources.yml", key="sources").content.__dict__
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        return ConfigurationLoader(self.path, key="sources",
+                                   snapshot_dir=self.snapshot_dir).content
+
+    def snapshot(self):
+        return ConfigurationLoader.snapshot_path(self.path,
+                                                 self.snapshot_dir)
+
+    def test_conf_object(self):
+        content = self.load()
+        self.assertIsInstance(content, Sources)
+        self.assertEqual(content.__dict__, self.expected)
+        self.assertEqual(content["etab1"]["apikey"], "S3CR3T")
+
+    def test_snapshot_used(self):
+        self.load()
+        self.assertTrue(os.path.exists(self.snapshot()))
+        with open(self.snapshot(), "rb") as snapshot_file:
+            snapshot = snapshot_file.read()
+        # the snapshot is read without parsing the file again
+        with open(self.snapshot(), "wb") as snapshot_file:
+            snapshot_file.write(snapshot.replace(b"S3CR3T2", b"CACHED2"))
+        self.assertEqual(self.load()["etab2"]["apikey"], "CACHED2")
+
+    def test_snapshot_outdated(self):
+        self.load()
+        with open(self.path, "a") as configuration_file:
+            configuration_file.write("etab3:\n    apikey: S3CR3T3\n")
+        self.assertEqual(self.load()["etab3"]["apikey"], "S3CR3T3")
+        # the snapshot was replaced
+        self.assertEqual(os.listdir(self.snapshot_dir),
+                         [os.path.basename(self.snapshot())])
+
+    def test_snapshot_corrupted(self):
+        self.load()
+        with open(self.snapshot(), "wb") as snapshot_file:
+            snapshot_file.write(b"corrupted")
+        self.assertEqual(self.load().__dict__, self.expected)
+
+    def test_snapshot_not_writable(self):
+        with open(self.snapshot_dir, "w"):
+            pass
+        self.assertEqual(self.load().__dict__, self.expected)
+
+    def test_not_a_mapping(self):
+        with open(self.path, "w") as configuration_file:
+            configuration_file.write("- etab1\n")
+        with self.assertRaises(ConfigurationLoaderError):
+            self.load()
+
+    def test_python_tags_refused(self):
+        with self.assertRaises(ConfigurationLoaderError):
+            ConfigurationLoader("test: !!python/object/apply:os.getcwd []",
+                                raw_yaml_content=True)
+
+
 class PluginLoaderTest(TestCase):
 
     def setUp(self):
@@ -86,5 +161,141 @@ class PluginLoaderTest(TestCase):
             instance = p.get_plugin(self.plugin1)
 
 
+class PluginLoaderLifecycleTest(TestCase):
+
+    def setUp(self):
+        self.plugin_module = "tests.plugins"
+        # the class is looked up since reload replaces it
+        self.plugin = PluginLoader(self.plugin_module).get_plugin_class(
+            "Plugin4")
+        self.plugin.setups = 0
+        self.plugin.teardowns = 0
+
+    def test_unknown_lifecycle(self):
+        with self.assertRaises(PluginLoaderError):
+            PluginLoader(self.plugin_module, lifecycle="forever")
+
+    def test_request(self):
+        p = PluginLoader(self.plugin_module)
+        with p.plugin("Plugin4") as first:
+            pass
+        with p.plugin("Plugin4") as second:
+            pass
+        self.assertIsNot(first, second)
+        self.assertEqual((self.plugin.setups, self.plugin.teardowns), (2, 2))
+
+    def test_teardown_error(self):
+        p = PluginLoader(self.plugin_module)
+        with mock.patch.object(self.plugin, "teardown",
+                               side_effect=IOError("closed")):
+            with self.assertLogs("excalibur.loader") as logs:
+                with p.plugin("Plugin4") as instance:
+                    data = instance.actions_action1({})
+        self.assertEqual(data, "p4ok1")
+        self.assertIn("Plugin4 failed to teardown: closed", logs.output[0])
+
+    def test_singleton(self):
+        p = PluginLoader(self.plugin_module, lifecycle="singleton")
+        with p.plugin("Plugin4") as first:
+            pass
+        with p.plugin("Plugin4") as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual((self.plugin.setups, self.plugin.teardowns), (1, 0))
+        p.close()
+        self.assertEqual(self.plugin.teardowns, 1)
+
+    def test_thread(self):
+        p = PluginLoader(self.plugin_module, lifecycle="thread")
+        instances = []
+
+        def get():
+            instances.append(p.get_plugin("Plugin4"))
+            instances.append(p.get_plugin("Plugin4"))
+        thread = threading.Thread(target=get)
+        thread.start()
+        thread.join()
+        get()
+        self.assertIs(instances[0], instances[1])
+        self.assertIs(instances[2], instances[3])
+        self.assertIsNot(instances[0], instances[2])
+        p.close()
+        self.assertEqual((self.plugin.setups, self.plugin.teardowns), (2, 2))
+
+    def test_pool(self):
+        p = PluginLoader(self.plugin_module, lifecycle="pool", pool_size=2)
+        first = p.get_plugin("Plugin4")
+        second = p.get_plugin("Plugin4")
+        self.assertIsNot(first, second)
+        checked_out = []
+        thread = threading.Thread(
+            target=lambda: checked_out.append(p.get_plugin("Plugin4")))
+        thread.start()
+        thread.join(0.1)
+        # the pool is full until an instance is released
+        self.assertEqual(checked_out, [])
+        p.release("Plugin4", first)
+        thread.join()
+        self.assertIs(checked_out[0], first)
+        self.assertEqual(self.plugin.setups, 2)
+
+    def test_reload(self):
+        p = PluginLoader(self.plugin_module, lifecycle="singleton")
+        first = p.get_plugin("Plugin4")
+        p.reload()
+        self.assertEqual(self.plugin.teardowns, 1)
+        self.assertIsNot(first, p.get_plugin("Plugin4"))
+
+
+class PluginWarmupTest(TestCase):
+
+    def setUp(self):
+        self.acl = open("./tests/data/acl.yml").read()
+        self.sources = open("./tests/data/sources.yml").read()
+        self.ressources = open("./tests/data/ressources.yml").read()
+
+    def runner(self, sources, **kwargs):
+        return PluginsRunner(self.acl, sources, self.ressources,
+                             "tests.plugins", raw_yaml_content=True,
+                             **kwargs)
+
+    def test_loader_warmup(self):
+        p = PluginLoader("tests.plugins", lifecycle="singleton")
+        reports = p.warmup(["Plugin4", "NotExist", "Plugin4"],
+                           instantiate=True)
+        self.assertEqual(list(reports), ["Plugin4", "NotExist"])
+        self.assertIsNone(reports["Plugin4"]["error"])
+        self.assertGreaterEqual(reports["Plugin4"]["instantiate"], 0)
+        self.assertIsNone(reports["NotExist"]["import"])
+        self.assertIsInstance(reports["NotExist"]["error"],
+                              PluginLoaderError)
+        # the singleton instance is built by the warmup
+        plugin = p.get_plugin_class("Plugin4")
+        setups = plugin.setups
+        p.get_plugin("Plugin4")
+        self.assertEqual(plugin.setups, setups)
+        p.close()
+
+    def test_runner_warmup(self):
+        reports = self.runner(self.sources).warmup()
+        self.assertEqual(list(reports), ["Plugin1", "Plugin2", "Plugin3"])
+        for report in reports.values():
+            self.assertIsNone(report["error"])
+            self.assertIsNone(report["instantiate"])
+            self.assertGreaterEqual(report["import"], 0)
+        self.assertEqual(reports["Plugin1"]["missing"], [])
+        self.assertEqual(reports["Plugin3"]["missing"],
+                         ["actions_action1", "actions_action2"])
+
+    def test_preload_error(self):
+        sources = self.sources.replace("Plugin3", "NotExist")
+        with self.assertRaises(PluginLoaderError):
+            self.runner(sources, preload=True)
+        reports = self.runner(sources).warmup(strict=False)
+        self.assertIsInstance(reports["NotExist"]["error"],
+                              PluginLoaderError)
+        self.assertEqual(reports["NotExist"]["missing"], [])
+
+
 if __name__ == '__main__':
     main()
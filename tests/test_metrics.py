@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import IPNotAuthorizedError, NoACLMatchedError,\
+    WrongSignatureError
+from excalibur.metrics import Histogram
+
+
+class HistogramTest(TestCase):
+
+    def test_buckets(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.buckets(),
+                         [(0.1, 2), (1.0, 3), ("+Inf", 4)])
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.sum, 3.65)
+
+
+class MetricsRegistryTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False,
+            metrics=True)
+
+    def query(self, source="etab1", method="action1", remote_ip="127.0.0.1"):
+        return Query(source=source,
+                     remote_ip=remote_ip,
+                     arguments={"login": "testzombie1", },
+                     ressource="actions",
+                     method=method,
+                     request_method="GET")
+
+    def test_as_dict(self):
+        self.plugin_runner(self.query())
+        self.plugin_runner(self.query())
+        self.plugin_runner(self.query(method="action2"))
+        with self.assertRaises(IPNotAuthorizedError):
+            self.plugin_runner(self.query(remote_ip="10.0.0.1"))
+        with self.assertRaises(NoACLMatchedError):
+            self.plugin_runner(self.query("etab2", method="action2"))
+        metrics = self.plugin_runner.metrics.as_dict()
+        plugins = dict(((metric["plugin"], metric["method"]), metric)
+                       for metric in metrics["plugins"])
+        self.assertEqual(plugins[("Plugin1", "action1")]["count"], 2)
+        self.assertEqual(plugins[("Plugin1", "action1")]["success"], 2)
+        self.assertEqual(plugins[("Plugin1", "action2")]["error"], 1)
+        self.assertEqual(plugins[("Plugin1", "action1")]["source"], "etab1")
+        self.assertEqual(metrics["rejections"], {
+            "IPNotAuthorizedError": 1, "NoACLMatchedError": 1})
+        self.assertEqual(metrics["checks"]["CheckSource"]["count"], 4)
+
+    def test_all_rejections(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl_three_etabs.yml",
+            "./tests/data/sources_projects_key_ids.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            metrics=True)
+        query = Query(source="all",
+                      remote_ip="127.0.0.1",
+                      signature="ERROR",
+                      arguments={"login": "testzombie1", },
+                      ressource="actions",
+                      method="action1",
+                      request_method="GET",
+                      project="project1")
+        with self.assertRaises(WrongSignatureError):
+            plugin_runner(query)
+        metrics = plugin_runner.metrics.as_dict()
+        self.assertEqual(metrics["rejections"], {"WrongSignatureError": 1})
+        self.assertEqual(metrics["checks"]["MatchSources"]["count"], 1)
+
+    def test_reload(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl_three_etabs.yml",
+            "./tests/data/sources_projects_key_ids.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            metrics=True)
+        query = Query(source="all",
+                      remote_ip="127.0.0.1",
+                      signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                      arguments={"login": "testzombie1", },
+                      ressource="actions",
+                      method="action1",
+                      request_method="GET",
+                      project="project1",
+                      key_id="client1")
+        self.assertEqual(plugin_runner(query)[1], {})
+        plugin_runner.reload_configuration(
+            sources="./tests/data/sources_projects_key_ids.yml")
+        metrics = plugin_runner.metrics.as_dict()
+        self.assertEqual(metrics["rejections"], {})
+        self.assertEqual(metrics["checks"]["MatchSources"]["count"], 1)
+
+    def test_render(self):
+        self.plugin_runner(self.query())
+        text = self.plugin_runner.metrics.render()
+        self.assertIn("# TYPE excalibur_plugin_call_seconds histogram\n",
+                      text)
+        self.assertIn(
+            'excalibur_plugin_calls_total{project="",source="etab1",'
+            'plugin="Plugin1",ressource="actions",method="action1",'
+            'outcome="success"} 1\n', text)
+        self.assertIn(
+            'excalibur_plugin_call_seconds_bucket{project="",source="etab1",'
+            'plugin="Plugin1",ressource="actions",method="action1",'
+            'le="+Inf"} 1\n', text)
+
+    def test_listener(self):
+        events = []
+
+        class Listener(object):
+            def check(self, *args, **kwargs):
+                events.append(args[1])
+
+            def plugin_call(self, *args, **kwargs):
+                events.append(args[1])
+
+            def plugin_load(self, *args, **kwargs):
+                pass
+
+            def decode(self, *args, **kwargs):
+                pass
+
+        self.plugin_runner.listener = Listener()
+        self.plugin_runner(self.query())
+        self.assertIn("Plugin1", events)
+        self.assertEqual(
+            self.plugin_runner.metrics.as_dict()["plugins"][0]["count"], 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,10 @@ from unittest import TestCase, main
 from excalibur.loader import ConfigurationLoader
 from excalibur.core import PluginsRunner
 from excalibur.core import Query
+from excalibur.configuration import order_plugins
 from excalibur.exceptions import PluginRunnerError
 from excalibur.exceptions import IPNotAuthorizedError,WrongSignatureError
+from excalibur.utils import monotonic
 from excalibur.utils import ALL_KEYWORD
 import yaml
 
@@ -78,6 +80,75 @@ class PluginsTest(TestCase):
         self.assertEqual(errors, self.errors_raw)
         self.assertEqual(data, {})
 
+    def test_run_singleton_plugins(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            plugin_lifecycle="singleton")
+        self.assertEqual(plugin_runner.run(self.query)[0], self.data_ok)
+        plugin = plugin_runner.plugin_loader.get_plugin("Plugin1")
+        data, errors = plugin_runner.run(self.query)
+        self.assertEqual(data, self.data_ok)
+        self.assertIs(plugin, plugin_runner.plugin_loader.get_plugin("Plugin1"))
+
+    def test_dispatch_table(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+        calls = plugin_runner.dispatch(self.query)
+        # Plugin3 does not define actions_action1
+        self.assertEqual([call.name for call in calls],
+                         ["Plugin1", "Plugin2"])
+        self.assertEqual([call.function_name for call in calls],
+                         ["actions_action1"] * 2)
+        self.assertIs(calls, plugin_runner.dispatch(self.query))
+        self.assertEqual(plugin_runner(self.query), (self.data_ok, {}))
+        plugin_runner.reload_plugins()
+        self.assertIsNot(calls, plugin_runner.dispatch(self.query))
+
+    def test_dispatch_dynamic_attributes(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_dispatch.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+        calls = plugin_runner.dispatch(self.query)
+        self.assertEqual([(call.name, call.implemented) for call in calls],
+                         [("Plugin1", True), ("Plugin8", None)])
+        # instances are looked up for each request
+        self.assertIsNot(calls, plugin_runner.dispatch(self.query))
+        data, errors = plugin_runner(self.query)
+        self.assertEqual(data, {"Plugin1": "p1ok1", "Plugin8": "p8ok1"})
+
+    def test_dispatch_multiple_sources(self):
+        query = Query(source="etab1,etab2",
+                      remote_ip="127.0.0.1",
+                      signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                      arguments={"login": "testzombie1", },
+                      ressource="actions",
+                      method="action1",
+                      request_method="GET",
+                      project="project1")
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl_projects.yml",
+            "./tests/data/sources_projects.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+        calls = plugin_runner.dispatch(query)
+        self.assertEqual(
+            sorted((call.name, call.plugin_name) for call in calls),
+            [("etab1|Plugin1", "Plugin1"), ("etab1|Plugin2", "Plugin2"),
+             ("etab2|Plugin1", "Plugin1"), ("etab2|Plugin2", "Plugin2")])
+        # the calls of each source are built once
+        self.assertEqual(
+            [id(call) for call in calls],
+            [id(call) for call in plugin_runner.dispatch(query)])
+
     def test_keyerror_plugins(self):
         plugin_runner = PluginsRunner(
             "./tests/data/acl.yml",
@@ -299,6 +370,31 @@ actions:
         data, errors = plugin_runner(self.query4)
         self.assertListEqual(['Plugin2', 'Plugin1'], list(data.keys()))
 
+    def test_plugins_order_resolved_once(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_with_plugins_order.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins"
+        )
+        plugins = plugin_runner.plugins("etab1", None)
+        self.assertListEqual(['Plugin2', 'Plugin3', 'Plugin1'],
+                             list(plugins.keys()))
+        self.assertIs(plugins, plugin_runner.plugins("etab1", None))
+        # a new snapshot orders its plugins again
+        plugin_runner["check_ip"] = True
+        self.assertIsNot(plugins, plugin_runner.plugins("etab1", None))
+
+    def test_order_plugins(self):
+        source = {"plugins_order": ["Plugin2", "Plugin4", "Plugin1",
+                                    "Plugin2"],
+                  "plugins": {"Plugin1": [], "Plugin2": [], "Plugin3": []}}
+        # the first occurrence of a plugin gives its position
+        self.assertListEqual(['Plugin2', 'Plugin1'],
+                             list(order_plugins(source).keys()))
+        source.pop("plugins_order")
+        self.assertIs(order_plugins(source), source["plugins"])
+
 
 class RunnerWithProjectsTest(TestCase):
 
@@ -623,6 +719,34 @@ actions:
         self.assertEqual(errors, self.errors_raw)
         self.assertEqual(data, {})
 
+    def test_query_source_set_to_all_with_key_id(self):
+        plugin_runner = PluginsRunner(
+            "./tests/data/acl_three_etabs.yml",
+            "./tests/data/sources_projects_key_ids.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+
+        def query(key_id):
+            return Query(source=ALL_KEYWORD,
+                         remote_ip="127.0.0.1",
+                         signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                         arguments={"login": "testzombie1", },
+                         ressource="actions",
+                         method="action1",
+                         request_method="GET",
+                         project="project1",
+                         key_id=key_id)
+
+        data, errors = plugin_runner(query("client1"))
+        self.assertEqual(sorted(data), ["etab1|Plugin1", "etab2|Plugin2"])
+        data, errors = plugin_runner(query("client2"))
+        self.assertEqual(sorted(data), ["etab2|Plugin2", "etab3|Plugin1"])
+        data, errors = plugin_runner(query(None))
+        self.assertEqual(sorted(data), ["etab1|Plugin1", "etab2|Plugin2",
+                                        "etab3|Plugin1"])
+        with self.assertRaises(WrongSignatureError):
+            plugin_runner(query("unknown"))
+
     def test_runner_projects_with_plugins_order(self):
         plugin_runner = PluginsRunner(
             "./tests/data/acl_projects.yml",
@@ -654,5 +778,74 @@ actions:
         self.assertListEqual(['Plugin2', 'Plugin1'], list(data.keys()))
 
 
+class ConcurrentRunnerTest(TestCase):
+
+    def setUp(self):
+        self.query = Query(source="etab1",
+                           remote_ip="127.0.0.1",
+                           signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                           arguments={"login": "testzombie1", },
+                           ressource="actions",
+                           method="action1",
+                           request_method="GET"
+                           )
+        self.query2 = Query(source="etab1",
+                            remote_ip="127.0.0.1",
+                            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                            arguments={"login": "testzombie1", },
+                            ressource="actions",
+                            method="action2",
+                            request_method="GET"
+                            )
+        self.query3 = Query(source="etab2",
+                            remote_ip="127.0.0.1",
+                            signature="c08b3ff9dff7c5f08a1abdfabfbd24279e82dd10",
+                            arguments={"login": "testzombie1", },
+                            ressource="actions",
+                            method="action1",
+                            request_method="GET"
+                            )
+        self.sequential_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_concurrent.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins")
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_concurrent.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            max_workers=4,
+            plugin_timeout=0.3)
+
+    def tearDown(self):
+        self.plugin_runner.close()
+
+    def test_same_results_as_sequential_run(self):
+        self.assertEqual(self.plugin_runner(self.query2),
+                         self.sequential_runner(self.query2))
+        data, errors = self.plugin_runner(self.query)
+        sequential_data, sequential_errors = self.sequential_runner(
+            self.query)
+        # run first, Plugin6 does not get Plugin5 data sequentially
+        self.assertEqual(sequential_data.pop('Plugin6'), 'p6 read None')
+        data.pop('Plugin6')
+        self.assertEqual((data, errors), (sequential_data, sequential_errors))
+
+    def test_plugins_order_and_dependencies(self):
+        data, errors = self.plugin_runner(self.query)
+        self.assertListEqual(['Plugin6', 'Plugin5', 'Plugin1', 'Plugin2'],
+                             list(data.keys()))
+        self.assertEqual(data['Plugin6'], 'p6 read p5ok1')
+        self.assertEqual(errors, {})
+
+    def test_plugin_timeout(self):
+        start = monotonic()
+        data, errors = self.plugin_runner(self.query3)
+        self.assertLess(monotonic() - start, 0.6)
+        self.assertEqual(data, {'Plugin1': 'p1ok1'})
+        self.assertEqual(errors['Plugin5']['error'], 'PluginTimeoutError')
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+from unittest import TestCase, main, mock
+
+from excalibur import loader
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import PluginProcessError
+from excalibur.process import sendable
+
+
+class SendableTest(TestCase):
+
+    def test_sendable(self):
+        # imported here, the runners reload the plugins modules
+        from tests.plugins.Plugin14 import BackendError
+        error = ValueError("wrong value")
+        self.assertIs(sendable(error), error)
+        # its __init__ does not take its args
+        error = sendable(BackendError("backend14", 500))
+        self.assertIsInstance(error, PluginProcessError)
+        self.assertEqual(str(sendable(error)), str(error))
+
+
+class ProcessExecutorTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_process.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False,
+            process_workers=1)
+
+    def tearDown(self):
+        self.plugin_runner.close()
+
+    def query(self, source="etab1", timeout=None):
+        return Query(source=source,
+                     remote_ip="127.0.0.1",
+                     arguments={"login": "testzombie1", },
+                     ressource="actions",
+                     method="action1",
+                     request_method="GET",
+                     timeout=timeout)
+
+    def test_plugin_runs_in_worker(self):
+        data, errors = self.plugin_runner(self.query())
+        self.assertEqual(errors, {})
+        self.assertEqual(data["Plugin1"], "p1ok1")
+        self.assertNotEqual(data["Plugin14"]["pid"], os.getpid())
+        self.assertEqual(data["Plugin14"]["data"], ["Plugin1"])
+        self.assertFalse(data["Plugin14"]["timeout"])
+        # the instance is kept by the worker
+        data, errors = self.plugin_runner(self.query(timeout=10))
+        self.assertEqual(data["Plugin14"]["calls"], 2)
+        self.assertTrue(data["Plugin14"]["timeout"])
+
+    def test_errors(self):
+        data, errors = self.plugin_runner(self.query("etab2"))
+        self.assertEqual(data["Plugin14"]["calls"], 2)
+        # the last error of the plugin is kept, as in the threads
+        self.assertEqual(errors["Plugin14"]["error"], "PluginProcessError")
+        self.assertEqual(errors["Plugin14"]["parameters_index"], 2)
+        self.assertIn("BackendError: backend14 answered 500",
+                      errors["Plugin14"]["error_message"])
+
+    def test_acall(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        data, errors = loop.run_until_complete(
+            self.plugin_runner.acall(self.query("etab2")))
+        self.assertNotEqual(data["Plugin14"]["pid"], os.getpid())
+        self.assertEqual(errors["Plugin14"]["parameters_index"], 2)
+
+    def test_python_version(self):
+        with mock.patch.object(loader.sys, "version_info", (3, 6, 15)):
+            data, errors = self.plugin_runner(self.query())
+        self.assertEqual(data, {"Plugin1": "p1ok1"})
+        self.assertEqual(errors["Plugin14"]["error"], "PluginLoaderError")
+        self.assertIn("Python 3.7", errors["Plugin14"]["error_message"])
+
+    def test_reload_plugins_restarts_workers(self):
+        pid = self.plugin_runner(self.query())[0]["Plugin14"]["pid"]
+        self.plugin_runner.reload_plugins()
+        data = self.plugin_runner(self.query())[0]["Plugin14"]
+        self.assertNotEqual(data["pid"], pid)
+        self.assertEqual(data["calls"], 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase, main
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.exceptions import IPNotAuthorizedError
+from excalibur.utils import monotonic
+
+
+class StreamTest(TestCase):
+
+    def setUp(self):
+        self.plugin_runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_stream.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False)
+
+    def query(self, remote_ip="127.0.0.1", source="etab1", timeout=None):
+        return Query(source=source,
+                     remote_ip=remote_ip,
+                     arguments={"login": "testzombie1", },
+                     ressource="actions",
+                     method="action1",
+                     request_method="GET",
+                     timeout=timeout)
+
+    def test_stream(self):
+        stream = self.plugin_runner.stream(self.query())
+        self.assertEqual(list(stream), [
+            ("Plugin1", "p1ok1"),
+            ("Plugin11", {"row": 0, "login": "testzombie1"}),
+            ("Plugin11", {"row": 1, "login": "testzombie1"}),
+            ("Plugin11", {"row": 2, "login": "testzombie1"}),
+            ("Plugin11", {"row": 0, "login": "testzombie1"})])
+        self.assertEqual(list(stream.errors), ["Plugin11"])
+        self.assertEqual(stream.errors["Plugin11"]["error_message"],
+                         "cannot read row 1")
+        self.assertEqual(stream.errors["Plugin11"]["parameters_index"], 1)
+
+    def test_lazy(self):
+        stream = self.plugin_runner.stream(self.query())
+        self.assertEqual(next(stream), ("Plugin1", "p1ok1"))
+        self.assertEqual(next(stream)[1]["row"], 0)
+        stream.close()
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.errors, {})
+
+    def test_deadline(self):
+        start = monotonic()
+        stream = self.plugin_runner.stream(self.query(source="etab2",
+                                                      timeout=0.1))
+        rows = list(stream)
+        self.assertLess(monotonic() - start, 0.3)
+        # the iterator is stopped, the next plugins are not started
+        self.assertTrue(0 < len(rows) < 10)
+        self.assertEqual(list(stream.errors), ["Plugin11", "Plugin1"])
+        for error in stream.errors.values():
+            self.assertEqual(error["error"], "PluginTimeoutError")
+
+    def test_checks(self):
+        with self.assertRaises(IPNotAuthorizedError):
+            self.plugin_runner.stream(self.query(remote_ip="10.0.0.1"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from unittest import TestCase, main, mock
+
+from excalibur.core import PluginsRunner, Query
+from excalibur.utils import monotonic
+
+
+class TimeoutTest(TestCase):
+
+    def setUp(self):
+        self.runners = []
+        self.timeouts()[:] = []
+
+    def tearDown(self):
+        for runner in self.runners:
+            runner.close()
+
+    def runner(self, **kwargs):
+        runner = PluginsRunner(
+            "./tests/data/acl.yml",
+            "./tests/data/sources_timeout.yml",
+            "./tests/data/ressources.yml",
+            "tests.plugins",
+            check_signature=False,
+            **kwargs)
+        self.runners.append(runner)
+        return runner
+
+    def timeouts(self):
+        return self.runner().plugin_loader.get_plugin_class(
+            "Plugin12").timeouts
+
+    def query(self, source="etab1", method="action1", timeout=None):
+        return Query(source=source,
+                     remote_ip="127.0.0.1",
+                     arguments={"login": "testzombie1", },
+                     ressource="actions",
+                     method=method,
+                     request_method="GET",
+                     timeout=timeout)
+
+    def test_plugin_timeout_from_sources(self):
+        for runner in (self.runner(), self.runner(max_workers=2)):
+            start = monotonic()
+            data, errors = runner(self.query())
+            self.assertLess(monotonic() - start, 0.4)
+            self.assertEqual(data, {"Plugin1": "p1ok1"})
+            self.assertEqual(errors["Plugin12"]["error"],
+                             "PluginTimeoutError")
+            self.assertIn("within 0.1s",
+                          errors["Plugin12"]["error_message"])
+
+    def test_late_plugins_keep_their_threads(self):
+        runner = self.runner(plugin_timeout=0.2)
+        for _ in range(6):
+            data, errors = runner(self.query("etab3"))
+            self.assertEqual(data, {"Plugin1": "p1ok1"})
+            self.assertEqual(list(errors.keys()), ["Plugin12"])
+
+    def test_thread_lifecycle_instances(self):
+        # the timed calls reuse the threads of the runner's pool
+        runner = self.runner(request_timeout=1, plugin_lifecycle="thread",
+                             timeout_workers=2)
+        plugin = runner.plugin_loader.get_plugin_class("Plugin1")
+        with mock.patch.object(plugin, "setup", create=True) as setup:
+            for _ in range(20):
+                self.assertEqual(runner(self.query("etab2"))[1], {})
+        self.assertLessEqual(setup.call_count, 2)
+
+    def test_query_timeout(self):
+        # Plugin1 does not wait for Plugin12 to answer
+        runner = self.runner(max_workers=2)
+        data, errors = runner(self.query("etab2", timeout=0.02))
+        self.assertEqual(data, {"Plugin1": "p1ok1"})
+        self.assertIn("request deadline",
+                      errors["Plugin12"]["error_message"])
+        # the remaining time is given to the plugin
+        timeouts = self.plugin_timeouts()
+        self.assertEqual(len(timeouts), 1)
+        self.assertTrue(0 < timeouts[0] <= 0.02)
+
+    def test_deadline_shared_by_sequential_plugins(self):
+        data, errors = self.runner()(self.query("etab2", timeout=0.02))
+        self.assertEqual(data, {})
+        self.assertEqual(list(errors.keys()), ["Plugin12", "Plugin1"])
+
+    def test_runner_request_timeout(self):
+        runner = self.runner(request_timeout=0.02)
+        data, errors = runner(self.query("etab2"))
+        self.assertEqual(errors["Plugin12"]["error"], "PluginTimeoutError")
+        # the query timeout overrides the runner's
+        self.assertEqual(runner(self.query("etab2", timeout=1)),
+                         ({"Plugin12": "p12ok1", "Plugin1": "p1ok1"}, {}))
+
+    def test_no_timeout(self):
+        self.assertEqual(self.runner()(self.query("etab2")),
+                         ({"Plugin12": "p12ok1", "Plugin1": "p1ok1"}, {}))
+        self.assertEqual(self.plugin_timeouts(), [None])
+
+    def test_run_batch(self):
+        start = monotonic()
+        results = self.runner().run_batch([self.query(), self.query(),
+                                           self.query("etab2", timeout=0.02)])
+        self.assertLess(monotonic() - start, 0.4)
+        for data, errors in results[:2]:
+            self.assertEqual(data, {"Plugin1": "p1ok1"})
+            self.assertIn("within 0.1s", errors["Plugin12"]["error_message"])
+        self.assertIn("request deadline",
+                      results[2][1]["Plugin12"]["error_message"])
+
+    def test_stream(self):
+        start = monotonic()
+        stream = self.runner().stream(self.query())
+        self.assertEqual(list(stream), [("Plugin1", "p1ok1")])
+        # the plugin is not interrupted, its data is dropped
+        self.assertGreaterEqual(monotonic() - start, 0.5)
+        self.assertEqual(stream.errors["Plugin12"]["error"],
+                         "PluginTimeoutError")
+
+    def test_arun_timeouts(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        runner = self.runner()
+        data, errors = loop.run_until_complete(runner.arun(self.query()))
+        self.assertEqual(data, {"Plugin1": "p1ok1"})
+        self.assertEqual(errors["Plugin12"]["error"], "PluginTimeoutError")
+        data, errors = loop.run_until_complete(
+            runner.arun(self.query("etab2", "action2", timeout=0.02)))
+        self.assertIn("request deadline",
+                      errors["Plugin12"]["error_message"])
+        self.assertEqual(errors["Plugin1"]["error_message"],
+                         "error plugin 1 action 2 !")
+        data, errors = loop.run_until_complete(
+            runner.arun(self.query("etab2", "action2", timeout=1)))
+        self.assertEqual(data, {"Plugin12": "p12ok2"})
+        self.assertTrue(0 < self.plugin_timeouts()[-1] <= 1)
+
+    def plugin_timeouts(self):
+        return self.runners[-1].plugin_loader.get_plugin_class(
+            "Plugin12").timeouts
+
+
+if __name__ == '__main__':
+    main()